@@ -0,0 +1,111 @@
+"""
+Compare an analytics report over ORM objects with the columnar store.
+
+Usage (from octofit-tracker/backend):
+
+    python -m benchmarks.analytics --scale 200000
+
+Seeds ``--scale`` activities with ``generate_load`` (see benchmarks/run.py)
+and answers "average duration per activity type per team over the last
+30 days" three ways:
+
+- ``orm``: iterate ``Activity`` instances and sum them in Python, the way
+  a report built on model objects does;
+- ``columnar``: ``ActivityStore.summarize`` on columns already loaded;
+- ``columnar-load``: the initial load of the store from the database.
+
+Reports the best of ``--repeat`` timings and the peak Python memory
+traced while holding the rows, and checks that the answers agree.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta
+
+# Importing benchmarks.run configures Django with the benchmark settings.
+from benchmarks.run import ANCHOR, seed_database
+from django.core.management import call_command
+from django.utils import timezone
+
+from octofit_tracker.columnar import ActivityStore
+from octofit_tracker.models import Activity
+
+
+def orm_report(start):
+    """The report computed from model instances, all held in memory at once."""
+    activities = list(Activity.objects.filter(date__gte=start).exclude(team_id=None))
+    groups = defaultdict(lambda: [0, 0])
+    for activity in activities:
+        group = groups[(activity.team_id, activity.activity_type)]
+        group[0] += 1
+        group[1] += activity.duration
+    return {key: round(duration / count, 2) for key, (count, duration) in groups.items()}
+
+
+def columnar_report(store, start):
+    rows = store.summarize(('team_id', 'activity_type'), start=start)
+    return {(row['team_id'], row['activity_type']): row['avg_duration'] for row in rows}
+
+
+def measure(function, repeat):
+    """Best wall time over ``repeat`` calls, peak traced memory of one call, and its result."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time an analytics report on ORM objects and on NumPy columns.')
+    parser.add_argument('--scale', type=int, default=200000, help='Activities to seed')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per variant')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+    seed_database(args.scale, args.seed)
+    start = timezone.make_aware(datetime.combine(ANCHOR, dt_time.min)) - timedelta(days=30)
+
+    store = ActivityStore()
+    load_time, _, _ = measure(lambda: (store.reset(), store.refresh()), 1)
+    orm_time, orm_peak, expected = measure(lambda: orm_report(start), args.repeat)
+    columnar_time, _, answer = measure(lambda: columnar_report(store, start), args.repeat)
+    if answer != expected:
+        print('MISMATCH between the ORM and columnar reports')
+        return 1
+
+    results = {
+        'scale': args.scale,
+        'groups': len(answer),
+        'orm_s': round(orm_time, 4),
+        'orm_peak_bytes': orm_peak,
+        'columnar_s': round(columnar_time, 4),
+        'columnar_bytes': store.nbytes(),
+        'columnar_load_s': round(load_time, 4),
+        'speedup': round(orm_time / columnar_time, 1),
+        'memory_ratio': round(orm_peak / store.nbytes(), 1),
+    }
+    for key, value in results.items():
+        print(f'{key:>18} {value}')
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
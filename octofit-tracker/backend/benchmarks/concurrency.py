@@ -0,0 +1,187 @@
+"""
+Compare the WSGI and ASGI read paths under many concurrent slow clients.
+
+Usage (from octofit-tracker/backend):
+
+    python -m benchmarks.concurrency --clients 1000 --client-delay 0.2 --wsgi-threads 16
+
+Both applications are driven in-process, without a network server, against
+data seeded by ``generate_load`` (see benchmarks/run.py). Every client
+takes ``--client-delay`` seconds to read its response, like a phone on a
+poor connection.
+
+- ``wsgi``: a pool of ``--wsgi-threads`` threads, as in a threaded WSGI
+  server. A worker is blocked for as long as its client is reading.
+- ``asgi-sync``: every request starts at once on one event loop, against
+  the regular sync ViewSets. Django gives each one a thread.
+- ``asgi``: the same, against the ``/api/async/`` endpoints, which run
+  their database work on the ``ASYNC_DB_THREADS`` pool.
+
+Both ASGI modes use ``octofit_tracker.asgi.application``. Latency is
+measured from the moment all clients connect, so waiting for a free
+WSGI worker counts against it.
+
+Reports wall time, requests per second, p50/p99 latency and the peak
+number of live threads for each mode.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# Importing benchmarks.run configures Django with the benchmark settings.
+from benchmarks.run import percentile, seed_database
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import setup_test_environment
+
+PATHS = [
+    ('/api/activities/', 'page_size=20'),
+    ('/api/leaderboard/', 'top=10'),
+    ('/api/teams/', ''),
+]
+
+
+class ThreadPeak:
+    """Sample ``threading.active_count()`` in the background and keep the maximum."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def summarise(mode, latencies, elapsed, peak_threads, failures):
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'failures': failures,
+        'wall_s': round(elapsed, 3),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_threads': peak_threads,
+    }
+
+
+def run_wsgi(clients, delay, threads):
+    application = get_wsgi_application()
+    failures = []
+
+    def request(index):
+        path, query = PATHS[index % len(PATHS)]
+        statuses = []
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, 'wsgi.version': (1, 0),
+        }
+        body = application(environ, lambda status, headers: statuses.append(status))
+        for _ in body:
+            pass
+        # The worker thread stays busy while the slow client reads the response.
+        time.sleep(delay)
+        body.close()
+        if not statuses[0].startswith('200'):
+            failures.append(statuses[0])
+        # Every client connects at the start, so queueing for a worker counts.
+        return time.perf_counter() - started
+
+    with ThreadPeak() as peak:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(request, range(clients)))
+        elapsed = time.perf_counter() - started
+    return summarise(f'wsgi ({threads} threads)', latencies, elapsed, peak.peak, len(failures))
+
+
+def run_asgi(clients, delay, prefix, mode):
+    from octofit_tracker.asgi import application
+    failures = []
+
+    async def request(index):
+        path, query = PATHS[index % len(PATHS)]
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path.replace('/api/', prefix, 1), 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 40000 + index % 20000), 'server': ('testserver', 80),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start' and message['status'] != 200:
+                failures.append(message['status'])
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                # The slow client reads the response without holding a thread.
+                await asyncio.sleep(delay)
+
+        await application(scope, receive, send)
+        return time.perf_counter() - started
+
+    async def main():
+        return await asyncio.gather(*(request(index) for index in range(clients)))
+
+    with ThreadPeak() as peak:
+        started = time.perf_counter()
+        latencies = asyncio.run(main())
+        elapsed = time.perf_counter() - started
+    return summarise(mode, latencies, elapsed, peak.peak, len(failures))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI under concurrent slow clients.')
+    parser.add_argument('--scale', type=int, default=10000, help='Activities to seed')
+    parser.add_argument('--clients', type=int, default=1000, help='Concurrent clients')
+    parser.add_argument('--client-delay', type=float, default=0.2,
+                        help='Seconds each client takes to read its response')
+    parser.add_argument('--wsgi-threads', type=int, default=16, help='Worker threads for the WSGI path')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    seed_database(args.scale, args.seed)
+
+    results = [
+        run_wsgi(args.clients, args.client_delay, args.wsgi_threads),
+        run_asgi(args.clients, args.client_delay, '/api/', 'asgi-sync'),
+        run_asgi(args.clients, args.client_delay, '/api/async/', 'asgi'),
+    ]
+    for result in results:
+        print(f'{result["mode"]:<20} {result["wall_s"]:>7.2f}s {result["requests_per_s"]:>8.1f} req/s '
+              f'p50={result["p50_ms"]:>8.1f}ms p99={result["p99_ms"]:>8.1f}ms '
+              f'threads={result["peak_threads"]:>5} failures={result["failures"]}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'clients': args.clients, 'client_delay': args.client_delay, 'results': results},
+                      output, indent=2)
+            output.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
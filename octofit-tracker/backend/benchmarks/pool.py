@@ -0,0 +1,173 @@
+"""
+Load test for the MongoDB connection pool.
+
+Usage (from octofit-tracker/backend, against a running MongoDB seeded with
+``python manage.py generate_load``):
+
+    python -m benchmarks.pool --concurrency 8,64,256 --requests 4000
+
+Unlike the other benchmarks this runs on the project settings, since the
+pool only exists on MongoDB. Each concurrency level drives the WSGI
+application from that many threads at once, like one worker process of a
+threaded server, and samples ``octofit_tracker.mongo.metrics`` meanwhile.
+
+Reports requests per second, p50/p99 latency, the peak number of
+connections checked out and of requests waiting for one, and the
+connections created, closed and timed out during the level. The pool is
+stable when no checkout fails and no more than ``maxPoolSize``
+connections are open. Nothing may be closed either: connections closed
+and reopened under load mean churn. Exits with status 1 if any level is
+unstable.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+
+# Importing benchmarks.run sets Django up with the settings chosen above.
+from benchmarks.run import percentile  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from octofit_tracker.mongo import metrics  # noqa: E402
+
+PATHS = [
+    ('/api/activities/', 'page_size=20'),
+    ('/api/users/', 'page_size=20'),
+    ('/api/leaderboard/', 'top=10'),
+    ('/api/activities/', 'page_size=20&ordering=date'),
+]
+
+
+def get(application, path, query):
+    statuses = []
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+    body = application(environ, lambda status, headers: statuses.append(status))
+    for _ in body:
+        pass
+    body.close()
+    return statuses[0]
+
+
+class PoolSampler:
+    """Poll the pool metrics in the background and keep the highs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_checked_out = 0
+        self.peak_waiting = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            snapshot = metrics.snapshot()
+            self.peak_checked_out = max(self.peak_checked_out, snapshot['checked_out'])
+            self.peak_waiting = max(self.peak_waiting, snapshot['waiting'])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_level(application, concurrency, requests):
+    failures = []
+    before = metrics.snapshot()
+
+    def request(index):
+        path, query = PATHS[index % len(PATHS)]
+        started = time.perf_counter()
+        status = get(application, path, query)
+        if not status.startswith('200'):
+            failures.append(status)
+        return time.perf_counter() - started
+
+    with PoolSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(request, range(requests)))
+        elapsed = time.perf_counter() - started
+    after = metrics.snapshot()
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'http_failures': len(failures),
+        'requests_per_s': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_checked_out': sampler.peak_checked_out,
+        'peak_waiting': sampler.peak_waiting,
+        'created': after['created'] - before['created'],
+        'closed': after['closed'] - before['closed'],
+        'open': after['open'],
+        'checkout_failures': after['checkout_failures'] - before['checkout_failures'],
+    }
+
+
+def problems(results, max_pool_size):
+    """Describe every way the results show an unstable pool."""
+    found = []
+    for result in results:
+        level = f'concurrency {result["concurrency"]}'
+        if result['checkout_failures']:
+            found.append(f'{level}: {result["checkout_failures"]} checkouts timed out')
+        if max(result['peak_checked_out'], result['open']) > max_pool_size:
+            found.append(f'{level}: more than maxPoolSize={max_pool_size} connections in use')
+        if result['closed']:
+            found.append(f'{level}: {result["closed"]} connections closed and {result["created"]} created')
+        if result['http_failures']:
+            found.append(f'{level}: {result["http_failures"]} requests failed')
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that the MongoDB pool stays stable under load.')
+    parser.add_argument('--concurrency', default='8,64,256', help='Comma-separated thread counts')
+    parser.add_argument('--requests', type=int, default=4000, help='Requests per concurrency level')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    if connection.vendor != 'djongo':
+        print('benchmarks.pool needs the MongoDB settings (DJANGO_SETTINGS_MODULE=octofit_tracker.settings)')
+        return 2
+    max_pool_size = settings.DATABASES['default']['CLIENT'].get('maxPoolSize', 100)
+    application = get_wsgi_application()
+    results = []
+    for concurrency in (int(level) for level in args.concurrency.split(',')):
+        result = run_level(application, concurrency, args.requests)
+        results.append(result)
+        print(f'{concurrency:>5} threads {result["requests_per_s"]:>8.1f} req/s '
+              f'p50={result["p50_ms"]:>7.1f}ms p99={result["p99_ms"]:>7.1f}ms '
+              f'checked_out<={result["peak_checked_out"]:>3} waiting<={result["peak_waiting"]:>4} '
+              f'created={result["created"]:>3} closed={result["closed"]:>3} open={result["open"]:>3} '
+              f'timeouts={result["checkout_failures"]}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'max_pool_size': max_pool_size, 'results': results}, output, indent=2)
+            output.write('\n')
+    found = problems(results, max_pool_size)
+    for problem in found:
+        print(f'UNSTABLE {problem}')
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
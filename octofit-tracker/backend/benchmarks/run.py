@@ -0,0 +1,283 @@
+"""
+Benchmark every API ViewSet action at several dataset sizes.
+
+Usage (from octofit-tracker/backend):
+
+    python -m benchmarks.run --scales 1000,100000,1000000 --output results.json
+    python -m benchmarks.run --scales 1000 --compare benchmarks/baseline.json
+
+Each scale is seeded with ``generate_load`` into a throwaway SQLite
+database (see benchmarks/settings.py). Then list, retrieve, create, update
+and delete are timed on every ViewSet through the Django test client,
+recording p50/p99 latency, queries per request and peak Python memory.
+``--compare`` flags p50 latency, peak memory or query counts that are
+worse than the baseline (beyond ``--tolerance`` for latency and memory)
+and exits with status 1.
+
+Baseline numbers depend on the machine. Regenerate
+benchmarks/baseline.json on the machine that runs the comparison.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date
+from io import StringIO
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import caches  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+
+from octofit_tracker.models import Activity, Leaderboard, Team, User, Workout  # noqa: E402
+
+ACTIVITIES_PER_USER = 50
+# Fixed so every run seeds identical data.
+ANCHOR = date(2026, 1, 31)
+
+ENDPOINTS = {
+    'users': User,
+    'teams': Team,
+    'activities': Activity,
+    'leaderboard': Leaderboard,
+    'workouts': Workout,
+}
+
+
+def payload(endpoint, n, user_ids):
+    """Request body for creating (or updating) object ``n`` of ``endpoint``."""
+    if endpoint == 'users':
+        return {'name': f'Bench {n}', 'email': f'bench{n}@bench.test', 'password': 'pw', 'team_id': 1}
+    if endpoint == 'teams':
+        return {'name': f'Bench Team {n}', 'description': 'benchmark'}
+    if endpoint == 'activities':
+        return {
+            'user_id': random.choice(user_ids), 'activity_type': 'Running', 'duration': 30 + n % 60,
+            'distance': 5.0, 'calories': 300 + n, 'date': '2026-01-15T08:00:00Z',
+        }
+    if endpoint == 'leaderboard':
+        return {'user_id': 10_000_000 + n, 'team_id': 1, 'total_calories': n, 'rank': 0}
+    return {
+        'name': f'Bench Workout {n}', 'description': 'benchmark', 'activity_type': 'Yoga',
+        'difficulty': 'Easy', 'duration': 30, 'calories_per_session': 200,
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(requests, warm_cache):
+    """
+    Run ``requests`` (callables returning a response) and summarise them.
+
+    Latency and query counts come from one pass and peak memory from a
+    second, traced pass, so tracing overhead does not skew the timings.
+    """
+    latencies, queries = [], []
+    # Collector pauses would otherwise land on whichever request triggers them.
+    gc.collect()
+    gc.disable()
+    try:
+        for request in requests['timed']:
+            if not warm_cache:
+                caches['api'].clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{response.status_code}: {response.content[:200]!r}')
+            queries.append(len(captured))
+    finally:
+        gc.enable()
+
+    peaks = []
+    for request in requests['traced']:
+        if not warm_cache:
+            caches['api'].clear()
+        tracemalloc.start()
+        request()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries': max(queries),
+        'peak_kib': round(max(peaks) / 1024, 1),
+    }
+
+
+def bench_endpoint(client, endpoint, model, repeat, warm_cache, user_ids, counter):
+    url = f'/api/{endpoint}/'
+    ids = list(model.objects.order_by('?').values_list('id', flat=True)[:repeat])
+    if not ids:
+        ids = [client.post(url, payload(endpoint, next(counter), user_ids), content_type='application/json').data['id']]
+
+    def bodies(count):
+        return [payload(endpoint, next(counter), user_ids) for _ in range(count)]
+
+    results = {}
+    results['list'] = measure({
+        'timed': [lambda: client.get(url)] * repeat,
+        'traced': [lambda: client.get(url)] * 3,
+    }, warm_cache)
+    results['retrieve'] = measure({
+        'timed': [lambda pk=pk: client.get(f'{url}{pk}/') for pk in (ids * repeat)[:repeat]],
+        'traced': [lambda: client.get(f'{url}{ids[0]}/')] * 3,
+    }, warm_cache)
+
+    created = []
+
+    def create(body):
+        response = client.post(url, body, content_type='application/json')
+        created.append(response.data['id'])
+        return response
+
+    results['create'] = measure({
+        'timed': [lambda body=body: create(body) for body in bodies(repeat)],
+        'traced': [lambda body=body: create(body) for body in bodies(3)],
+    }, warm_cache)
+    results['update'] = measure({
+        'timed': [
+            lambda pk=pk, body=body: client.put(f'{url}{pk}/', body, content_type='application/json')
+            for pk, body in zip(created[:repeat], bodies(repeat))
+        ],
+        'traced': [
+            lambda pk=pk, body=body: client.put(f'{url}{pk}/', body, content_type='application/json')
+            for pk, body in zip(created[repeat:], bodies(3))
+        ],
+    }, warm_cache)
+    results['delete'] = measure({
+        'timed': [lambda pk=pk: client.delete(f'{url}{pk}/') for pk in created[:repeat]],
+        'traced': [lambda pk=pk: client.delete(f'{url}{pk}/') for pk in created[repeat:]],
+    }, warm_cache)
+    return results
+
+
+def seed_database(scale, seed):
+    """Replace the benchmark database contents with ``scale`` generated activities."""
+    users = max(scale // ACTIVITIES_PER_USER, 1)
+    call_command(
+        'generate_load', users=users, teams=max(users // 50, 1),
+        activities_per_user=max(scale // users, 1), seed=seed, anchor=ANCHOR, stdout=StringIO(),
+    )
+
+
+def run_scale(scale, repeat, warm_cache, seed):
+    seed_database(scale, seed)
+    random.seed(seed)
+    user_ids = list(User.objects.values_list('id', flat=True)[:1000])
+    counter = iter(range(10 ** 9))
+    client = Client()
+    results = {}
+    for endpoint, model in ENDPOINTS.items():
+        for action, metrics in bench_endpoint(
+            client, endpoint, model, repeat, warm_cache, user_ids, counter
+        ).items():
+            name = f'{endpoint}.{action}'
+            results[name] = metrics
+            print(f'  {name:<22} p50={metrics["p50_ms"]:>8.2f}ms '
+                  f'p99={metrics["p99_ms"]:>8.2f}ms queries={metrics["queries"]:>3} '
+                  f'peak={metrics["peak_kib"]:>9.1f}KiB')
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms=5.0, check_p99=False):
+    """
+    Return human-readable regressions of ``results`` against ``baseline``.
+
+    Latencies must also be at least ``min_delta_ms`` slower, so scheduler
+    jitter on millisecond requests is not reported. p99 is recorded but
+    only checked with ``check_p99``: with tens of samples it is close to
+    the maximum and too noisy to gate on by default.
+    """
+    regressions = []
+    for scale, actions in results['scales'].items():
+        for name, metrics in actions.items():
+            expected = baseline.get('scales', {}).get(scale, {}).get(name)
+            if expected is None:
+                continue
+            for metric in ('p50_ms', 'p99_ms', 'peak_kib'):
+                if metric == 'p99_ms' and not check_p99:
+                    continue
+                limit = expected[metric] * (1 + tolerance)
+                if metric.endswith('_ms'):
+                    limit = max(limit, expected[metric] + min_delta_ms)
+                if metrics[metric] > limit:
+                    regressions.append(
+                        f'{scale} {name} {metric}: {metrics[metric]} > {expected[metric]} (+{tolerance:.0%})'
+                    )
+            if metrics['queries'] > expected['queries']:
+                regressions.append(f'{scale} {name} queries: {metrics["queries"]} > {expected["queries"]}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the octofit API ViewSets.')
+    parser.add_argument('--scales', default='1000,100000,1000000',
+                        help='Comma-separated activity counts to seed')
+    parser.add_argument('--repeat', type=int, default=50, help='Requests per action')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='Keep the response cache between requests instead of clearing it')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Baseline JSON to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                        help='Ignore latency increases smaller than this many milliseconds')
+    parser.add_argument('--check-p99', action='store_true',
+                        help='Also flag p99 regressions (use a large --repeat)')
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'warm_cache': args.warm_cache,
+        },
+        'scales': {},
+    }
+    for scale in (int(value) for value in args.scales.split(',')):
+        print(f'Scale: {scale} activities')
+        results['scales'][str(scale)] = run_scale(scale, args.repeat, args.warm_cache, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(
+                results, json.load(baseline_file), args.tolerance, args.min_delta_ms, args.check_p99
+            )
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('No regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
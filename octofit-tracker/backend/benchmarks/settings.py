@@ -0,0 +1,24 @@
+"""
+Settings for the benchmark suite.
+
+Same as the project settings, but backed by a throwaway SQLite database
+so benchmarks can run anywhere without a MongoDB server.
+"""
+import os
+import tempfile
+
+from octofit_tracker.settings import *  # noqa: F401,F403
+from octofit_tracker.settings import INSTALLED_APPS
+
+DEBUG = False
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'djongo']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get(
+            'OCTOFIT_BENCH_DB', os.path.join(tempfile.gettempdir(), 'octofit_bench.sqlite3')
+        ),
+    }
+}
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, Workout, UserDailyStats, TeamDailyStats, Job, ActivityArchive
 
 
 @admin.register(User)
@@ -38,3 +38,30 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_filter = ['activity_type', 'difficulty']
     search_fields = ['name', 'description']
     ordering = ['name']
+
+
+@admin.register(UserDailyStats)
+class UserDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user_id', 'day', 'activity_count', 'duration_sum', 'distance_sum', 'calories_sum']
+    list_filter = ['day']
+    ordering = ['-day']
+
+
+@admin.register(TeamDailyStats)
+class TeamDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['id', 'team_id', 'day', 'activity_count', 'duration_sum', 'distance_sum', 'calories_sum']
+    list_filter = ['team_id', 'day']
+    ordering = ['-day']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'attempts', 'worker', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    ordering = ['-created_at']
+
+
+@admin.register(ActivityArchive)
+class ActivityArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'month', 'row_count', 'size_bytes', 'path', 'created_at']
+    ordering = ['-month']
@@ -0,0 +1,198 @@
+"""
+Group-by queries that run as native MongoDB aggregation pipelines.
+
+djongo's SQL translation cannot express ``GROUP BY`` with sums efficiently,
+so on MongoDB these functions send ``$match``/``$group``/``$sort`` (and
+``$setWindowFields`` for ranking) pipelines straight through pymongo. On
+any other backend they use the equivalent ORM ``annotate()`` queries.
+Every function takes an optional ``db`` so a pymongo-compatible database,
+such as a mongomock one, can be used in place of the default connection.
+Pipelines run with ``allowDiskUse``: at a million users the ``$group`` and
+``$sort`` stages outgrow MongoDB's 100MB per-stage memory limit.
+"""
+from django.db import connection
+from django.db.models import Count, Sum
+from pymongo.errors import OperationFailure
+
+from .models import Activity
+
+
+def mongo_database():
+    """Return the pymongo database behind the default connection, or None off MongoDB."""
+    if connection.vendor != 'djongo':
+        return None
+    connection.ensure_connection()
+    return connection.connection
+
+
+# The error MongoDB raises for a stage it does not know, e.g. $setWindowFields before 5.0.
+UNRECOGNIZED_STAGE = 40324
+
+
+def _activities(db):
+    return db[Activity._meta.db_table]
+
+
+def _aggregate(db, pipeline):
+    return _activities(db).aggregate(pipeline, allowDiskUse=True)
+
+
+def _match(user_id=None, team_id=None, activity_type=None, start=None, end=None):
+    """Build a ``$match`` stage; ``start`` is inclusive and ``end`` exclusive."""
+    match = {}
+    if user_id is not None:
+        match['user_id'] = user_id
+    if team_id is not None:
+        match['team_id'] = team_id
+    if activity_type is not None:
+        match['activity_type'] = activity_type
+    if start is not None or end is not None:
+        match['date'] = {}
+        if start is not None:
+            match['date']['$gte'] = start
+        if end is not None:
+            match['date']['$lt'] = end
+    return match
+
+
+def _filter(user_id=None, team_id=None, activity_type=None, start=None, end=None):
+    activities = Activity.objects.all()
+    if user_id is not None:
+        activities = activities.filter(user_id=user_id)
+    if team_id is not None:
+        activities = activities.filter(team_id=team_id)
+    if activity_type is not None:
+        activities = activities.filter(activity_type=activity_type)
+    if start is not None:
+        activities = activities.filter(date__gte=start)
+    if end is not None:
+        activities = activities.filter(date__lt=end)
+    return activities
+
+
+_SUM_STAGE = {
+    'total_calories': {'$sum': '$calories'},
+    'total_duration': {'$sum': '$duration'},
+    'total_distance': {'$sum': '$distance'},
+    'activity_count': {'$sum': 1},
+}
+
+
+def _orm_sums(activities, key):
+    return activities.values(key).annotate(
+        total_calories=Sum('calories'),
+        total_duration=Sum('duration'),
+        total_distance=Sum('distance'),
+        activity_count=Count('id'),
+    ).order_by()
+
+
+def _row(**values):
+    # $sum over no distances gives 0 on MongoDB but Sum() gives NULL in SQL.
+    values['total_distance'] = round(values['total_distance'] or 0.0, 2)
+    return values
+
+
+def user_totals(start=None, end=None, db=None):
+    """
+    Sum calories, duration and distance per user.
+
+    Returns ``{user_id: {'total_calories': ..., 'total_duration': ...,
+    'total_distance': ..., 'activity_count': ...}}``.
+    """
+    db = mongo_database() if db is None else db
+    if db is None:
+        rows = _orm_sums(_filter(start=start, end=end), 'user_id')
+        return {row.pop('user_id'): _row(**row) for row in rows}
+
+    pipeline = [
+        {'$match': _match(start=start, end=end)},
+        {'$group': {'_id': '$user_id', **_SUM_STAGE}},
+    ]
+    return {row.pop('_id'): _row(**row) for row in _aggregate(db, pipeline)}
+
+
+def ranked_user_totals(db=None):
+    """
+    Per-user totals ranked the way the leaderboard orders them.
+
+    Returns a list of ``(user_id, totals, rank)`` sorted by rank, with
+    ranks dense and ordered by total calories descending, then user id.
+    On MongoDB 5.0+ the ranks come from ``$setWindowFields``; older
+    servers sort in the pipeline and are numbered here.
+    """
+    db = mongo_database() if db is None else db
+    if db is None:
+        totals = user_totals()
+        ordered = sorted(totals, key=lambda user_id: (-totals[user_id]['total_calories'], user_id))
+        return [(user_id, totals[user_id], rank) for rank, user_id in enumerate(ordered, start=1)]
+
+    group = {'$group': {'_id': '$user_id', **_SUM_STAGE}}
+    order = {'total_calories': -1, '_id': 1}
+    try:
+        rows = list(_aggregate(db, [
+            group,
+            {'$setWindowFields': {'sortBy': order, 'output': {'rank': {'$documentNumber': {}}}}},
+            {'$sort': {'rank': 1}},
+        ]))
+    except (OperationFailure, NotImplementedError) as exc:
+        # $setWindowFields needs MongoDB 5.0; stand-ins may not implement it at all.
+        # Any other failure, such as a memory limit, would fail the fallback too.
+        if isinstance(exc, OperationFailure) and exc.code != UNRECOGNIZED_STAGE:
+            raise
+        rows = list(_aggregate(db, [group, {'$sort': order}]))
+        for rank, row in enumerate(rows, start=1):
+            row['rank'] = rank
+    return [(row.pop('_id'), _row(**{key: row[key] for key in _SUM_STAGE}), row['rank']) for row in rows]
+
+
+def team_totals(start=None, end=None, db=None):
+    """
+    Sum activity totals per team, highest total calories first.
+
+    Groups on the team_id denormalized onto each activity, so no join
+    through users is needed; activities of users without a team are left
+    out. Returns a list of dicts with ``team_id``, the totals,
+    ``activity_count`` and ``member_count`` (the number of members with at
+    least one activity in range).
+    """
+    db = mongo_database() if db is None else db
+    if db is None:
+        rows = _orm_sums(_filter(start=start, end=end).exclude(team_id=None), 'team_id').annotate(
+            member_count=Count('user_id', distinct=True)
+        )
+        return sorted((_row(**row) for row in rows), key=lambda row: (-row['total_calories'], row['team_id']))
+
+    match = _match(start=start, end=end)
+    match['team_id'] = {'$ne': None}
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': '$team_id', **_SUM_STAGE, 'members': {'$addToSet': '$user_id'}}},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    return [
+        _row(team_id=row.pop('_id'), member_count=len(row.pop('members')), **row)
+        for row in _aggregate(db, pipeline)
+    ]
+
+
+def type_breakdown(user_id=None, team_id=None, start=None, end=None, db=None):
+    """
+    Sum activity totals per activity type, highest total calories first.
+
+    Narrow it to one user or one team with ``user_id`` or ``team_id``.
+    """
+    db = mongo_database() if db is None else db
+    if db is None:
+        rows = [
+            _row(**row)
+            for row in _orm_sums(_filter(user_id, team_id, start=start, end=end), 'activity_type')
+        ]
+        return sorted(rows, key=lambda row: (-row['total_calories'], row['activity_type']))
+
+    pipeline = [
+        {'$match': _match(user_id, team_id, start=start, end=end)},
+        {'$group': {'_id': '$activity_type', **_SUM_STAGE}},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    return [_row(activity_type=row.pop('_id'), **row) for row in _aggregate(db, pipeline)]
@@ -0,0 +1,111 @@
+"""
+Archival of cold activity partitions.
+
+:func:`archive_month` writes one month of activities to a gzip-compressed
+NDJSON file under ``ACTIVITY_ARCHIVE_DIR``. The rows have the fields the
+export endpoint streams. The month's rollups are recomputed from exactly
+those rows, then the rows are deleted from ``activities`` and the month is
+recorded in ``ActivityArchive``. The ``Activity`` version is bumped so
+in-memory copies of the table reload. The leaderboard is left alone, since its
+all-time totals already count the archived rows. :func:`archived_rows`
+streams them back for a date range, opening only the files it touches.
+"""
+import gzip
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .encoders import RowEncoder
+from .caching import bump_version
+from .models import Activity, ActivityArchive, delete_all
+from .partitions import archives_for, month_bounds, month_start, next_month
+from .renderers import ndjson_line
+from .rollups import rebuild_rollups
+from .serializers import ActivitySerializer
+
+
+def archive_dir():
+    return Path(settings.ACTIVITY_ARCHIVE_DIR)
+
+
+def read_archive(archive):
+    """Yield the activity dicts stored in an ``ActivityArchive``'s file, oldest first."""
+    with gzip.open(archive_dir() / archive.path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def archived_rows(start=None, end=None):
+    """Yield the archived activity dicts dated in ``[start, end)``, oldest first."""
+    for archive in archives_for(start, end):
+        for row in read_archive(archive):
+            if start is None and end is None:
+                yield row
+                continue
+            date = parse_datetime(row['date'])
+            if (start is None or date >= start) and (end is None or date < end):
+                yield row
+
+
+def archivable_months(cutoff):
+    """First days of the months with activities, up to the month holding ``cutoff``."""
+    oldest = Activity.objects.order_by('date').values_list('date', flat=True).first()
+    if oldest is None:
+        return []
+    month = month_start(timezone.localdate(oldest))
+    end = month_start(cutoff)
+    months = []
+    while month < end:
+        start, stop = month_bounds(month)
+        if Activity.objects.filter(date__gte=start, date__lt=stop).exists():
+            months.append(month)
+        month = next_month(month)
+    return months
+
+
+def archive_month(month, chunk_size=None):
+    """
+    Move one month of activities into its archive file and return the archive row.
+
+    A month archived before, which has since gained rows written around
+    the API's validation, is rewritten with the old and the new rows.
+    """
+    chunk_size = chunk_size or settings.ACTIVITY_EXPORT_CHUNK_SIZE
+    start, end = month_bounds(month)
+    activities = Activity.objects.filter(date__gte=start, date__lt=end)
+    existing = ActivityArchive.objects.filter(month=month).first()
+    encoder = RowEncoder.for_serializer(ActivitySerializer)
+
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f'activities-{month:%Y-%m}.ndjson.gz'
+    partial = directory / f'{name}.partial'
+    count = 0
+    with gzip.open(partial, 'wt', encoding='utf-8') as output:
+        if existing is not None:
+            for row in read_archive(existing):
+                output.write(ndjson_line(row))
+                count += 1
+        for row in encoder.iter_rows(activities.order_by('date', 'id'), chunk_size=chunk_size):
+            output.write(ndjson_line(row))
+            count += 1
+    os.replace(partial, directory / name)
+
+    if existing is None:
+        # Make sure the rollups that stand in for these rows match them.
+        rebuild_rollups(month, next_month(month))
+    with transaction.atomic():
+        archive, _ = ActivityArchive.objects.update_or_create(month=month, defaults={
+            'path': name, 'row_count': count, 'size_bytes': (directory / name).stat().st_size,
+        })
+        # One DELETE, like reseeding: a collector delete would load the
+        # whole month to send a signal per row.
+        delete_all(activities)
+    # Nothing is logged per row, so in-memory copies of the table reload.
+    bump_version(Activity)
+    return archive
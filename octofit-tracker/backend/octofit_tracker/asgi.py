@@ -9,8 +9,41 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+# Coroutine endpoints (async_views.py) run their blocking work on their own
+# bounded thread pool.
+ASYNC_PATH_PREFIX = '/api/async/'
+
+
+class OctofitASGIHandler(ASGIHandler):
+    """
+    Django's ASGI handler, minus the per-request thread for async endpoints.
+
+    Django opens a thread-sensitive context for every request, which gives
+    each in-flight request a thread of its own until its response is sent.
+    Requests under ASYNC_PATH_PREFIX skip it, so their few sync calls
+    (request signals) share Django's single sync thread instead and a slow
+    client costs no thread at all. The live leaderboard stream is a plain
+    ASGI app and bypasses the view layer entirely.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == live.STREAM_PATH:
+            await live.leaderboard_stream(scope, receive, send)
+        elif scope['type'] == 'http' and scope['path'].startswith(ASYNC_PATH_PREFIX):
+            await self.handle(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+
+django.setup(set_prefix=False)
+
+from octofit_tracker import live, snapshot  # noqa: E402  (needs the app registry)
+
+application = OctofitASGIHandler()
+# Map the snapshot, if one has been built, before the first request.
+snapshot.warm()
@@ -0,0 +1,82 @@
+"""
+Async read endpoints for the ASGI application.
+
+Under ASGI, Django gives every request that reaches a sync view a thread
+of its own until the response is sent, and pymongo has no async API. These
+views instead hand the blocking work (the regular DRF list/retrieve,
+including its cache, filters and keyset pagination) to a bounded pool of
+``ASYNC_DB_THREADS`` threads and await it. A slow client then holds only a
+coroutine while its response is sent, and the number of concurrent
+database operations stays capped however many requests are in flight.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .views import ActivityViewSet, LeaderboardViewSet, TeamViewSet
+
+_executors = {}
+
+
+def _executor():
+    size = settings.ASYNC_DB_THREADS
+    if size not in _executors:
+        _executors[size] = ThreadPoolExecutor(max_workers=size, thread_name_prefix='octofit-db')
+    return _executors[size]
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads never see request_finished, so apply CONN_MAX_AGE here.
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run ``func`` on the bounded database thread pool and await its result.
+
+    With ``ASYNC_DB_THREADS = 0`` it runs on Django's thread-sensitive
+    executor instead, which keeps test transactions visible.
+    """
+    if not settings.ASYNC_DB_THREADS:
+        return await sync_to_async(func)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    # Carry context variables (e.g. the request's instrumentation) into the pool thread.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor(), partial(context.run, _call, func, args, kwargs))
+
+
+def _rendered(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    # Render in the pool too: encoding a large page is CPU work.
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def async_endpoint(viewset_class, actions):
+    """Wrap a ViewSet's read actions in a coroutine view that runs them on the pool."""
+    view = viewset_class.as_view(actions)
+
+    async def endpoint(request, *args, **kwargs):
+        return await run_blocking(_rendered, view, request, *args, **kwargs)
+
+    endpoint.csrf_exempt = True
+    endpoint.__name__ = f'async_{viewset_class.__name__}'
+    endpoint.__doc__ = viewset_class.__doc__
+    return endpoint
+
+
+activity_list = async_endpoint(ActivityViewSet, {'get': 'list'})
+activity_detail = async_endpoint(ActivityViewSet, {'get': 'retrieve'})
+leaderboard_list = async_endpoint(LeaderboardViewSet, {'get': 'list'})
+leaderboard_detail = async_endpoint(LeaderboardViewSet, {'get': 'retrieve'})
+team_list = async_endpoint(TeamViewSet, {'get': 'list'})
+team_detail = async_endpoint(TeamViewSet, {'get': 'retrieve'})
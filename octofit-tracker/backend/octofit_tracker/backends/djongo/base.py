@@ -0,0 +1,28 @@
+"""
+djongo, with the MongoDB client taken from the per-process pool in mongo.py.
+
+Set ``READ_PREFERENCE`` on a database alias (e.g. ``secondaryPreferred``)
+to read through it with that preference. The pool is still shared with
+the other aliases.
+"""
+from djongo import base
+
+from octofit_tracker.mongo import get_client, read_preference
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, connection_params):
+        name = connection_params.pop('name')
+        enforce_schema = connection_params.pop('enforce_schema')
+        self.client_connection = get_client(**connection_params)
+        database = self.client_connection.get_database(
+            name, read_preference=read_preference(self.settings_dict.get('READ_PREFERENCE'))
+        )
+        self.djongo_connection = base.DjongoClient(database, enforce_schema)
+        return database
+
+    def _close(self):
+        # The client and its pool live as long as the process; checked-out
+        # sockets are returned to the pool after every operation.
+        pass
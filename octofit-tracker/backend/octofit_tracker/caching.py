@@ -0,0 +1,149 @@
+"""
+Versioned response cache for read-heavy endpoints.
+
+Each cached model has a version counter that is bumped whenever one of its
+rows is saved or deleted. Cache keys and ETags embed the current version,
+so a write invalidates every cached response for that model at once and
+nothing has to be deleted or scanned.
+
+The counters are ``ModelVersion`` rows in the database, incremented in
+place (``$inc`` on MongoDB, an ``F()`` update elsewhere), so a write in
+one worker invalidates the responses every other worker cached. Only the
+response bodies live in the ``api`` cache, which may be per-process.
+The version functions also take a plain name for counters that other
+processes watch, such as ranking.REBUILDS.
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .aggregation import mongo_database
+from .models import ModelVersion
+
+CACHE_ALIAS = 'api'
+
+_deferred = ContextVar('octofit_deferred_bumps', default=None)
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_name(model):
+    # Counters that stand for something other than a model's rows go by name.
+    return model if isinstance(model, str) else model._meta.label_lower
+
+
+def _create_version(name):
+    """Insert the counter for ``name``; returns its version, or None if another writer got there first."""
+    from .idempotency import is_duplicate
+    # Start from a clock value rather than 1 so a counter that is ever
+    # deleted cannot come back at a version with cached responses under it.
+    version = time.time_ns()
+    try:
+        with transaction.atomic():
+            ModelVersion.objects.create(name=name, version=version)
+    except DatabaseError as exc:
+        if not is_duplicate(exc):
+            raise
+        return None
+    return version
+
+
+def model_versions(*models):
+    """The current version of each of ``models``, read in one query."""
+    names = [_version_name(model) for model in models]
+    stored = dict(ModelVersion.objects.filter(name__in=names).values_list('name', 'version'))
+    for name in names:
+        if name not in stored:
+            stored[name] = _create_version(name) or ModelVersion.objects.get(name=name).version
+    return [stored[name] for name in names]
+
+
+def model_version(model):
+    return model_versions(model)[0]
+
+
+def bump_version(model):
+    """Invalidate every cached response that depends on ``model``, in every process."""
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.add(model)
+        return
+    name = _version_name(model)
+    db = mongo_database()
+    if db is not None:
+        # djongo cannot translate ``SET version = version + 1``; use $inc directly.
+        updated = db[ModelVersion._meta.db_table].update_one({'name': name}, {'$inc': {'version': 1}}).matched_count
+    else:
+        updated = ModelVersion.objects.filter(name=name).update(version=F('version') + 1)
+    if not updated and _create_version(name) is None:
+        bump_version(model)
+
+
+@contextmanager
+def deferred_bumps():
+    """Bump each model written inside the block once, when it ends, instead of once per row."""
+    if _deferred.get() is not None:
+        yield
+        return
+    models = set()
+    token = _deferred.set(models)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        for model in sorted(models, key=_version_name):
+            bump_version(model)
+
+
+class CachedResponseMixin:
+    """
+    Serve ``list`` and ``retrieve`` from the ``api`` cache.
+
+    Responses carry an ETag derived from the model versions and the request
+    URL; a matching ``If-None-Match`` gets a 304 before any query runs.
+    Set ``cache_models`` when a view depends on more than its own model.
+    """
+    cache_models = None
+
+    def get_cache_models(self):
+        return self.cache_models or (self.get_queryset().model,)
+
+    def cache_tag(self, request):
+        versions = ':'.join(str(version) for version in model_versions(*self.get_cache_models()))
+        return hashlib.md5(
+            f'{versions}:{request.build_absolute_uri()}'.encode(), usedforsecurity=False
+        ).hexdigest()
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        tag = self.cache_tag(request)
+        etag = f'"{tag}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        key = f'octofit:response:{tag}'
+        data = _cache().get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            _cache().set(key, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
@@ -0,0 +1,95 @@
+"""
+A shared log of activity writes for in-memory state to follow.
+
+The window rankings and the columnar store are held in each process.
+Every activity write made through the ORM or :func:`ingest.insert_activities`
+adds an :class:`ActivityChange` row: the activity, its date (and its date
+before an update) or, for a team move, the user's new team. Bulk inserts
+log one row per bucket of dates rather than one per activity. A
+:class:`ChangeCursor` reads the rows other processes added since its last
+read, so a worker patches only what changed instead of reloading.
+
+Rows are stamped by the writer's clock at save time and become visible at
+commit, so an older stamp can appear after a newer one has been read.
+Each read therefore reaches ``ACTIVITY_CHANGES_SETTLE_SECONDS`` back and
+skips the rows it has already returned. Rows older than
+``ACTIVITY_CHANGES_RETENTION_SECONDS`` are pruned; a cursor that has not
+read for that long returns None and its owner reloads.
+
+Wholesale replacements (reseeding, archiving a month) are not logged; they
+bump the ``Activity`` version instead.
+"""
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ActivityChange, delete_all
+
+# Monotonic time of the next prune in this process.
+_next_prune = time.monotonic() + settings.ACTIVITY_CHANGES_RETENTION_SECONDS / 24
+
+
+def log_activity(op, activity, previous=None):
+    """Log an insert, update or delete of one activity."""
+    ActivityChange.objects.create(
+        op=op, activity_id=activity.pk, user_id=activity.user_id, team_id=activity.team_id,
+        date=activity.date, previous_date=previous.date if previous is not None else None,
+    )
+
+
+def log_inserts(activities):
+    """Log bulk-inserted activities, whose ids may be unknown, as one row per bucket of dates."""
+    seconds = settings.LEADERBOARD_WINDOW_BUCKET_SECONDS
+    buckets = {int(activity.date.timestamp() // seconds) for activity in activities}
+    ActivityChange.objects.bulk_create([
+        ActivityChange(op=ActivityChange.INSERT, date=datetime.fromtimestamp(bucket * seconds, tz=dt_timezone.utc))
+        for bucket in sorted(buckets)
+    ])
+
+
+def log_team(user_id, team_id):
+    """Log a user's move to ``team_id`` (None for no team)."""
+    ActivityChange.objects.create(op=ActivityChange.TEAM, user_id=user_id, team_id=team_id)
+
+
+def prune(now=None):
+    """Delete log rows older than the retention period."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.ACTIVITY_CHANGES_RETENTION_SECONDS)
+    delete_all(ActivityChange.objects.filter(created_at__lt=cutoff))
+
+
+class ChangeCursor:
+    """A position in the change log; :meth:`read` returns what was logged after it."""
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        """Begin at the current time; call before loading what the log will patch."""
+        self.since = timezone.now()
+        self.seen = set()
+
+    def read(self):
+        """
+        Rows logged since the last read, oldest first.
+
+        Returns None when the cursor is further behind than the log keeps,
+        in which case the caller must reload and :meth:`start` again.
+        """
+        global _next_prune
+        now = timezone.now()
+        retention = settings.ACTIVITY_CHANGES_RETENTION_SECONDS
+        if now - self.since > timedelta(seconds=retention):
+            return None
+        settle = timedelta(seconds=settings.ACTIVITY_CHANGES_SETTLE_SECONDS)
+        rows = list(ActivityChange.objects.filter(created_at__gte=self.since - settle).order_by('created_at', 'id'))
+        changes = [row for row in rows if row.pk not in self.seen]
+        # Only rows inside the next read's reach can come back.
+        self.since = now
+        self.seen = {row.pk for row in rows if row.created_at >= now - settle}
+        if time.monotonic() >= _next_prune:
+            _next_prune = time.monotonic() + retention / 24
+            prune(now)
+        return changes
@@ -0,0 +1,381 @@
+"""
+Columnar in-memory activity store for analytics queries.
+
+:class:`ActivityStore` holds every activity as one row across a set of
+NumPy arrays. Ids are int64, user and team ids int32. The team is -1 for
+users without one. ``activity_type`` is dictionary-encoded into int16
+codes. Dates are int64 microseconds since the epoch, and a missing
+distance is NaN. A row costs about 43 bytes, against the kilobyte or so
+of a model instance and its ``__dict__``. Group-by queries are
+``np.unique`` plus ``np.bincount`` over masked columns, with no per-row
+Python.
+
+The store is opt-in (``ANALYTICS_COLUMNAR``). When it is on, the
+``/api/stats/teams/`` and ``/api/stats/types/`` endpoints answer from it
+rather than from aggregation.py. It loads lazily, starting from the
+memory-mapped snapshot (snapshot.py) when there is one, and is then kept
+current in place:
+
+- Inserts: before every query the store reads the activities created
+  since its last read. The read reaches ``ACTIVITY_CHANGES_SETTLE_SECONDS``
+  back, because ids and timestamps can commit out of order, and skips the
+  ids it already holds.
+- Updates overwrite the row's columns where it sits.
+- Deletes clear the row in the ``alive`` tombstone mask.
+- Team moves rewrite the team column of the user's rows.
+
+The signal handlers patch the store for writes made in this process.
+Other workers' updates, deletes and team moves come from the shared
+change log (changes.py), read every ``ACTIVITY_CHANGES_POLL_SECONDS``;
+updated rows are read again by id in one query. A bump of the
+``Activity`` version, sent after the table is replaced wholesale, causes
+a reload.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import snapshot
+from .caching import model_version
+from .changes import ChangeCursor
+from .models import Activity, ActivityChange
+from .snapshot import NO_TEAM, epoch_micros
+
+KEYS = ('user_id', 'team_id', 'activity_type')
+
+COLUMNS = {
+    'id': np.int64,
+    'user_id': np.int32,
+    'team_id': np.int32,
+    'activity_type': np.int16,
+    'date': np.int64,
+    'duration': np.int32,
+    'calories': np.int32,
+    'distance': np.float64,
+}
+
+FIELDS = ('pk', 'user_id', 'team_id', 'activity_type', 'date', 'duration', 'calories', 'distance')
+
+
+class ActivityStore:
+    """Activities as NumPy columns, with vectorized group-by queries."""
+
+    def __init__(self, chunk_size=20000):
+        self.chunk_size = chunk_size
+        self._lock = threading.RLock()
+        self._cursor = ChangeCursor()
+        self.reset()
+
+    def reset(self):
+        """Drop every row; the next query reloads from the database."""
+        with self._lock:
+            self.columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+            self.alive = np.empty(0, dtype=bool)
+            self.size = 0
+            self.types = []
+            self.codes = {}
+            # Inserts are read from created_at >= scanned_at - settle on;
+            # recent holds the ids read there already (None: check every id).
+            self.scanned_at = None
+            self.recent = set()
+            self._loaded_at = None
+            self._version = None
+
+    def nbytes(self):
+        return sum(column[:self.size].nbytes for column in self.columns.values()) + self.alive[:self.size].nbytes
+
+    def _code(self, activity_type):
+        code = self.codes.get(activity_type)
+        if code is None:
+            code = self.codes[activity_type] = len(self.types)
+            self.types.append(activity_type)
+        return code
+
+    def _write(self, positions, rows):
+        """Store ``rows`` (FIELDS tuples) at ``positions``, copying any column still mapped read-only."""
+        ids, user_ids, team_ids, types, dates, durations, calories, distances = zip(*rows)
+        values = {
+            'id': ids,
+            'user_id': user_ids,
+            'team_id': [NO_TEAM if team is None else team for team in team_ids],
+            'activity_type': [self._code(name) for name in types],
+            'date': [epoch_micros(date) for date in dates],
+            'duration': durations,
+            'calories': calories,
+            'distance': [np.nan if value is None else value for value in distances],
+        }
+        for name, column in self.columns.items():
+            if not column.flags.writeable:
+                column = self.columns[name] = column.copy()
+            column[positions] = values[name]
+        self.alive[positions] = True
+
+    def _append(self, rows):
+        count = len(rows)
+        if not count:
+            return
+        if self.size + count > len(self.columns['date']):
+            capacity = max(self.size + count, 2 * len(self.columns['date']))
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self.size] = self.alive[:self.size]
+            self.alive = alive
+        end = self.size + count
+        self._write(slice(self.size, end), rows)
+        self.size = end
+
+    def _positions(self, ids):
+        """Map activity ids to the positions of their rows; ids not held are left out."""
+        positions = np.flatnonzero(np.isin(self.columns['id'][:self.size], list(ids)))
+        return dict(zip(self.columns['id'][positions].tolist(), positions.tolist()))
+
+    def load_snapshot(self, mapped):
+        """
+        Start from a snapshot's activities (snapshot.py), with its delta log replayed.
+
+        The columns stay views of the mapped file, shared with every other
+        worker, until the first appended or patched row copies them.
+        """
+        columns, types = mapped.activity_columns()
+        with self._lock:
+            self.reset()
+            # Kept free of queries for warm(); the first sync takes the version.
+            self._cursor.start()
+            self.columns = {name: columns[name] for name in COLUMNS}
+            self.size = len(self.columns['date'])
+            self.alive = np.ones(self.size, dtype=bool)
+            self.types = types
+            self.codes = {name: code for code, name in enumerate(types)}
+            # Rows created while the snapshot was being built may be in it or not.
+            self.scanned_at = datetime.fromtimestamp(mapped.version / 1e9, tz=dt_timezone.utc)
+            self.recent = None
+            self._loaded_at = time.monotonic()
+
+    def _load(self):
+        mapped = snapshot.current()
+        if mapped is not None:
+            self.load_snapshot(mapped)
+            return
+        self.reset()
+        self._cursor.start()
+        self._version = model_version(Activity)
+        self.scanned_at = timezone.now()
+        self.recent = self._read(Activity.objects.order_by('pk'), self.scanned_at - self._settle())
+        self._loaded_at = time.monotonic()
+
+    def _settle(self):
+        return timedelta(seconds=settings.ACTIVITY_CHANGES_SETTLE_SECONDS)
+
+    def _read(self, activities, since):
+        """Append the rows of ``activities`` not held yet; return the ids read that were created from ``since`` on."""
+        rows = activities.values_list(*FIELDS, 'created_at')
+        recent = set()
+        batch = []
+        for row in rows.iterator(chunk_size=self.chunk_size):
+            if row[-1] >= since:
+                recent.add(row[0])
+            batch.append(row[:-1])
+            if len(batch) == self.chunk_size:
+                self._append(self._unseen(batch))
+                batch = []
+        if batch:
+            self._append(self._unseen(batch))
+        return recent
+
+    def _unseen(self, rows):
+        if self.recent is None:
+            held = np.isin([row[0] for row in rows], self.columns['id'][:self.size])
+            return [row for row, known in zip(rows, held.tolist()) if not known]
+        return [row for row in rows if row[0] not in self.recent]
+
+    def _scan(self):
+        """Append the activities created since the last scan."""
+        now = timezone.now()
+        activities = Activity.objects.filter(created_at__gte=self.scanned_at - self._settle())
+        # Only rows inside the next scan's reach can come back.
+        self.recent = self._read(activities, now - self._settle())
+        self.scanned_at = now
+
+    def update(self, activities):
+        """Overwrite the rows of saved activities in place, if they are held."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            positions = self._positions(activity.pk for activity in activities)
+            rows = [
+                tuple(getattr(activity, name) for name in FIELDS)
+                for activity in activities if activity.pk in positions
+            ]
+            if rows:
+                self._write([positions[row[0]] for row in rows], rows)
+
+    def discard(self, ids):
+        """Tombstone the rows of deleted activities."""
+        with self._lock:
+            if self._loaded_at is not None:
+                self.alive[list(self._positions(ids).values())] = False
+
+    def move_user(self, user_id, team_id):
+        """Rewrite the team of every row of a user."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            column = self.columns['team_id']
+            if not column.flags.writeable:
+                column = self.columns['team_id'] = column.copy()
+            column[:self.size][self.columns['user_id'][:self.size] == user_id] = (
+                NO_TEAM if team_id is None else team_id
+            )
+
+    def _sync(self):
+        """Apply the updates, deletes and team moves other workers logged since the last sync."""
+        self._loaded_at = time.monotonic()
+        version = model_version(Activity)
+        if self._version is None:
+            self._version = version
+        changes = self._cursor.read() if version == self._version else None
+        if changes is None:
+            return False
+        updated, deleted = set(), set()
+        for change in changes:
+            if change.op == ActivityChange.TEAM:
+                self.move_user(change.user_id, change.team_id)
+            elif change.op == ActivityChange.UPDATE:
+                updated.add(change.activity_id)
+            elif change.op == ActivityChange.DELETE:
+                deleted.add(change.activity_id)
+        updated -= deleted
+        if updated:
+            rows = list(Activity.objects.filter(pk__in=updated).values_list(*FIELDS))
+            positions = self._positions(updated)
+            held = [row for row in rows if row[0] in positions]
+            if held:
+                self._write([positions[row[0]] for row in held], held)
+            # Updated, then deleted before this read.
+            deleted |= updated - {row[0] for row in rows}
+        if deleted:
+            self.discard(deleted)
+        return True
+
+    def refresh(self):
+        """Bring the store up to date with the database, loading it first if needed."""
+        with self._lock:
+            if self._loaded_at is None:
+                self._load()
+            elif time.monotonic() - self._loaded_at >= settings.ACTIVITY_CHANGES_POLL_SECONDS and not self._sync():
+                self._load()
+            self._scan()
+
+    def _mask(self, user_id=None, team_id=None, activity_type=None, start=None, end=None):
+        columns = self.columns
+        mask = self.alive[:self.size].copy()
+        if user_id is not None:
+            mask &= columns['user_id'][:self.size] == user_id
+        if team_id is not None:
+            mask &= columns['team_id'][:self.size] == team_id
+        if activity_type is not None:
+            if activity_type not in self.codes:
+                return np.zeros(self.size, dtype=bool)
+            mask &= columns['activity_type'][:self.size] == self.codes[activity_type]
+        if start is not None:
+            mask &= columns['date'][:self.size] >= epoch_micros(start)
+        if end is not None:
+            mask &= columns['date'][:self.size] < epoch_micros(end)
+        return mask
+
+    def summarize(self, by, **filters):
+        """
+        Activity totals grouped by the ``by`` columns, highest total calories first.
+
+        ``by`` is a tuple drawn from ``user_id``, ``team_id`` and
+        ``activity_type``. ``filters`` narrow the rows like the
+        aggregation.py functions do: ``user_id``, ``team_id``,
+        ``activity_type``, ``start`` (inclusive) and ``end`` (exclusive).
+        Grouping on ``team_id`` leaves out activities without a team. Rows
+        carry the ``by`` values, ``total_calories``, ``total_duration``,
+        ``total_distance``, ``activity_count`` and ``avg_duration``.
+        """
+        unknown = set(by) - set(KEYS)
+        if unknown:
+            raise ValueError(f'Cannot group by {", ".join(sorted(unknown))}.')
+        with self._lock:
+            self.refresh()
+            mask = self._mask(**filters)
+            if 'team_id' in by:
+                mask &= self.columns['team_id'][:self.size] != NO_TEAM
+            picked = {
+                name: self.columns[name][:self.size][mask]
+                for name in (*by, 'duration', 'calories', 'distance')
+            }
+            types = list(self.types)
+        if not mask.any():
+            return []
+
+        # Pack the group columns into one int64 key per row (mixed radix),
+        # so grouping is a single 1-D sort rather than a sort of row tuples.
+        key = np.zeros(len(picked['duration']), dtype=np.int64)
+        lows, radixes = [], []
+        for name in by:
+            column = picked[name].astype(np.int64)
+            low = int(column.min())
+            radix = int(column.max()) - low + 1
+            key = key * radix + (column - low)
+            lows.append(low)
+            radixes.append(radix)
+        uniques, inverse = np.unique(key, return_inverse=True)
+        groups = len(uniques)
+        counts = np.bincount(inverse, minlength=groups)
+        calories = np.bincount(inverse, weights=picked['calories'], minlength=groups)
+        duration = np.bincount(inverse, weights=picked['duration'], minlength=groups)
+        distance = np.bincount(inverse, weights=np.nan_to_num(picked['distance']), minlength=groups)
+        order = np.lexsort((np.arange(groups), -calories))
+        values = {}
+        remainder = uniques
+        for name, low, radix in reversed(list(zip(by, lows, radixes))):
+            remainder, digit = np.divmod(remainder, radix)
+            values[name] = (digit + low).tolist()
+
+        rows = []
+        for index in order.tolist():
+            row = {}
+            for name in by:
+                value = values[name][index]
+                row[name] = types[value] if name == 'activity_type' else value
+            row.update(
+                total_calories=int(calories[index]),
+                total_duration=int(duration[index]),
+                total_distance=round(float(distance[index]), 2),
+                activity_count=int(counts[index]),
+                avg_duration=round(float(duration[index] / counts[index]), 2),
+            )
+            rows.append(row)
+        return rows
+
+    def team_totals(self, start=None, end=None):
+        """What aggregation.team_totals returns, answered from the columns."""
+        with self._lock:
+            rows = self.summarize(('team_id',), start=start, end=end)
+            members = Counter(row['team_id'] for row in self.summarize(('team_id', 'user_id'), start=start, end=end))
+        for row in rows:
+            del row['avg_duration']
+            row['member_count'] = members[row['team_id']]
+        return rows
+
+    def type_breakdown(self, user_id=None, team_id=None, start=None, end=None):
+        """What aggregation.type_breakdown returns, answered from the columns."""
+        rows = self.summarize(('activity_type',), user_id=user_id, team_id=team_id, start=start, end=end)
+        for row in rows:
+            del row['avg_duration']
+        rows.sort(key=lambda row: (-row['total_calories'], row['activity_type']))
+        return rows
+
+
+activity_store = ActivityStore()
@@ -0,0 +1,136 @@
+"""
+Lightweight row encoders for read paths that skip the DRF field machinery.
+
+A :class:`RowEncoder` is built once per serializer class from its
+``Meta.fields``. It reads rows with ``values()``/``values_list()`` and
+turns each one into the same dict the serializer would produce, using one
+precomputed converter per column instead of per-field
+``to_representation`` dispatch. :class:`FastReadMixin` puts it behind a
+ViewSet's list and retrieve actions.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import models
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import ISO_8601
+from rest_framework import serializers as drf_fields
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+def _datetime_converter():
+    drf_field = drf_fields.DateTimeField()
+    output_format = api_settings.DATETIME_FORMAT
+    if output_format is None or output_format.lower() != ISO_8601 or not settings.USE_TZ:
+        return drf_field.to_representation
+
+    def convert(value):
+        if not timezone.is_aware(value):
+            # Naive values need DRF's make_aware handling; rare enough to delegate.
+            return drf_field.to_representation(value)
+        value = value.astimezone(timezone.get_current_timezone()).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return convert
+
+
+def _converter(model_field):
+    if isinstance(model_field, models.DateTimeField):
+        return _datetime_converter()
+    if isinstance(model_field, (models.IntegerField, models.AutoField)):
+        return int
+    if isinstance(model_field, models.FloatField):
+        return float
+    if isinstance(model_field, (models.CharField, models.TextField)):
+        return str
+    # Anything else goes through the field DRF would have used.
+    field_class, field_kwargs = drf_fields.ModelSerializer().build_standard_field(
+        model_field.name, model_field
+    )
+    return field_class(**field_kwargs).to_representation
+
+
+class RowEncoder:
+    """Encode ``values_list()`` rows exactly like ``serializer_class`` would."""
+
+    def __init__(self, serializer_class):
+        meta = serializer_class.Meta
+        extra_kwargs = getattr(meta, 'extra_kwargs', {})
+        self.model = meta.model
+        self.fields = [
+            name for name in meta.fields
+            if not extra_kwargs.get(name, {}).get('write_only')
+        ]
+        self.converters = [
+            _converter(self.model._meta.get_field(name)) for name in self.fields
+        ]
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def for_serializer(cls, serializer_class):
+        """Return the shared encoder for ``serializer_class``."""
+        return cls(serializer_class)
+
+    def encode(self, row):
+        """Encode a ``values_list()`` tuple."""
+        return {
+            name: None if value is None else convert(value)
+            for name, convert, value in zip(self.fields, self.converters, row)
+        }
+
+    def encode_dict(self, row):
+        """Encode a ``values()`` dict."""
+        encoded = {}
+        for name, convert in zip(self.fields, self.converters):
+            value = row[name]
+            encoded[name] = None if value is None else convert(value)
+        return encoded
+
+    def iter_rows(self, queryset, chunk_size=2000):
+        """Yield encoded rows from a server-side cursor over ``queryset``."""
+        rows = queryset.values_list(*self.fields).iterator(chunk_size=chunk_size)
+        for row in rows:
+            yield self.encode(row)
+
+
+class FastReadMixin:
+    """
+    Serve ``list`` and ``retrieve`` through a :class:`RowEncoder`.
+
+    Rows are fetched with ``values()`` and encoded directly, producing the
+    same JSON as the serializer. Opt in per view with ``fast_read = True``
+    or globally with the ``API_FAST_READS`` setting. Object-level
+    permissions are not checked on this path.
+    """
+    fast_read = None
+
+    def use_fast_read(self):
+        if self.fast_read is not None:
+            return self.fast_read
+        return getattr(settings, 'API_FAST_READS', False)
+
+    def get_row_encoder(self):
+        return RowEncoder.for_serializer(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+        encoder = self.get_row_encoder()
+        queryset = self.filter_queryset(self.get_queryset()).values(*encoder.fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response([encoder.encode_dict(row) for row in page])
+        return Response([encoder.encode_dict(row) for row in queryset])
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().retrieve(request, *args, **kwargs)
+        encoder = self.get_row_encoder()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).values(*encoder.fields)
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(encoder.encode_dict(row))
@@ -0,0 +1,142 @@
+"""
+Idempotent activity creation for ``POST /api/activities/``.
+
+A mobile client that retries a POST after a dropped response would
+otherwise insert the activity twice and count it twice on the
+leaderboard. Each create is therefore given a key:
+
+- with an ``Idempotency-Key`` header, a hash of the author's user id and
+  the header, so unrelated clients cannot collide;
+- without one, a hash of the natural key
+  ``(user_id, date, activity_type, duration)``.
+
+The key is stored on the activity under a unique index
+(``activity_idempotency_key_uniq``). A repeated key is answered with the
+original response and an ``Idempotent-Replayed: true`` header. Nothing is
+inserted and the leaderboard is not touched. Each worker remembers
+recent responses in :data:`seen_keys`, so a quick retry costs one dict
+lookup. Older keys fall back to one indexed read, and two racing requests
+are settled by the index itself.
+
+Keys are only recorded for single creates. Bulk ingestion and imports
+dedupe by their own means.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError
+from pymongo.errors import DuplicateKeyError
+from rest_framework.exceptions import ValidationError
+
+from .models import Activity
+from .serializers import ActivitySerializer
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def stored_date(date):
+    """``date`` in UTC as the database keeps it: MongoDB stores milliseconds, not microseconds."""
+    date = date.astimezone(dt_timezone.utc)
+    return date.replace(microsecond=date.microsecond // 1000 * 1000)
+
+
+def natural_key(data):
+    """Hash of an activity's ``(user_id, date, activity_type, duration)``, from a model or validated data."""
+    get = data.get if isinstance(data, dict) else lambda name: getattr(data, name)
+    # A stored date must hash like the posted one.
+    date = stored_date(get('date'))
+    return _digest('natural', get('user_id'), date.isoformat(), get('activity_type'), get('duration'))
+
+
+def request_key(request, data):
+    """The key for creating ``data``, from the request's Idempotency-Key header if it sent one."""
+    header = request.headers.get(HEADER)
+    if header is None:
+        return natural_key(data)
+    header = header.strip()
+    if not header or len(header) > MAX_KEY_LENGTH:
+        raise ValidationError({HEADER: [f'Expected 1 to {MAX_KEY_LENGTH} characters.']})
+    return _digest('client', data['user_id'], header)
+
+
+def is_duplicate(exc):
+    """Whether a failed insert hit the unique index; djongo wraps pymongo's error in a DatabaseError."""
+    while exc is not None:
+        if isinstance(exc, (IntegrityError, DuplicateKeyError)):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class SeenKeys:
+    """
+    A per-worker map of recent keys to ``(fingerprint, response data)``.
+
+    ``fingerprint`` is the activity's :func:`natural_key`, which tells a
+    retry apart from a different activity sent with a reused header.
+    Entries expire after ``IDEMPOTENCY_CACHE_SECONDS``. Once there are
+    more than ``IDEMPOTENCY_CACHE_SIZE``, the oldest are dropped first.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1:]
+
+    def add(self, key, fingerprint, data):
+        expires = time.monotonic() + settings.IDEMPOTENCY_CACHE_SECONDS
+        with self._lock:
+            self._entries[key] = (expires, fingerprint, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.IDEMPOTENCY_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+seen_keys = SeenKeys()
+
+
+def lookup(key, fingerprint):
+    """
+    The original response data for ``key``, or None if it was never used.
+
+    Raises ValidationError when an Idempotency-Key header was used for a
+    different activity. A natural key is its own fingerprint, so it is
+    replayed even if the activity has been edited since.
+    """
+    entry = seen_keys.get(key)
+    if entry is None:
+        activity = Activity.objects.filter(idempotency_key=key).first()
+        if activity is None:
+            return None
+        entry = (natural_key(activity), ActivitySerializer(activity).data)
+        seen_keys.add(key, *entry)
+    if key != fingerprint and entry[0] != fingerprint:
+        raise ValidationError({HEADER: ['This key was already used for a different activity.']})
+    return entry[1]
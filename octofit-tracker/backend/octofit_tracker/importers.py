@@ -0,0 +1,308 @@
+"""
+Parsing of historical activity exports for ``manage.py import_activities``.
+
+Each input file is cut into units, and each unit is parsed and validated by
+:func:`parse_unit` in a worker process.
+
+- CSV and newline-delimited JSON files are split into byte ranges of about
+  ``chunk_bytes``, so one large file is parsed by every worker at once. An
+  NDJSON unit starts at the first line that begins inside its range. CSV
+  ranges are cut at record boundaries found by the parent, where the
+  quotes seen so far are balanced, so a quoted field may span lines; each
+  CSV unit is read by one ``csv.reader``.
+- JSON arrays and GPX files are one unit each. They are still read as
+  streams, one object or track at a time. A JSON array that stops parsing
+  raises :class:`MalformedFileError` with the offset.
+
+Workers turn emails into user ids through the dict passed to
+:func:`configure` and validate rows with ``ActivitySerializer``. They
+never write to the database. Deduplication and inserts happen in the
+parent process, which sees every unit's rows.
+"""
+import codecs
+import csv
+import io
+import json
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .serializers import ActivitySerializer
+
+FORMATS = ('csv', 'json', 'gpx')
+FIELDS = ('activity_type', 'duration', 'distance', 'calories', 'date')
+# GPX tracks carry no calories; estimate them from the duration.
+GPX_CALORIES_PER_MINUTE = {'Running': 11, 'Cycling': 8, 'Swimming': 10, 'Walking': 5, 'Hiking': 7}
+GPX_DEFAULT_CALORIES_PER_MINUTE = 7
+EARTH_RADIUS_KM = 6371.0
+# Rejected rows kept per unit for the report; the rest are only counted.
+MAX_ERRORS = 20
+
+_users = {}
+_gpx_email = None
+
+
+class MalformedFileError(ValueError):
+    """A file that cannot be read past some offset, so none of its remaining rows can be found."""
+
+
+def plan_units(path, file_format, chunk_bytes):
+    """Split one file into ``(path, format, start, end)`` units."""
+    size = os.path.getsize(path)
+    if file_format == 'gpx' or (file_format == 'json' and _is_array(path)) or size <= chunk_bytes:
+        return [(path, file_format, 0, size)]
+    if file_format == 'csv':
+        cuts = _csv_cuts(path, chunk_bytes)
+        return [(path, file_format, start, end) for start, end in zip(cuts, cuts[1:] + [size]) if start < end]
+    return [(path, file_format, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+
+def _csv_cuts(path, chunk_bytes):
+    """Offsets of CSV records about ``chunk_bytes`` apart, starting at 0."""
+    cuts = [0]
+    offset = quotes = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            offset += len(line)
+            quotes += line.count(b'"')
+            # An odd count means this newline is inside a quoted field.
+            if offset - cuts[-1] >= chunk_bytes and not quotes % 2:
+                cuts.append(offset)
+    return cuts
+
+
+def unit_key(unit):
+    path, _, start, end = unit
+    return f'{path}:{start}-{end}'
+
+
+def _is_array(path):
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(4096), b''):
+            stripped = chunk.lstrip()
+            if stripped:
+                return stripped.startswith(b'[')
+    return False
+
+
+def _lines(file, start, end):
+    """Yield ``(offset, line)`` for the lines of ``file`` that start in ``[start, end)``."""
+    if start:
+        file.seek(start - 1)
+        file.readline()
+    offset = file.tell()
+    while offset < end:
+        line = file.readline()
+        if not line:
+            return
+        yield offset, line
+        offset += len(line)
+
+
+def _csv_records(path, start, end):
+    """
+    Yield ``(offset, values)`` for the CSV records starting in ``[start, end)``.
+
+    ``start`` must be a record boundary. One ``csv.reader`` reads the
+    decoded text; byte offsets are counted from the lines it consumes.
+    """
+    with open(path, 'rb') as file:
+        if start == 0 and file.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            start = len(codecs.BOM_UTF8)
+        file.seek(start)
+        consumed = [start]
+
+        def lines():
+            for line in io.TextIOWrapper(file, encoding='utf-8', newline=''):
+                consumed[0] += len(line.encode('utf-8'))
+                yield line
+
+        reader = csv.reader(lines())
+        while consumed[0] < end:
+            offset = consumed[0]
+            values = next(reader, None)
+            if values is None:
+                return
+            yield offset, values
+
+
+def csv_rows(path, start, end):
+    """Yield ``(location, row)`` for the CSV records in a byte range; the header is read from the top."""
+    records = _csv_records(path, 0, end)
+    header = next(records, (0, None))[1]
+    if header is None:
+        return
+    if start:
+        records.close()
+        records = _csv_records(path, start, end)
+    for offset, values in records:
+        if values:
+            yield f'{path}@{offset}', dict(zip(header, values))
+
+
+def ndjson_rows(path, start, end):
+    with open(path, 'rb') as file:
+        for offset, line in _lines(file, start, end):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield f'{path}@{offset}', json.loads(line)
+            except ValueError:
+                yield f'{path}@{offset}', None
+
+
+def json_array_rows(path, read_size=1 << 16):
+    """Yield the objects of a top-level JSON array one at a time, without loading the file."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as file:
+        buffer = file.read(read_size)
+        # Characters of the file before ``buffer``, for error offsets.
+        position = len(buffer) - len(buffer.lstrip())
+        buffer = buffer.lstrip()
+        if not buffer.startswith('['):
+            raise MalformedFileError(f'{path} is not a JSON array')
+        buffer = buffer[1:]
+        position += 1
+        index = 0
+        while True:
+            stripped = buffer.lstrip().lstrip(',').lstrip()
+            position += len(buffer) - len(stripped)
+            buffer = stripped
+            if buffer.startswith(']'):
+                return
+            try:
+                item, consumed = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as exc:
+                more = file.read(read_size)
+                if not more:
+                    raise MalformedFileError(
+                        f'{path}: item {index} at character {position + exc.pos} is not valid JSON ({exc.msg})'
+                        if buffer else f'{path}: the array is not closed'
+                    ) from exc
+                buffer += more
+                continue
+            yield f'{path}[{index}]', item
+            index += 1
+            buffer = buffer[consumed:]
+            position += consumed
+            if len(buffer) < read_size:
+                buffer += file.read(read_size)
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _distance_km(points):
+    total = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        total += 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+    return total
+
+
+def gpx_rows(path, email=None):
+    """
+    Yield one activity per ``<trk>`` of a GPX file.
+
+    The activity's email comes from ``<metadata><author><email>``,
+    otherwise from ``email``. Its type is the track's ``<type>``. Its date
+    is the first point's time. Its duration runs from the first point to
+    the last, and its distance is measured along the points.
+    """
+    author = email
+    points, times = [], []
+    track_type = point_time = None
+    index = 0
+    for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+        tag = _local(element.tag)
+        if event == 'start':
+            if tag == 'trkpt':
+                point_time = None
+            continue
+        if tag == 'email' and element.get('id') and element.get('domain'):
+            author = f'{element.get("id")}@{element.get("domain")}'
+        elif tag == 'type' and track_type is None:
+            track_type = (element.text or '').strip().title() or None
+        elif tag == 'time':
+            point_time = parse_datetime((element.text or '').strip())
+        elif tag == 'trkpt':
+            points.append((float(element.get('lat')), float(element.get('lon'))))
+            if point_time is not None:
+                times.append(point_time)
+            element.clear()
+        elif tag == 'trk':
+            activity_type = track_type or 'Running'
+            row = {'email': author, 'activity_type': activity_type, 'distance': None,
+                   'duration': None, 'calories': None, 'date': None}
+            if times:
+                minutes = max(round((times[-1] - times[0]).total_seconds() / 60), 1)
+                rate = GPX_CALORIES_PER_MINUTE.get(activity_type, GPX_DEFAULT_CALORIES_PER_MINUTE)
+                row.update(date=times[0].isoformat(), duration=minutes, calories=minutes * rate,
+                           distance=round(_distance_km(points), 2))
+            yield f'{path}#trk{index}', row
+            index += 1
+            points, times, track_type = [], [], None
+            element.clear()
+
+
+def read_unit(unit, gpx_email=None):
+    path, file_format, start, end = unit
+    if file_format == 'csv':
+        return csv_rows(path, start, end)
+    if file_format == 'gpx':
+        return gpx_rows(path, gpx_email)
+    if start == 0 and _is_array(path):
+        return json_array_rows(path)
+    return ndjson_rows(path, start, end)
+
+
+def configure(users, gpx_email=None):
+    """Set the email-to-id map :func:`parse_unit` resolves users with."""
+    global _users, _gpx_email
+    _users = users
+    _gpx_email = gpx_email
+
+
+def worker_init(users, gpx_email=None):
+    """Pool initializer; forked workers must not share the parent's database sockets."""
+    connections.close_all()
+    configure(users, gpx_email)
+
+
+def parse_unit(unit):
+    """
+    Parse and validate one unit; runs in worker processes.
+
+    Returns ``(unit, rows, rejected, errors)``. ``rows`` are validated
+    activity dicts keyed by ``user_id``. ``rejected`` counts the bad rows,
+    and ``errors`` describes the first :data:`MAX_ERRORS` of them.
+    """
+    serializer = ActivitySerializer()
+    rows, errors = [], []
+    rejected = 0
+    for location, raw in read_unit(unit, _gpx_email):
+        try:
+            if not isinstance(raw, dict):
+                raise ValidationError({'non_field_errors': ['Expected a JSON object.']})
+            email = (raw.get('email') or '').strip().lower()
+            user_id = _users.get(email)
+            if user_id is None:
+                raise ValidationError({'email': [f'No user with email {email!r}.']})
+            data = {field: raw.get(field) for field in FIELDS}
+            if data['distance'] in ('', None):
+                data['distance'] = None
+            data['user_id'] = user_id
+            rows.append(dict(serializer.run_validation(data)))
+        except ValidationError as exc:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append({'location': location, 'errors': exc.detail})
+    return unit, rows, rejected, errors
@@ -0,0 +1,238 @@
+"""
+Secondary index management and query-plan checks.
+
+Indexes are declared in each model's ``Meta.indexes``, and unique ones as
+``UniqueConstraint`` in ``Meta.constraints``. djongo does not reliably
+turn ``AddIndex`` or ``AddConstraint`` migrations into MongoDB indexes, so
+:func:`sync_mongo_indexes` creates them on the collections directly and
+reports indexes that are unused or no longer declared. :func:`full_scans`
+explains a queryset and names the tables it would read in full.
+"""
+import re
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+APP_LABEL = 'octofit_tracker'
+# BSON types a partial unique index requires of fields that must not be null.
+MONGO_TYPES = {'CharField': 'string', 'IntegerField': 'number', 'FloatField': 'number', 'DateTimeField': 'date'}
+
+
+def index_keys(model, index):
+    """Return the pymongo key list for a ``models.Index`` on ``model``."""
+    keys = []
+    for name in index.fields:
+        direction = DESCENDING if name.startswith('-') else ASCENDING
+        keys.append((model._meta.get_field(name.lstrip('-')).column, direction))
+    return keys
+
+
+def unique_constraints(model):
+    return [
+        constraint for constraint in model._meta.constraints
+        if isinstance(constraint, UniqueConstraint) and constraint.fields
+    ]
+
+
+def unique_options(model, constraint):
+    """
+    Return the pymongo ``create_index`` options for a ``UniqueConstraint``.
+
+    A ``field__isnull=False`` condition becomes a partial index over the
+    documents where the field holds a value, since MongoDB would otherwise
+    count every null as the same key. A ``field=value`` condition becomes a
+    partial index over the documents holding that value. Other conditions
+    are not supported.
+    """
+    options = {'unique': True}
+    if constraint.condition is not None:
+        expression = {}
+        for lookup, value in constraint.condition.children:
+            name, _, operator = lookup.partition('__')
+            field = model._meta.get_field(name)
+            if operator in ('', 'exact') and isinstance(value, (str, int)):
+                expression[field.column] = value
+            elif operator == 'isnull' and value is False:
+                expression[field.column] = {'$type': MONGO_TYPES[field.get_internal_type()]}
+            else:
+                raise NotImplementedError(f'Unsupported condition on {constraint.name}: {lookup}={value!r}')
+        options['partialFilterExpression'] = expression
+    return options
+
+
+def declared_indexes():
+    """
+    Map each table of the app to ``{index name: key list}``.
+
+    Covers ``Meta.indexes`` and the unique constraints of ``Meta.constraints``.
+    """
+    declared = {}
+    for model in apps.get_app_config(APP_LABEL).get_models():
+        declared[model._meta.db_table] = {
+            index.name: index_keys(model, index)
+            for index in model._meta.indexes + unique_constraints(model)
+        }
+    return declared
+
+
+def declared_options():
+    """Map each table of the app to ``{index name: create_index options}`` for its unique constraints."""
+    return {
+        model._meta.db_table: {
+            constraint.name: unique_options(model, constraint) for constraint in unique_constraints(model)
+        }
+        for model in apps.get_app_config(APP_LABEL).get_models()
+    }
+
+
+def _index_usage(collection):
+    """
+    Return ``{index name: operations since server start}`` from ``$indexStats``.
+
+    Empty when the stage is unavailable, e.g. without the ``indexStats``
+    privilege or on a stand-in that does not implement it.
+    """
+    try:
+        return {
+            stats['name']: stats['accesses']['ops']
+            for stats in collection.aggregate([{'$indexStats': {}}])
+        }
+    except (OperationFailure, NotImplementedError):
+        return {}
+
+
+def sync_mongo_indexes(db, dry_run=False):
+    """
+    Create missing declared indexes on ``db`` and report the rest.
+
+    Returns ``{table: {'created': [...], 'unused': [...], 'undeclared': [...]}}``.
+    An index whose name exists with different keys is dropped and recreated.
+    ``unused`` lists declared indexes that ``$indexStats`` has never seen used
+    since the server started. ``undeclared`` lists indexes that no model
+    declares; they are reported but never dropped.
+    """
+    report = {}
+    options = declared_options()
+    for table, indexes in declared_indexes().items():
+        collection = db[table]
+        information = collection.index_information()
+        existing = {
+            name: [(key, int(direction)) for key, direction in info['key']]
+            for name, info in information.items()
+        }
+        created = []
+        for name, keys in indexes.items():
+            if existing.get(name) == keys:
+                continue
+            if not dry_run:
+                if name in existing:
+                    collection.drop_index(name)
+                collection.create_index(keys, name=name, background=True, **options[table].get(name, {}))
+            created.append(name)
+
+        usage = _index_usage(collection)
+        report[table] = {
+            'created': created,
+            'unused': sorted(
+                name for name in indexes if name not in created and usage.get(name) == 0
+            ),
+            # _id_ is built in and unique indexes back model constraints.
+            'undeclared': sorted(
+                name for name, info in information.items()
+                if name != '_id_' and name not in indexes and not info.get('unique')
+            ),
+        }
+    return report
+
+
+def sync_sql_indexes(dry_run=False):
+    """
+    Create declared indexes that are missing from a SQL database.
+
+    Migrations normally take care of this; the command uses it to repair
+    a schema. Returns ``{table: {'created': [...]}}``.
+    """
+    report = {}
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for model in apps.get_app_config(APP_LABEL).get_models():
+            table = model._meta.db_table
+            if table not in tables:
+                continue
+            existing = connection.introspection.get_constraints(cursor, table)
+            missing = [index for index in model._meta.indexes if index.name not in existing]
+            if not dry_run:
+                # Run the DDL directly: SQLite refuses a schema editor inside a transaction.
+                editor = connection.schema_editor()
+                for index in missing:
+                    cursor.execute(str(index.create_sql(model, editor)))
+            report[table] = {'created': [index.name for index in missing]}
+    return report
+
+
+def _plan_stages(plan):
+    """Yield every stage name in a MongoDB explain plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+def mongo_plan_scans(explain):
+    """Return True if a MongoDB ``explain()`` result's winning plan is a COLLSCAN."""
+    return 'COLLSCAN' in _plan_stages(explain['queryPlanner']['winningPlan'])
+
+
+_SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)')
+
+
+def full_scans(queryset):
+    """
+    Return the tables that ``queryset`` would read in full.
+
+    Works on SQLite and PostgreSQL, whose ``EXPLAIN`` output is parsed, and
+    on MongoDB, where ``filter``/``sort`` are rebuilt from the query's
+    simple lookups and explained through pymongo.
+    """
+    if connection.vendor == 'sqlite':
+        plan = queryset.explain()
+        return sorted({match.group(1) for match in _SQLITE_FULL_SCAN.finditer(plan)})
+    if connection.vendor == 'postgresql':
+        plan = queryset.explain()
+        return sorted(set(re.findall(r'Seq Scan on (\w+)', plan)))
+    if connection.vendor == 'djongo':
+        from .aggregation import mongo_database
+        table = queryset.model._meta.db_table
+        query, sort = _mongo_query(queryset)
+        cursor = mongo_database()[table].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        return [table] if mongo_plan_scans(cursor.explain()) else []
+    raise NotImplementedError(f'No plan check for {connection.vendor}')
+
+
+def _mongo_query(queryset):
+    """Translate a queryset's equality/range filters and ordering to a pymongo find()."""
+    operators = {'exact': None, 'gt': '$gt', 'gte': '$gte', 'lt': '$lt', 'lte': '$lte', 'in': '$in'}
+    query = {}
+    for child in queryset.query.where.children:
+        lookup = operators[child.lookup_name]
+        column = child.lhs.target.column
+        value = list(child.rhs) if lookup == '$in' else child.rhs
+        if lookup is None:
+            query[column] = value
+        else:
+            query.setdefault(column, {})[lookup] = value
+    sort = []
+    for name in queryset.query.order_by:
+        field = name.lstrip('-')
+        field = queryset.model._meta.pk if field == 'pk' else queryset.model._meta.get_field(field)
+        sort.append((field.column, DESCENDING if name.startswith('-') else ASCENDING))
+    return query, sort
@@ -0,0 +1,156 @@
+"""
+Batched activity ingestion.
+
+Rows are validated a column at a time, falling back to a single
+serializer instance for the rows that fail, inserted with
+``bulk_create`` in chunks and folded into one leaderboard delta per user
+and one rollup write per (user, day), so a batch costs a handful of
+round-trips instead of a few per row.
+"""
+import math
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .caching import deferred_bumps
+from .changes import log_inserts
+from .leaderboard import activity_totals, apply_activity_delta
+from .models import Activity, User
+from .parsers import MalformedLine
+from .partitions import hot_start
+from .rollups import add_activities
+from .serializers import ActivitySerializer
+from .windows import window_rankings
+
+
+def _in_range(value, field):
+    return type(value) is int and (field.min_value is None or value >= field.min_value) and (
+        field.max_value is None or value <= field.max_value
+    )
+
+
+def _is_type(value, field):
+    return (type(value) is str and 0 < len(value) <= field.max_length
+            and value == value.strip() and '\x00' not in value)
+
+
+def _is_distance(value):
+    return value is None or type(value) is int or (type(value) is float and math.isfinite(value))
+
+
+def _parse_date(value, field, boundary):
+    """The aware datetime in ``value``, or None when the serializer has to judge it."""
+    if type(value) is not str:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        date = field.enforce_timezone(parsed) if parsed is not None else None
+    except (ValueError, ValidationError):
+        return None
+    if date is None or (boundary is not None and date < boundary):
+        return None
+    return date
+
+
+def validate_activities(rows):
+    """
+    Validate raw activity dicts.
+
+    Returns ``(activities, errors)``: unsaved Activity instances for the
+    valid rows and ``{'index': i, 'errors': {...}}`` for the rejected ones.
+    Each field is checked across the whole batch at once: exact types,
+    the serializer fields' ranges, and the authors' existence with one
+    query. Only the rows that fail there go through the serializer, for
+    its coercions and error messages.
+    """
+    serializer = ActivitySerializer(context={'hot_start': hot_start()})
+    fields = serializer.fields
+    objects = [row if isinstance(row, dict) else {} for row in rows]
+    user_ids = [row.get('user_id') for row in objects]
+    types = [row.get('activity_type') for row in objects]
+    durations = [row.get('duration') for row in objects]
+    calories = [row.get('calories') for row in objects]
+    distances = [row.get('distance') for row in objects]
+    dates = [_parse_date(row.get('date'), fields['date'], serializer.context['hot_start']) for row in objects]
+    passed = [
+        isinstance(row, dict) and date is not None and _is_distance(distance)
+        and _is_type(activity_type, fields['activity_type']) and _in_range(user_id, fields['user_id'])
+        and _in_range(duration, fields['duration']) and _in_range(calorie, fields['calories'])
+        for row, user_id, activity_type, duration, calorie, distance, date
+        in zip(rows, user_ids, types, durations, calories, distances, dates)
+    ]
+
+    valid = {}
+    errors = []
+    for index, row in enumerate(rows):
+        if passed[index]:
+            valid[index] = Activity(
+                user_id=user_ids[index], activity_type=types[index], duration=durations[index],
+                calories=calories[index], date=dates[index],
+                distance=None if distances[index] is None else float(distances[index]),
+            )
+        elif isinstance(row, MalformedLine):
+            errors.append({'index': index, 'errors': row.errors})
+        else:
+            try:
+                valid[index] = Activity(**serializer.run_validation(row))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+    known = set(User.objects.filter(pk__in={a.user_id for a in valid.values()}).values_list('id', flat=True))
+    for index, activity in list(valid.items()):
+        if activity.user_id not in known:
+            del valid[index]
+            errors.append({'index': index, 'errors': {
+                'user_id': [f'Invalid pk "{activity.user_id}" - object does not exist.'],
+            }})
+    errors.sort(key=lambda error: error['index'])
+    return list(valid.values()), errors
+
+
+def assign_team_ids(activities):
+    """Copy each author's ``User.team_id`` onto the activities with one query."""
+    teams = dict(
+        User.objects.filter(pk__in={a.user_id for a in activities}).values_list('id', 'team_id')
+    )
+    for activity in activities:
+        activity.team_id = teams.get(activity.user_id)
+
+
+def apply_leaderboard_deltas(activities):
+    """Apply one leaderboard delta per user for a batch of new activities."""
+    deltas = {}
+    for activity in activities:
+        calories, duration, distance = activity_totals(activity)
+        current = deltas.setdefault(activity.user_id, [0, 0, 0.0])
+        current[0] += calories
+        current[1] += duration
+        current[2] += distance
+    for user_id, (calories, duration, distance) in deltas.items():
+        apply_activity_delta(user_id, calories, duration, distance)
+
+
+def insert_activities(activities, chunk_size=None):
+    """Insert validated activities in chunks and update derived data once per user."""
+    chunk_size = chunk_size or settings.ACTIVITY_BULK_CHUNK_SIZE
+    assign_team_ids(activities)
+    created = Activity.objects.bulk_create(activities, batch_size=chunk_size)
+    with deferred_bumps():
+        apply_leaderboard_deltas(created)
+    add_activities(created)
+    window_rankings.record(created)
+    log_inserts(created)
+    return created
+
+
+def ingest_activities(rows, chunk_size=None):
+    """
+    Validate and insert a batch of raw activity dicts.
+
+    Invalid rows are reported and skipped; the rest of the batch is inserted.
+    Returns ``(created, errors)``.
+    """
+    activities, errors = validate_activities(rows)
+    created = insert_activities(activities, chunk_size) if activities else []
+    return created, errors
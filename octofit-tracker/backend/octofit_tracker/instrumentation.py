@@ -0,0 +1,277 @@
+"""
+Per-request timing and query instrumentation.
+
+:class:`InstrumentationMiddleware` times every request. For the sampled
+share of requests (``INSTRUMENTATION_SAMPLE_RATE``) it also records:
+
+- the number of database round trips and the time spent in them;
+- the time spent rendering the response body (``serialize``);
+- the total time.
+
+It reports them in a ``Server-Timing`` header and in in-process
+histograms labelled with the view name. ``GET /metrics`` serves the
+histograms in the Prometheus text format. Each worker process keeps its
+own, so scrape every worker, or run one per pod.
+
+Queries are counted through Django's execute wrappers. On MongoDB they are
+counted through a pymongo command listener instead, which also sees the
+aggregation pipelines and ``$inc`` updates that bypass the ORM. Both find
+the request being measured through a context variable. The variable
+follows the request into the ``/api/async/`` thread pool, and an unsampled
+request pays one lookup per query.
+"""
+import asyncio
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from pymongo import monitoring
+
+from . import nplusone
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+_current = ContextVar('octofit_request_measurement', default=None)
+
+
+class Measurement:
+    """What one sampled request spent its time on."""
+    __slots__ = ('queries', 'db_time', 'serialize_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+
+def current():
+    """The :class:`Measurement` of the request being sampled, or None."""
+    return _current.get()
+
+
+def record_query(seconds):
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.queries += 1
+        measurement.db_time += seconds
+
+
+@contextmanager
+def serializing():
+    """Count the time spent inside the block as serialization."""
+    measurement = _current.get()
+    if measurement is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        measurement.serialize_time += time.perf_counter() - started
+
+
+class Histogram:
+    """A Prometheus-style histogram with cumulative buckets per label set."""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, label_values):
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        """The histogram in the Prometheus text exposition format."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            labels = ','.join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)
+            )
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram(
+    'octofit_http_request_duration_seconds', 'Time to produce a response, every request.',
+    ('view', 'method'), DURATION_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    'octofit_http_request_db_seconds', 'Time spent in database round trips, sampled requests.',
+    ('view',), DURATION_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'octofit_http_request_db_queries', 'Database round trips per request, sampled requests.',
+    ('view',), QUERY_BUCKETS,
+)
+SERIALIZE_SECONDS = Histogram(
+    'octofit_http_request_serialize_seconds', 'Time spent rendering response bodies, sampled requests.',
+    ('view',), DURATION_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, DB_QUERIES, SERIALIZE_SECONDS)
+
+
+def _time_query(execute, sql, params, many, context):
+    nplusone.record_sql(sql)
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_query(time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Time (and shape, see nplusone.py) every SQL query; MongoDB is handled by :data:`command_timer`."""
+    if connection.vendor != 'djongo' and _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(install_query_timer, dispatch_uid='octofit_query_timer')
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Time every MongoDB command, including the ones issued directly through pymongo."""
+
+    def started(self, event):
+        nplusone.record_command(event.command_name, event.command)
+
+    def succeeded(self, event):
+        record_query(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record_query(event.duration_micros / 1e6)
+
+
+command_timer = CommandTimer()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+def sampled():
+    rate = settings.INSTRUMENTATION_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class InstrumentationMiddleware:
+    """
+    Time requests and report the breakdown of sampled ones.
+
+    Sync and async capable, so requests to async views are measured without
+    being moved to a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        measurement = Measurement() if sampled() else None
+        token = _current.set(measurement)
+        started = time.perf_counter()
+        try:
+            with self.detect_repeats(request):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, measurement, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        measurement = Measurement() if sampled() else None
+        token = _current.set(measurement)
+        started = time.perf_counter()
+        try:
+            with self.detect_repeats(request):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, measurement, time.perf_counter() - started)
+
+    def detect_repeats(self, request):
+        """Watch for N+1 queries (nplusone.py) when ``QUERY_REPEAT_THRESHOLD`` is set."""
+        if not settings.QUERY_REPEAT_THRESHOLD:
+            return nullcontext()
+        return nplusone.detect(label=f'{request.method} {request.path}')
+
+    def finish(self, request, response, measurement, elapsed):
+        view = view_name(request)
+        REQUEST_SECONDS.observe((view, request.method), elapsed)
+        timings = [f'total;dur={elapsed * 1000:.1f}']
+        if measurement is not None:
+            DB_SECONDS.observe((view,), measurement.db_time)
+            DB_QUERIES.observe((view,), measurement.queries)
+            SERIALIZE_SECONDS.observe((view,), measurement.serialize_time)
+            timings[:0] = [
+                f'db;dur={measurement.db_time * 1000:.1f};desc="{measurement.queries} queries"',
+                f'serialize;dur={measurement.serialize_time * 1000:.1f}',
+            ]
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+
+def expose():
+    """Every histogram, plus the MongoDB pool counters, in the Prometheus text format."""
+    from .mongo import metrics as pool
+    snapshot = pool.snapshot()
+    gauges = [
+        '# HELP octofit_mongo_pool_connections MongoDB pool connections by state.',
+        '# TYPE octofit_mongo_pool_connections gauge',
+        *(
+            f'octofit_mongo_pool_connections{{state="{state}"}} {snapshot[state]}'
+            for state in ('open', 'checked_out', 'waiting')
+        ),
+        '# HELP octofit_mongo_pool_connections_created_total MongoDB connections opened.',
+        '# TYPE octofit_mongo_pool_connections_created_total counter',
+        f'octofit_mongo_pool_connections_created_total {snapshot["created"]}',
+        '# HELP octofit_mongo_pool_checkout_failures_total Connection checkouts that failed or timed out.',
+        '# TYPE octofit_mongo_pool_checkout_failures_total counter',
+        f'octofit_mongo_pool_checkout_failures_total {snapshot["checkout_failures"]}',
+    ]
+    return '\n'.join([histogram.expose() for histogram in HISTOGRAMS] + gauges) + '\n'
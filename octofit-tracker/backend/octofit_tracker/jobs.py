@@ -0,0 +1,275 @@
+"""
+Persistent background jobs.
+
+Jobs are rows in the ``jobs`` collection of the default database, so the
+queue survives restarts without another service. :func:`enqueue` returns
+immediately and folds a request into an identical job that is still
+pending. ``manage.py run_jobs`` starts worker processes that claim jobs
+one at a time with a conditional update, run the registered handler and
+record its progress and result. While a handler runs, a thread refreshes
+the job's heartbeat every ``JOB_HEARTBEAT_SECONDS``, so only jobs whose
+worker died are requeued as stale.
+"""
+import hashlib
+import inspect
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .idempotency import is_duplicate
+from .ingest import ingest_activities
+from .leaderboard import rebuild_leaderboard
+from .models import Job
+from .rollups import rebuild_rollups
+
+HANDLERS = {}
+
+
+def job(kind):
+    """Register ``func(job, **payload)`` as the handler for ``kind``."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def dedup_key(kind, payload):
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return f'{kind}:{hashlib.md5(encoded.encode(), usedforsecurity=False).hexdigest()}'
+
+
+def enqueue(kind, **payload):
+    """
+    Queue a job and return ``(job, created)``.
+
+    If an identical job (same kind and payload) is still pending, that job
+    is returned instead and nothing new is queued. Raises ValueError for an
+    unknown kind and TypeError when the payload does not fit its handler.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    inspect.signature(HANDLERS[kind]).bind(None, **payload)
+    key = dedup_key(kind, payload)
+    while True:
+        pending = Job.objects.filter(dedup_key=key, status=Job.PENDING).first()
+        if pending is not None:
+            return pending, False
+        # The unique index on pending keys decides between concurrent enqueues.
+        try:
+            with transaction.atomic():
+                return Job.objects.create(kind=kind, payload=json.dumps(payload), dedup_key=key), True
+        except DatabaseError as exc:
+            if not is_duplicate(exc):
+                raise
+
+
+def owned(job):
+    """The job's row while ``job``'s claim on it still holds, i.e. it was not requeued and claimed again."""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker, started_at=job.started_at)
+
+
+def report(job, progress, message='', state=None):
+    """
+    Record a running job's progress (0 to 1) and refresh its heartbeat.
+
+    ``state`` is stored as the job's result, for a requeued run of the same
+    job to resume from; see :func:`saved_state`.
+    """
+    job.progress = min(max(progress, 0.0), 1.0)
+    job.message = message
+    job.heartbeat_at = timezone.now()
+    fields = {'progress': job.progress, 'message': message, 'heartbeat_at': job.heartbeat_at}
+    if state is not None:
+        job.result = fields['result'] = json.dumps(state)
+    owned(job).update(**fields)
+
+
+def saved_state(job):
+    """The ``state`` last reported by an earlier run of ``job``, or None on its first run."""
+    return json.loads(job.result) if job.result else None
+
+
+@contextmanager
+def heartbeat(job, interval=None):
+    """
+    Refresh ``job``'s heartbeat every ``interval`` seconds from a thread.
+
+    Keeps a handler that spends longer than ``JOB_STALE_SECONDS`` in one
+    call (a rebuild, say) from being requeued and run twice. The thread
+    stops with the block, and with the process if the worker dies.
+    """
+    interval = settings.JOB_HEARTBEAT_SECONDS if interval is None else interval
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                owned(job).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """
+    Claim the oldest pending job for ``worker`` and return it, or None.
+
+    The status update only matches while the job is still pending, so two
+    workers racing for the same job cannot both win it.
+    """
+    candidates = Job.objects.filter(status=Job.PENDING).order_by('created_at', 'id')
+    for pk in candidates.values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.PENDING).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, progress=0.0
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    """
+    Run a claimed job and store its outcome.
+
+    The outcome is dropped if the job was requeued meanwhile: its new run
+    records its own.
+    """
+    owned(job).update(attempts=job.attempts + 1)
+    try:
+        with heartbeat(job):
+            result = HANDLERS[job.kind](job, **json.loads(job.payload))
+    except Exception as exc:
+        owned(job).update(
+            status=Job.FAILED, message=f'{type(exc).__name__}: {exc}',
+            result=json.dumps({'traceback': traceback.format_exc()}), finished_at=timezone.now(),
+        )
+    else:
+        owned(job).update(
+            status=Job.DONE, progress=1.0, result=json.dumps(result), finished_at=timezone.now(),
+        )
+    finally:
+        close_old_connections()
+
+
+def run_next(worker=None):
+    """Claim and run one job; returns the job or None when the queue is empty."""
+    claimed = claim(worker or worker_name())
+    if claimed is not None:
+        run(claimed)
+    return claimed
+
+
+def work(poll=None, burst=False):
+    """
+    Run jobs one after another in this process.
+
+    An idle worker requeues stale jobs and sleeps ``poll`` seconds before
+    looking again; with ``burst`` it returns as soon as the queue is empty.
+    Returns the number of jobs run.
+    """
+    poll = settings.JOB_POLL_SECONDS if poll is None else poll
+    worker = worker_name()
+    count = 0
+    while True:
+        if run_next(worker) is not None:
+            count += 1
+            continue
+        if requeue_stale():
+            continue
+        if burst:
+            return count
+        time.sleep(poll)
+
+
+def requeue_stale(max_age=None):
+    """
+    Put running jobs whose heartbeat is older than ``max_age`` seconds back in the queue.
+
+    Covers workers that died mid-job. A job that has already started
+    ``JOB_MAX_ATTEMPTS`` times, or whose identical twin is pending, is
+    marked failed instead. Returns the number of jobs requeued.
+    """
+    max_age = settings.JOB_STALE_SECONDS if max_age is None else max_age
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - timedelta(seconds=max_age))
+    stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED, finished_at=now,
+        message=f'Gave up after the worker stopped responding {settings.JOB_MAX_ATTEMPTS} times',
+    )
+    requeued = 0
+    for pk in stale.values_list('id', flat=True):
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(pk=pk, status=Job.RUNNING).update(
+                    status=Job.PENDING, worker='', message='Requeued after the worker stopped responding'
+                )
+        except DatabaseError as exc:
+            if not is_duplicate(exc):
+                raise
+            Job.objects.filter(pk=pk, status=Job.RUNNING).update(
+                status=Job.FAILED, finished_at=now, message='Superseded by an identical pending job',
+            )
+    return requeued
+
+
+@job('rebuild_leaderboard')
+def rebuild_leaderboard_job(job):
+    report(job, 0.0, 'Rebuilding leaderboard')
+    return {'entries': rebuild_leaderboard()}
+
+
+@job('rebuild_rollups')
+def rebuild_rollups_job(job):
+    report(job, 0.0, 'Rebuilding rollups')
+    counts = rebuild_rollups()
+    return {model._meta.db_table: count for model, count in counts.items()}
+
+
+@job('import_activities')
+def import_activities_job(job, rows, chunk_size=None, errors=()):
+    """
+    Validate and insert ``rows`` chunk by chunk, reporting progress after each one.
+
+    ``errors`` reports rows that could not be parsed; their slots in
+    ``rows`` hold None and are not validated again.
+
+    Each chunk commits together with the count of rows done, so a requeued
+    run starts after the last finished chunk instead of inserting it again.
+    On backends without transactions a crash between the two can still
+    repeat that one chunk.
+    """
+    chunk_size = chunk_size or settings.ACTIVITY_BULK_CHUNK_SIZE
+    unparsed = {error['index'] for error in errors}
+    state = saved_state(job) or {'done': 0, 'created': 0, 'errors': list(errors)}
+    for start in range(state['done'], len(rows), chunk_size):
+        with transaction.atomic():
+            chunk_created, chunk_errors = ingest_activities(rows[start:start + chunk_size], chunk_size)
+            state['created'] += len(chunk_created)
+            state['errors'].extend(
+                {**error, 'index': error['index'] + start} for error in chunk_errors
+                if error['index'] + start not in unparsed
+            )
+            state['done'] = min(start + chunk_size, len(rows))
+            report(job, state['done'] / len(rows), f'{state["done"]}/{len(rows)} rows processed', state)
+    return {'created': state['created'], 'errors': sorted(state['errors'], key=lambda error: error['index'])}
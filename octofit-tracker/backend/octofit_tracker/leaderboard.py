@@ -0,0 +1,258 @@
+"""
+Incremental leaderboard maintenance.
+
+Leaderboard rows are kept in sync with Activity writes by applying the
+change in a user's totals as a delta instead of recomputing everything.
+Ranks are dense (1..n) and ordered by ``(-total_calories, id)``, so when
+one entry moves only the ranks between its old and new position shift.
+
+Totals are added in place (``$inc``-style on MongoDB, an ``F()`` update
+elsewhere), so no writer's delta is lost. The new rank is then derived
+from the stored totals. Rank moves are serialized by :func:`rank_lock`:
+``_lock`` within a process, plus a lock shared by every process. That is
+a transaction-scoped advisory lock on PostgreSQL, and a lease document
+in ``RANK_LOCK_COLLECTION`` on MongoDB (djongo).
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Round
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError
+
+from .aggregation import ranked_user_totals
+from .caching import bump_version
+from .models import Leaderboard, User, delete_all
+from .partitions import with_archived_totals
+from .ranking import REBUILDS, leaderboard_index
+from .windows import window_rankings
+
+_lock = threading.Lock()
+# Advisory lock key for rank moves on PostgreSQL; any constant unique to the app.
+RANK_LOCK_ID = 0x6f63746f
+# On MongoDB, rank moves hold a lease on one document of this collection.
+RANK_LOCK_COLLECTION = 'locks'
+RANK_LOCK_NAME = 'leaderboard_ranks'
+# A lease left by a process that died mid-move is taken over after this long.
+RANK_LOCK_SECONDS = 30
+
+
+def _is_mongo():
+    return connection.vendor == 'djongo'
+
+
+def _shift_ranks(low, high, step, exclude_pk):
+    """Add ``step`` to every rank in ``[low, high]`` except ``exclude_pk``."""
+    if low > high:
+        return
+    if _is_mongo():
+        # djongo cannot translate ``SET rank = rank + 1``; use $inc directly.
+        connection.ensure_connection()
+        connection.connection[Leaderboard._meta.db_table].update_many(
+            {'rank': {'$gte': low, '$lte': high}, 'id': {'$ne': exclude_pk}},
+            {'$inc': {'rank': step}},
+        )
+    else:
+        Leaderboard.objects.filter(rank__gte=low, rank__lte=high).exclude(
+            pk=exclude_pk
+        ).update(rank=F('rank') + step)
+
+
+def entries_ahead(entry):
+    """
+    The entries ranked above ``entry``.
+
+    Both branches are ranges of ``leaderboard_calories_idx``, so counting
+    them reads the index up to the entry instead of the whole table.
+    """
+    return Leaderboard.objects.filter(
+        Q(total_calories__gt=entry.total_calories)
+        | Q(total_calories=entry.total_calories, pk__lt=entry.pk)
+    )
+
+
+def _reposition(entry, old_rank):
+    """Move ``entry`` from ``old_rank`` to its correct rank, shifting the range in between."""
+    new_rank = entries_ahead(entry).count() + 1
+    if new_rank < old_rank:
+        _shift_ranks(new_rank, old_rank - 1, 1, entry.pk)
+    elif new_rank > old_rank:
+        _shift_ranks(old_rank + 1, new_rank, -1, entry.pk)
+    entry.rank = new_rank
+    return new_rank
+
+
+def _add_totals(entry, calories, duration, distance):
+    """Add to ``entry``'s stored totals in one atomic update, then reload them into ``entry``."""
+    now = timezone.now()
+    if _is_mongo():
+        # An update pipeline, so the sums and the rounding happen on the server.
+        connection.ensure_connection()
+        connection.connection[Leaderboard._meta.db_table].update_one({'id': entry.pk}, [{'$set': {
+            'total_calories': {'$add': ['$total_calories', calories]},
+            'total_duration': {'$add': ['$total_duration', duration]},
+            'total_distance': {'$round': [{'$add': ['$total_distance', distance]}, 2]},
+            'updated_at': now,
+        }}])
+    else:
+        Leaderboard.objects.filter(pk=entry.pk).update(
+            total_calories=F('total_calories') + calories,
+            total_duration=F('total_duration') + duration,
+            total_distance=Round(F('total_distance') + distance, 2),
+            updated_at=now,
+        )
+    entry.refresh_from_db(fields=['total_calories', 'total_duration', 'total_distance', 'rank', 'updated_at'])
+
+
+def apply_activity_delta(user_id, calories=0, duration=0, distance=0.0):
+    """
+    Add a change in activity totals to ``user_id``'s leaderboard entry.
+
+    Creates the entry when the user has none yet and removes it once all of
+    its totals are back to zero. A delta that takes something away never
+    creates an entry: it belongs to activities of a user whose entry was
+    removed with them (see ``signals.user_deleted``). Returns a tuple of ``(entry, old_rank)``
+    where ``entry`` is None for a removed entry and ``old_rank`` is None for
+    a new one.
+    """
+    distance = distance or 0.0
+    if not (calories or duration or distance):
+        return None, None
+
+    with rank_lock():
+        entry = Leaderboard.objects.filter(user_id=user_id).first()
+        if entry is None:
+            if min(calories, duration, distance) < 0:
+                return None, None
+            team_id = User.objects.filter(pk=user_id).values_list('team_id', flat=True).first()
+            # A new entry starts at the bottom of the board and moves up from there.
+            entry = Leaderboard.objects.create(
+                user_id=user_id, team_id=team_id or 0, total_calories=calories, total_duration=duration,
+                total_distance=round(distance, 2), rank=Leaderboard.objects.count() + 1,
+            )
+            old_rank = None
+        else:
+            old_rank = entry.rank
+            _add_totals(entry, calories, duration, distance)
+        if not (entry.total_calories or entry.total_duration or entry.total_distance):
+            # Nothing left to rank, e.g. the user's only activity was deleted.
+            _delete_entry(entry)
+            return None, old_rank
+        start_rank = entry.rank
+        if _reposition(entry, start_rank) != start_rank:
+            Leaderboard.objects.filter(pk=entry.pk).update(rank=entry.rank)
+        leaderboard_index.upsert(entry)
+        bump_version(Leaderboard)
+    return entry, old_rank
+
+
+@contextmanager
+def rank_lock():
+    """
+    Hold the board's rank lock, in this process and across processes, inside a transaction.
+
+    On PostgreSQL it is an advisory lock released when the transaction
+    ends; on MongoDB a lease from :func:`mongo_lease`.
+    """
+    with _lock, transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [RANK_LOCK_ID])
+        if _is_mongo():
+            connection.ensure_connection()
+            with mongo_lease(connection.connection[RANK_LOCK_COLLECTION], RANK_LOCK_NAME):
+                yield
+        else:
+            yield
+
+
+@contextmanager
+def mongo_lease(locks, name, seconds=None):
+    """
+    Hold the lease ``name`` in the ``locks`` collection for the block.
+
+    Taking it is one upsert that only matches an expired lease. While
+    another process holds it, the insert collides with the lease's
+    ``_id`` and is retried. The holder deletes the lease when done, and a
+    holder that died loses it after ``seconds``.
+    """
+    seconds = RANK_LOCK_SECONDS if seconds is None else seconds
+    holder = uuid.uuid4().hex
+    while True:
+        now = time.time()
+        try:
+            locks.update_one(
+                {'_id': name, 'expires': {'$lt': now}},
+                {'$set': {'holder': holder, 'expires': now + seconds}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            time.sleep(0.005)
+    try:
+        yield
+    finally:
+        locks.delete_one({'_id': name, 'holder': holder})
+
+
+def _delete_entry(entry):
+    rank = entry.rank
+    entry.delete()
+    _shift_ranks(rank + 1, Leaderboard.objects.count() + 1, -1, None)
+    bump_version(Leaderboard)
+
+
+def remove_entry(entry):
+    """Delete a leaderboard entry and close the gap it leaves in the ranks."""
+    with rank_lock():
+        # Another process may have moved or removed it since it was read.
+        entry.rank = Leaderboard.objects.filter(pk=entry.pk).values_list('rank', flat=True).first()
+        if entry.rank is not None:
+            _delete_entry(entry)
+
+
+def activity_totals(activity):
+    """Return the ``(calories, duration, distance)`` an activity contributes."""
+    return activity.calories, activity.duration, activity.distance or 0.0
+
+
+def rebuild_leaderboard():
+    """
+    Recompute every leaderboard entry from the activities collection.
+
+    Totals and ranks come from a single aggregation, plus the rollups of any
+    archived months. Used for seeding and repairs; regular writes go through
+    :func:`apply_activity_delta`.
+    """
+    ranked = with_archived_totals(ranked_user_totals())
+    teams = dict(
+        User.objects.filter(pk__in=[user_id for user_id, _, _ in ranked]).values_list('id', 'team_id')
+    )
+    # Insert in user order so ``id`` grows with ``user_id``, which keeps the
+    # (-total_calories, id) rank order in line with the precomputed ranks.
+    entries = [
+        Leaderboard(
+            user_id=user_id,
+            team_id=teams.get(user_id) or 0,
+            total_calories=totals['total_calories'],
+            total_duration=totals['total_duration'],
+            total_distance=totals['total_distance'],
+            rank=rank,
+        )
+        for user_id, totals, rank in sorted(ranked, key=lambda row: row[0])
+    ]
+
+    with rank_lock():
+        # One DELETE: a per-row delete would send leaderboard_deleted for each entry.
+        delete_all(Leaderboard)
+        Leaderboard.objects.bulk_create(entries, batch_size=1000)
+    leaderboard_index.reset()
+    window_rankings.reset()
+    # Other processes reload their index when they see this.
+    bump_version(REBUILDS)
+    bump_version(Leaderboard)
+    return len(entries)
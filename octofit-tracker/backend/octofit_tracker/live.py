@@ -0,0 +1,237 @@
+"""
+Live leaderboard updates pushed over Server-Sent Events.
+
+One :class:`LeaderboardFeed` per process watches the leaderboard's
+version (caching.py) once per ``LIVE_LEADERBOARD_WINDOW`` seconds. When
+it has moved, the feed reloads the first ranks and broadcasts only what
+changed ("user 7 moved from 14 to 9"). Streams only report the top N, so
+the feed reads the first ``API_MAX_PAGE_SIZE`` ranks through
+``leaderboard_rank_idx``, plus the users who dropped out of them, rather
+than the whole board. However many activity writes land in one
+window, subscribers get one diff. The version is a counter in the
+database that every process bumps, so watching it rather than local
+signals also picks up writes made by other worker processes.
+
+:func:`leaderboard_stream` is a plain ASGI app, mounted by asgi.py at
+``/api/leaderboard/stream/``. Django 4.1 cannot stream from an async
+iterator, so the stream bypasses the view layer.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .async_views import run_blocking
+from .caching import model_version
+from .models import Leaderboard
+
+STREAM_PATH = '/api/leaderboard/stream/'
+# Events buffered per subscriber before it is told to resync instead.
+QUEUE_SIZE = 64
+KEEPALIVE_SECONDS = 15
+
+
+def load_ranks(count, user_ids=()):
+    """
+    Return ``{user_id: (rank, total_calories)}`` for the first ``count`` ranks.
+
+    The entries of ``user_ids`` are included wherever they rank, so a user
+    leaving the slice is reported with their new rank.
+    """
+    fields = ('user_id', 'rank', 'total_calories')
+    rows = Leaderboard.objects.order_by('rank', 'id').values_list(*fields)[:count]
+    ranks = {user_id: (rank, total) for user_id, rank, total in rows}
+    missing = set(user_ids) - ranks.keys()
+    if missing:
+        rows = Leaderboard.objects.filter(user_id__in=missing).values_list(*fields)
+        ranks.update((user_id, (rank, total)) for user_id, rank, total in rows)
+    return ranks
+
+
+def rank_deltas(before, after):
+    """
+    Diff two :func:`load_ranks` snapshots.
+
+    Returns ``{'user_id', 'from', 'to', 'total_calories'}`` dicts, best new
+    rank first, for every user whose rank or total changed. ``from`` is None
+    for entries new to the watched slice; ``to`` and ``total_calories`` are
+    None for removed ones.
+    """
+    deltas = []
+    for user_id in before.keys() | after.keys():
+        old, new = before.get(user_id), after.get(user_id)
+        if old == new:
+            continue
+        deltas.append({
+            'user_id': user_id,
+            'from': old[0] if old else None,
+            'to': new[0] if new else None,
+            'total_calories': new[1] if new else None,
+        })
+    deltas.sort(key=lambda delta: (delta['to'] is None, delta['to'] or 0, delta['user_id']))
+    return deltas
+
+
+def within_top(deltas, top):
+    """Keep the deltas that enter, leave or move within the first ``top`` ranks."""
+    return [
+        delta for delta in deltas
+        if (delta['from'] is not None and delta['from'] <= top)
+        or (delta['to'] is not None and delta['to'] <= top)
+    ]
+
+
+class LeaderboardFeed:
+    """Coalesce leaderboard changes and fan the resulting deltas out to subscribers."""
+
+    def __init__(self, window=None, depth=None):
+        self.window = window
+        self.depth = depth
+        self.subscribers = set()
+        self.ranks = None
+        self.version = None
+        self._task = None
+
+    def get_window(self):
+        if self.window is not None:
+            return self.window
+        return settings.LIVE_LEADERBOARD_WINDOW
+
+    def get_depth(self):
+        """How many ranks the feed watches: the largest ``top`` a stream may ask for."""
+        return self.depth or settings.API_MAX_PAGE_SIZE
+
+    async def subscribe(self):
+        """Register a subscriber and return its event queue, with the ranks loaded."""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        if self.ranks is None or self._task is None or self._task.done():
+            await self.refresh()
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def _watch(self):
+        while self.subscribers:
+            await asyncio.sleep(self.get_window())
+            await self.refresh()
+        # Nobody is listening: forget the ranks rather than let them go stale.
+        self.ranks = self.version = None
+
+    async def refresh(self):
+        """Reload the ranks if the leaderboard changed and broadcast the difference."""
+        version = await run_blocking(model_version, Leaderboard)
+        if version == self.version and self.ranks is not None:
+            return
+        depth = self.get_depth()
+        ranks = await run_blocking(load_ranks, depth, list(self.ranks or ()))
+        if self.ranks is not None:
+            deltas = rank_deltas(self.ranks, ranks)
+            if deltas:
+                self.publish({'event': 'ranks', 'deltas': deltas})
+        self.ranks = {user_id: entry for user_id, entry in ranks.items() if entry[0] <= depth}
+        self.version = version
+
+    def publish(self, event):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too far behind to catch up from deltas: drop the backlog.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'event': 'resync'})
+
+    def top(self, count):
+        """The first ``count`` entries of the loaded ranks as ``{'user_id', 'rank', 'total_calories'}``."""
+        ordered = sorted(self.ranks.items(), key=lambda item: item[1][0])[:count]
+        return [
+            {'user_id': user_id, 'rank': rank, 'total_calories': total}
+            for user_id, (rank, total) in ordered
+        ]
+
+
+feed = LeaderboardFeed()
+
+
+def sse_message(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _respond(send, status, body, content_type=b'application/json'):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', content_type)]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def leaderboard_stream(scope, receive, send):
+    """
+    ASGI app streaming leaderboard rank deltas as Server-Sent Events.
+
+    ``GET /api/leaderboard/stream/?top=N`` first sends a ``snapshot`` event
+    with the top N entries. It then sends ``ranks`` events with the deltas
+    that touch the top N. A ``resync`` event means the client fell behind
+    and should fetch a fresh snapshot by reconnecting.
+    """
+    if scope['method'] != 'GET':
+        await _respond(send, 405, b'{"detail":"Method not allowed."}')
+        return
+    query = parse_qs(scope['query_string'].decode())
+    try:
+        top = int(query.get('top', ['100'])[0])
+        if top < 1:
+            raise ValueError
+    except ValueError:
+        await _respond(send, 400, b'{"top":["Expected a positive integer."]}')
+        return
+    top = min(top, settings.API_MAX_PAGE_SIZE)
+
+    queue = await feed.subscribe()
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        headers = [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Stop nginx and similar proxies from buffering the stream.
+            (b'x-accel-buffering', b'no'),
+        ]
+        if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+            headers.append((b'access-control-allow-origin', b'*'))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({
+            'type': 'http.response.body', 'more_body': True,
+            'body': sse_message('snapshot', {'top': top, 'entries': feed.top(top)}),
+        })
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {event, disconnect}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnect in done:
+                event.cancel()
+                return
+            if event not in done:
+                event.cancel()
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            message = event.result()
+            if message['event'] == 'resync':
+                await send({'type': 'http.response.body', 'body': sse_message('resync', {}), 'more_body': True})
+                continue
+            deltas = within_top(message['deltas'], top)
+            if deltas:
+                await send({
+                    'type': 'http.response.body', 'more_body': True,
+                    'body': sse_message('ranks', {'deltas': deltas}),
+                })
+    finally:
+        feed.unsubscribe(queue)
+        disconnect.cancel()
@@ -0,0 +1,146 @@
+"""
+Deterministic synthetic data for load testing.
+
+Users are split into fixed-size chunks and every chunk draws its
+activities from its own generator seeded with ``(seed, chunk_index + 1)``
+(stream 0 assigns teams), so
+the data depends only on the seed and anchor, never on how many workers
+inserted it. Columns are generated with NumPy and leaderboard totals come
+from ``np.bincount`` over the generated columns rather than a re-read.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.db import connections
+
+from .models import Activity, Leaderboard
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing']
+# Indexes into ACTIVITY_TYPES that record a distance
+DISTANCE_TYPES = 3
+HISTORY_SECONDS = 30 * 24 * 3600
+
+
+def generate_activity_columns(seed, chunk_index, user_ids, per_user, anchor_ts, team_ids=None):
+    """
+    Generate the activity columns for one chunk of users.
+
+    Returns a dict of equal-length arrays: ``user_id``, ``team_id`` (when
+    ``team_ids`` parallel to ``user_ids`` is given), ``type`` (index into
+    ACTIVITY_TYPES), ``duration``, ``distance`` (NaN when not recorded),
+    ``calories`` and ``timestamp`` (epoch seconds).
+    """
+    rng = np.random.default_rng([seed, chunk_index + 1])
+    count = len(user_ids) * per_user
+    types = rng.integers(0, len(ACTIVITY_TYPES), count)
+    duration = rng.integers(15, 121, count)
+    distance = np.round(rng.uniform(1.0, 20.0, count), 2)
+    distance[types >= DISTANCE_TYPES] = np.nan
+    calories = duration * rng.integers(5, 16, count)
+    timestamp = anchor_ts - rng.integers(0, HISTORY_SECONDS, count)
+    columns = {
+        'user_id': np.repeat(np.asarray(user_ids, dtype=np.int64), per_user),
+        'type': types,
+        'duration': duration,
+        'distance': distance,
+        'calories': calories,
+        'timestamp': timestamp,
+    }
+    if team_ids is not None:
+        columns['team_id'] = np.repeat(np.asarray(team_ids, dtype=np.int64), per_user)
+    return columns
+
+
+def columns_to_activities(columns):
+    """Build unsaved Activity instances from generated columns."""
+    created_at = datetime.now(dt_timezone.utc)
+    distances = columns['distance'].tolist()
+    count = len(distances)
+    team_ids = columns['team_id'].tolist() if 'team_id' in columns else [None] * count
+    return [
+        Activity(
+            user_id=user_id,
+            team_id=team_id,
+            activity_type=ACTIVITY_TYPES[type_index],
+            duration=duration,
+            distance=None if distance != distance else distance,
+            calories=calories,
+            date=datetime.fromtimestamp(timestamp, dt_timezone.utc),
+            created_at=created_at,
+        )
+        for user_id, team_id, type_index, duration, distance, calories, timestamp in zip(
+            columns['user_id'].tolist(),
+            team_ids,
+            columns['type'].tolist(),
+            columns['duration'].tolist(),
+            distances,
+            columns['calories'].tolist(),
+            columns['timestamp'].tolist(),
+        )
+    ]
+
+
+def chunk_totals(columns, user_ids):
+    """Sum calories, duration and distance per user of a chunk in one vectorized pass."""
+    positions = np.searchsorted(user_ids, columns['user_id'])
+    size = len(user_ids)
+    return (
+        np.bincount(positions, weights=columns['calories'], minlength=size).astype(np.int64),
+        np.bincount(positions, weights=columns['duration'], minlength=size).astype(np.int64),
+        np.bincount(positions, weights=np.nan_to_num(columns['distance']), minlength=size),
+    )
+
+
+def insert_chunk(task):
+    """
+    Generate and insert one chunk of activities; runs in worker processes.
+
+    Returns the chunk's per-user ``(calories, duration, distance)`` totals.
+    """
+    seed, chunk_index, user_ids, team_ids, per_user, anchor_ts, batch_size = task
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    columns = generate_activity_columns(seed, chunk_index, user_ids, per_user, anchor_ts, team_ids)
+    Activity.objects.bulk_create(columns_to_activities(columns), batch_size=batch_size)
+    return chunk_index, chunk_totals(columns, user_ids)
+
+
+def worker_init():
+    # Forked workers must not share the parent's database sockets.
+    connections.close_all()
+
+
+def build_leaderboard(user_ids, team_ids, calories, duration, distance):
+    """
+    Build ranked leaderboard entries from per-user total arrays.
+
+    Ranks follow the incremental ordering in leaderboard.py: total
+    calories descending, ties broken by insertion (user) order.
+    """
+    order = np.lexsort((user_ids, -calories))
+    ranks = np.empty(len(user_ids), dtype=np.int64)
+    ranks[order] = np.arange(1, len(user_ids) + 1)
+    return [
+        Leaderboard(
+            user_id=user_id,
+            team_id=team_id,
+            total_calories=total_calories,
+            total_duration=total_duration,
+            total_distance=round(total_distance, 2),
+            rank=rank,
+        )
+        for user_id, team_id, total_calories, total_duration, total_distance, rank in zip(
+            user_ids.tolist(), team_ids.tolist(), calories.tolist(),
+            duration.tolist(), distance.tolist(), ranks.tolist(),
+        )
+    ]
+
+
+def anchor_timestamp(anchor=None):
+    """
+    Epoch seconds of midnight UTC on ``anchor`` (a date), defaulting to today.
+
+    Generated activities fall in the 30 days before this instant.
+    """
+    if anchor is None:
+        anchor = datetime.now(dt_timezone.utc).date()
+    return int(datetime.combine(anchor, datetime.min.time(), dt_timezone.utc).timestamp())
@@ -0,0 +1,44 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from octofit_tracker.archive import archivable_months, archive_month
+
+UNITS = {'d': 1, 'w': 7}
+
+
+def parse_age(value):
+    """Parse an age such as ``365d`` or ``52w`` into a timedelta."""
+    match = re.fullmatch(r'(\d+)([dw])', value.strip())
+    if match is None:
+        raise CommandError(f'Invalid age {value!r}; use a number of days or weeks such as 365d or 52w')
+    return timedelta(days=int(match.group(1)) * UNITS[match.group(2)])
+
+
+class Command(BaseCommand):
+    help = 'Move whole months of old activities into compressed archive files, keeping their rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', default='365d',
+                            help='Archive the months that ended before this age, e.g. 365d or 52w')
+        parser.add_argument('--dry-run', action='store_true', help='List the months without archiving them')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - parse_age(options['older_than'])
+        months = archivable_months(cutoff)
+        if not months:
+            self.stdout.write(self.style.SUCCESS(f'✓ No activities in months before {cutoff:%Y-%m}'))
+            return
+        if options['dry_run']:
+            for month in months:
+                self.stdout.write(f'  - Would archive {month:%Y-%m}')
+            return
+
+        self.stdout.write(self.style.WARNING(f'Archiving {len(months)} month(s) before {cutoff:%Y-%m}...'))
+        for month in months:
+            archive = archive_month(month)
+            self.stdout.write(f'  - {month:%Y-%m}: {archive.row_count} activities, '
+                              f'{archive.size_bytes / 1024:.1f} KiB -> {archive.path}')
+        self.stdout.write(self.style.SUCCESS('✓ Activities archived!'))
@@ -0,0 +1,97 @@
+import time
+from datetime import date
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from octofit_tracker.models import User, Team, Activity, ActivityArchive, Leaderboard, Workout, delete_all
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.signals import reset_derived
+
+
+class Command(BaseCommand):
+    help = 'Replace the database contents with deterministic synthetic data for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help='Number of users to create')
+        parser.add_argument('--teams', type=int, default=20, help='Number of teams to spread users over')
+        parser.add_argument('--activities-per-user', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=1, help='Parallel insert processes')
+        parser.add_argument('--chunk-users', type=int, default=1000,
+                            help='Users per generation chunk; part of the seed, so keep it fixed to reproduce a run')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create round-trip')
+        parser.add_argument('--anchor', type=date.fromisoformat, default=None,
+                            help='Date (YYYY-MM-DD) activities lead up to; defaults to today. '
+                                 'Pass it to reproduce a run on another day.')
+        parser.add_argument('--skip-rollups', action='store_true', help='Do not rebuild the daily rollups')
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from octofit_tracker import loadgen
+        except ImportError:
+            raise CommandError('generate_load requires numpy (pip install numpy)')
+
+        started = time.perf_counter()
+        users, teams = options['users'], options['teams']
+        per_user, chunk_users = options['activities_per_user'], options['chunk_users']
+        if min(users, teams, per_user, chunk_users, options['workers'], options['batch_size']) < 1:
+            raise CommandError('All counts must be positive')
+
+        self.stdout.write(self.style.WARNING('Clearing existing data...'))
+        delete_all(Activity, ActivityArchive, Leaderboard, User, Team, Workout)
+        reset_derived()
+
+        Team.objects.bulk_create(
+            [Team(name=f'Load Team {i}', description='Synthetic load-test team') for i in range(teams)]
+        )
+        team_ids = np.array(Team.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        rng = np.random.default_rng([options['seed'], 0])
+        user_teams = team_ids[rng.integers(0, teams, users)]
+        User.objects.bulk_create(
+            (
+                User(name=f'Load User {i}', email=f'user{i}@load.octofit.test',
+                     password='password123', team_id=team_id)
+                for i, team_id in enumerate(user_teams.tolist())
+            ),
+            batch_size=options['batch_size'],
+        )
+        # Users were inserted in index order, so ascending ids line up with user_teams.
+        user_ids = np.array(User.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        self.stdout.write(self.style.SUCCESS(f'Created {teams} teams and {users} users'))
+
+        anchor_ts = loadgen.anchor_timestamp(options['anchor'])
+        tasks = [
+            (options['seed'], index, user_ids[start:start + chunk_users].tolist(),
+             user_teams[start:start + chunk_users].tolist(), per_user, anchor_ts, options['batch_size'])
+            for index, start in enumerate(range(0, users, chunk_users))
+        ]
+        totals = [None] * len(tasks)
+        if options['workers'] > 1:
+            connections.close_all()
+            with get_context('fork').Pool(options['workers'], initializer=loadgen.worker_init) as pool:
+                for index, chunk in pool.imap_unordered(loadgen.insert_chunk, tasks):
+                    totals[index] = chunk
+                    self.stdout.write(f'  chunk {index + 1}/{len(tasks)} inserted')
+        else:
+            for task in tasks:
+                index, chunk = loadgen.insert_chunk(task)
+                totals[index] = chunk
+                self.stdout.write(f'  chunk {index + 1}/{len(tasks)} inserted')
+        self.stdout.write(self.style.SUCCESS(f'Created {users * per_user} activities'))
+
+        calories, duration, distance = (np.concatenate(column) for column in zip(*totals))
+        entries = loadgen.build_leaderboard(user_ids, user_teams, calories, duration, distance)
+        Leaderboard.objects.bulk_create(entries, batch_size=options['batch_size'])
+        # bulk_create sends no signals, so drop what was derived from the empty tables.
+        reset_derived()
+        self.stdout.write(self.style.SUCCESS(f'Created {len(entries)} leaderboard entries'))
+
+        if not options['skip_rollups']:
+            rebuild_rollups()
+            self.stdout.write(self.style.SUCCESS('Rebuilt daily rollups'))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'✓ Load data generated in {elapsed:.1f}s'))
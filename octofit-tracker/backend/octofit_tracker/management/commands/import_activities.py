@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from octofit_tracker import importers
+from octofit_tracker.idempotency import stored_date
+from octofit_tracker.ingest import insert_activities
+from octofit_tracker.models import Activity, User
+
+
+class Command(BaseCommand):
+    help = 'Import historical activities from CSV, JSON or GPX exports, parsing files in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files to import')
+        parser.add_argument('--format', choices=importers.FORMATS, required=True,
+                            help='csv and json rows need email, activity_type, duration, calories and date')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel parsing processes')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows inserted per batch')
+        parser.add_argument('--chunk-mb', type=float, default=8,
+                            help='Size of the pieces CSV and NDJSON files are split into for the workers')
+        parser.add_argument('--checkpoint', default='import_activities.checkpoint',
+                            help='File recording finished pieces, so a rerun after a crash resumes')
+        parser.add_argument('--email', help='Owner of GPX tracks that name no author')
+
+    def handle(self, *args, **options):
+        paths = [os.path.abspath(path) for path in options['paths']]
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            raise CommandError(f'No such file: {", ".join(missing)}')
+        if min(options['workers'], options['batch_size']) < 1 or options['chunk_mb'] <= 0:
+            raise CommandError('--workers, --batch-size and --chunk-mb must be positive')
+
+        checkpoint = self.load_checkpoint(options['checkpoint'], paths, options['format'])
+        done = set(checkpoint['done'])
+        chunk_bytes = max(int(options['chunk_mb'] * 1024 * 1024), 1)
+        units = [
+            unit
+            for path in paths
+            for unit in importers.plan_units(path, options['format'], chunk_bytes)
+            if importers.unit_key(unit) not in done
+        ]
+        if done:
+            self.stdout.write(self.style.WARNING(f'Resuming: {len(done)} piece(s) already imported'))
+
+        users = {email.lower(): pk for pk, email in User.objects.values_list('id', 'email')}
+        # Dedupe against what is stored and against earlier rows of this import.
+        # Dates are compared as stored, or a re-import on MongoDB would not match.
+        stored = Activity.objects.values_list('user_id', 'date', 'activity_type').iterator(chunk_size=10000)
+        seen = {(user_id, stored_date(date), activity_type) for user_id, date, activity_type in stored}
+        self.stdout.write(self.style.WARNING(
+            f'Importing {len(units)} piece(s) of {len(paths)} file(s) with {options["workers"]} worker(s)...'
+        ))
+
+        started = time.perf_counter()
+        batch, pending = [], []
+        try:
+            for unit, rows, rejected, errors in self.parse(units, users, options):
+                for row in rows:
+                    key = (row['user_id'], stored_date(row['date']), row['activity_type'])
+                    if key in seen:
+                        checkpoint['duplicates'] += 1
+                        continue
+                    seen.add(key)
+                    batch.append(Activity(**row))
+                checkpoint['rejected'] += rejected
+                for error in errors:
+                    self.stdout.write(self.style.ERROR(f'  ! {error["location"]}: {error["errors"]}'))
+                pending.append(importers.unit_key(unit))
+                if len(batch) >= options['batch_size']:
+                    self.flush(batch, pending, checkpoint, options)
+                    batch, pending = [], []
+                    self.progress(checkpoint, started)
+        except importers.MalformedFileError as exc:
+            # Keep what the other pieces produced; a rerun after fixing the file resumes.
+            self.flush(batch, pending, checkpoint, options)
+            raise CommandError(str(exc))
+        self.flush(batch, pending, checkpoint, options)
+        elapsed = time.perf_counter() - started
+
+        if os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        imported = checkpoint['inserted'] + checkpoint['duplicates'] + checkpoint['rejected']
+        self.stdout.write(
+            f'  - {checkpoint["inserted"]} inserted, {checkpoint["duplicates"]} duplicates skipped, '
+            f'{checkpoint["rejected"]} rejected in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} rows/s)'
+        )
+        self.stdout.write(self.style.SUCCESS('✓ Activities imported!'))
+
+    def parse(self, units, users, options):
+        if options['workers'] == 1 or len(units) <= 1:
+            importers.configure(users, options['email'])
+            yield from map(importers.parse_unit, units)
+            return
+        # Close the parent's connections so no child inherits their sockets.
+        connections.close_all()
+        context = get_context('fork')
+        with context.Pool(options['workers'], initializer=importers.worker_init,
+                          initargs=(users, options['email'])) as pool:
+            yield from pool.imap_unordered(importers.parse_unit, units)
+
+    def flush(self, batch, pending, checkpoint, options):
+        """Insert a batch, then record the pieces it completes."""
+        if batch:
+            insert_activities(batch, options['batch_size'])
+            checkpoint['inserted'] += len(batch)
+        checkpoint['done'].extend(pending)
+        partial = f'{options["checkpoint"]}.partial'
+        with open(partial, 'w') as output:
+            json.dump(checkpoint, output)
+        os.replace(partial, options['checkpoint'])
+
+    def progress(self, checkpoint, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'  {checkpoint["inserted"]} inserted ({checkpoint["inserted"] / elapsed:.0f} rows/s)')
+
+    def load_checkpoint(self, path, paths, file_format):
+        fresh = {'paths': paths, 'format': file_format, 'done': [], 'inserted': 0, 'duplicates': 0, 'rejected': 0}
+        if not os.path.exists(path):
+            return fresh
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get('paths') != paths or checkpoint.get('format') != file_format:
+            raise CommandError(f'{path} belongs to another import; remove it or pass --checkpoint')
+        return checkpoint
@@ -2,7 +2,10 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
 import random
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.models import User, Team, Activity, ActivityArchive, Leaderboard, Workout, delete_all
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.signals import reset_derived
 
 
 class Command(BaseCommand):
@@ -11,12 +14,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write(self.style.WARNING('Clearing existing data...'))
         
-        # Delete existing data using Django ORM
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Workout.objects.all().delete()
+        # Delete existing data with one statement per table
+        delete_all(Activity, ActivityArchive, Leaderboard, User, Team, Workout)
+        reset_derived()
         
         self.stdout.write(self.style.SUCCESS('Existing data cleared.'))
         self.stdout.write(self.style.WARNING('Inserting test data...'))
@@ -83,7 +83,7 @@ class Command(BaseCommand):
         
         # Create Activities
         activity_types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing']
-        activities_created = 0
+        activities = []
         
         for user in all_users:
             # Create 5-10 random activities for each user
@@ -95,43 +95,24 @@ class Command(BaseCommand):
                 calories = duration * random.randint(5, 15)
                 days_ago = random.randint(0, 30)
                 
-                Activity.objects.create(
+                activities.append(Activity(
                     user_id=user.id,
+                    team_id=user.team_id,
                     activity_type=activity_type,
                     duration=duration,
                     distance=distance,
                     calories=calories,
                     date=timezone.now() - timedelta(days=days_ago),
                     created_at=timezone.now()
-                )
-                activities_created += 1
+                ))
         
-        self.stdout.write(self.style.SUCCESS(f'Created {activities_created} activities'))
+        # bulk_create skips the per-activity signals; the leaderboard is rebuilt below
+        Activity.objects.bulk_create(activities)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(activities)} activities'))
         
-        # Create Leaderboard entries
-        leaderboard_entries = 0
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=user.id)
-            total_calories = sum(a.calories for a in user_activities)
-            total_duration = sum(a.duration for a in user_activities)
-            total_distance = sum(a.distance for a in user_activities if a.distance)
-            
-            Leaderboard.objects.create(
-                user_id=user.id,
-                team_id=user.team_id,
-                total_calories=total_calories,
-                total_duration=total_duration,
-                total_distance=round(total_distance, 2),
-                rank=0,  # Will be calculated later
-                updated_at=timezone.now()
-            )
-            leaderboard_entries += 1
-        
-        # Update ranks based on total_calories
-        leaderboard = Leaderboard.objects.all().order_by('-total_calories')
-        for rank, entry in enumerate(leaderboard, start=1):
-            entry.rank = rank
-            entry.save()
+        # Create Leaderboard entries with totals and ranks in a single pass
+        leaderboard_entries = rebuild_leaderboard()
+        rebuild_rollups()
         
         self.stdout.write(self.style.SUCCESS(f'Created {leaderboard_entries} leaderboard entries'))
         
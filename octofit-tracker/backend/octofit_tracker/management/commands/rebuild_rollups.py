@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.models import TeamDailyStats, UserDailyStats
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-day user and team activity rollups from the activities collection'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Rebuilding activity rollups...'))
+        counts = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS('✓ Rollups rebuilt!'))
+        self.stdout.write(self.style.SUCCESS(f'  - User days: {counts[UserDailyStats]}'))
+        self.stdout.write(self.style.SUCCESS(f'  - Team days: {counts[TeamDailyStats]}'))
@@ -0,0 +1,46 @@
+import time
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from octofit_tracker import jobs
+
+
+def work(poll, burst):
+    try:
+        return jobs.work(poll=poll, burst=burst)
+    except KeyboardInterrupt:
+        return 0
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (leaderboard and rollup rebuilds, bulk imports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes')
+        parser.add_argument('--poll', type=float, default=None,
+                            help='Seconds an idle worker waits between polls; defaults to JOB_POLL_SECONDS')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be positive')
+        started = time.perf_counter()
+        self.stdout.write(self.style.WARNING(f'Running jobs with {workers} worker(s)...'))
+        if workers == 1:
+            count = work(options['poll'], options['burst'])
+        else:
+            # Forked workers must open their own database connections.
+            connections.close_all()
+            context = get_context('fork')
+            with context.Pool(workers) as pool:
+                try:
+                    count = sum(pool.starmap(work, [(options['poll'], options['burst'])] * workers))
+                except KeyboardInterrupt:
+                    pool.terminate()
+                    raise
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Ran {count} job(s) in {time.perf_counter() - started:.1f}s'
+        ))
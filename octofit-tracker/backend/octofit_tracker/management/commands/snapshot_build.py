@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.snapshot import Snapshot, build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write the memory-mapped snapshot of the leaderboard, users and activities that workers warm up from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help=f'Snapshot file to write (default: SNAPSHOT_PATH, {settings.SNAPSHOT_PATH})')
+        parser.add_argument('--chunk-size', type=int, default=20000, help='Rows read per database batch')
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.SNAPSHOT_PATH
+        self.stdout.write(self.style.WARNING(f'Building snapshot {path}...'))
+        started = time.perf_counter()
+        header = build_snapshot(path, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        for table, layout in header['tables'].items():
+            self.stdout.write(f'  - {table}: {layout["rows"]} rows')
+
+        started = time.perf_counter()
+        mapped = Snapshot(path)
+        self.stdout.write(f'  - {mapped.stat.st_size / 1024:.1f} KiB, version {header["version"]}, '
+                          f'built in {elapsed:.2f}s, mapped in {(time.perf_counter() - started) * 1000:.1f}ms')
+        self.stdout.write(self.style.SUCCESS('✓ Snapshot built!'))
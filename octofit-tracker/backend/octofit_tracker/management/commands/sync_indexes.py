@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.aggregation import mongo_database
+from octofit_tracker.indexes import sync_mongo_indexes, sync_sql_indexes
+
+
+class Command(BaseCommand):
+    help = 'Create the indexes declared in Meta.indexes that are missing and report unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without creating anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        db = mongo_database()
+        if db is None:
+            self.stdout.write(self.style.WARNING('Not on MongoDB; checking the SQL schema instead.'))
+            report = sync_sql_indexes(dry_run=dry_run)
+        else:
+            report = sync_mongo_indexes(db, dry_run=dry_run)
+
+        verb = 'Would create' if dry_run else 'Created'
+        for table, changes in sorted(report.items()):
+            for name in changes['created']:
+                self.stdout.write(self.style.SUCCESS(f'  {verb} {table}.{name}'))
+            for name in changes.get('unused', []):
+                self.stdout.write(self.style.WARNING(f'  Unused since server start: {table}.{name}'))
+            for name in changes.get('undeclared', []):
+                self.stdout.write(self.style.WARNING(f'  Not declared on any model: {table}.{name}'))
+
+        created = sum(len(changes['created']) for changes in report.values())
+        self.stdout.write(self.style.SUCCESS(f'✓ Indexes in sync ({verb.lower()} {created})'))
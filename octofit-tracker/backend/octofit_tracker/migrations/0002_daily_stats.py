@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('activity_count', models.IntegerField(default=0)),
+                ('duration_sum', models.IntegerField(default=0)),
+                ('duration_min', models.IntegerField(blank=True, null=True)),
+                ('duration_max', models.IntegerField(blank=True, null=True)),
+                ('distance_sum', models.FloatField(default=0.0)),
+                ('distance_min', models.FloatField(blank=True, null=True)),
+                ('distance_max', models.FloatField(blank=True, null=True)),
+                ('calories_sum', models.IntegerField(default=0)),
+                ('calories_min', models.IntegerField(blank=True, null=True)),
+                ('calories_max', models.IntegerField(blank=True, null=True)),
+                ('user_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'User daily stats',
+                'db_table': 'user_daily_stats',
+                'unique_together': {('user_id', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TeamDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('activity_count', models.IntegerField(default=0)),
+                ('duration_sum', models.IntegerField(default=0)),
+                ('duration_min', models.IntegerField(blank=True, null=True)),
+                ('duration_max', models.IntegerField(blank=True, null=True)),
+                ('distance_sum', models.FloatField(default=0.0)),
+                ('distance_min', models.FloatField(blank=True, null=True)),
+                ('distance_max', models.FloatField(blank=True, null=True)),
+                ('calories_sum', models.IntegerField(default=0)),
+                ('calories_min', models.IntegerField(blank=True, null=True)),
+                ('calories_max', models.IntegerField(blank=True, null=True)),
+                ('team_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'Team daily stats',
+                'db_table': 'team_daily_stats',
+                'unique_together': {('team_id', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+def copy_team_ids(apps, schema_editor):
+    User = apps.get_model('octofit_tracker', 'User')
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    for user_id, team_id in User.objects.exclude(team_id=None).values_list('id', 'team_id'):
+        Activity.objects.filter(user_id=user_id).update(team_id=team_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_secondary_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='team_id',
+            field=models.IntegerField(blank=True, help_text="Author's team, copied from User.team_id", null=True),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['team_id', '-date'], name='activity_team_date_idx'),
+        ),
+        migrations.RunPython(copy_team_ids, migrations.RunPython.noop),
+    ]
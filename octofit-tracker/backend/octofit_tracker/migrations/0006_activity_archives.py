@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0005_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the archived month', unique=True)),
+                ('path', models.CharField(help_text='gzip-compressed NDJSON file, relative to ACTIVITY_ARCHIVE_DIR', max_length=500)),
+                ('row_count', models.IntegerField(default=0)),
+                ('size_bytes', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'activity_archives',
+                'ordering': ['month'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_activity_archives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, help_text="Hash of the create request's Idempotency-Key or natural key; see idempotency.py", max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='activity',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('idempotency_key',), name='activity_idempotency_key_uniq'),
+        ),
+    ]
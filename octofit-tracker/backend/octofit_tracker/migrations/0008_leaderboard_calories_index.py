@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_activity_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-total_calories', 'id'], name='leaderboard_calories_idx'),
+        ),
+    ]
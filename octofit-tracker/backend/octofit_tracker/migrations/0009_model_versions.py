@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_leaderboard_calories_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Model label, e.g. octofit_tracker.team', max_length=200, unique=True)),
+                ('version', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'model_versions',
+            },
+        ),
+    ]
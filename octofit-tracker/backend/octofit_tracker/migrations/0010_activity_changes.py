@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0009_model_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('op', models.CharField(choices=[('insert', 'Insert'), ('update', 'Update'), ('delete', 'Delete'), ('team', 'Team change')], max_length=10)),
+                ('activity_id', models.IntegerField(blank=True, help_text='None for bulk inserts and team changes', null=True)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('team_id', models.IntegerField(blank=True, help_text="The user's new team, for team changes", null=True)),
+                ('date', models.DateTimeField(blank=True, help_text="The activity's date", null=True)),
+                ('previous_date', models.DateTimeField(blank=True, help_text='Its date before an update', null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'activity_changes',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activitychange',
+            index=models.Index(fields=['created_at', 'id'], name='activity_change_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0010_activity_changes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['created_at', 'id'], name='activity_created_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class User(models.Model):
@@ -10,6 +11,10 @@ class User(models.Model):
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='user_team_idx'),
+            models.Index(fields=['created_at', 'id'], name='user_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -22,6 +27,9 @@ class Team(models.Model):
     
     class Meta:
         db_table = 'teams'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='team_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -29,16 +37,34 @@ class Team(models.Model):
 
 class Activity(models.Model):
     user_id = models.IntegerField()
+    team_id = models.IntegerField(null=True, blank=True, help_text="Author's team, copied from User.team_id")
     activity_type = models.CharField(max_length=100)
     duration = models.IntegerField(help_text="Duration in minutes")
     distance = models.FloatField(null=True, blank=True, help_text="Distance in km")
     calories = models.IntegerField()
     date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    idempotency_key = models.CharField(
+        max_length=64, null=True, blank=True, editable=False,
+        help_text="Hash of the create request's Idempotency-Key or natural key; see idempotency.py"
+    )
     
     class Meta:
         db_table = 'activities'
         verbose_name_plural = 'Activities'
+        indexes = [
+            models.Index(fields=['user_id', '-date'], name='activity_user_date_idx'),
+            models.Index(fields=['team_id', '-date'], name='activity_team_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activity_type_date_idx'),
+            models.Index(fields=['-date', '-id'], name='activity_date_idx'),
+            models.Index(fields=['created_at', 'id'], name='activity_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['idempotency_key'], condition=models.Q(idempotency_key__isnull=False),
+                name='activity_idempotency_key_uniq',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.activity_type} - {self.duration} mins"
@@ -55,6 +81,12 @@ class Leaderboard(models.Model):
     
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['user_id'], name='leaderboard_user_idx'),
+            models.Index(fields=['team_id', '-total_calories'], name='leaderboard_team_idx'),
+            models.Index(fields=['rank', 'id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['-total_calories', 'id'], name='leaderboard_calories_idx'),
+        ]
     
     def __str__(self):
         return f"User {self.user_id} - Rank {self.rank}"
@@ -71,6 +103,159 @@ class Workout(models.Model):
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='workout_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
+
+
+class DailyStats(models.Model):
+    """Per-day sum/count/min/max of activity metrics, maintained by rollups.py."""
+    day = models.DateField()
+    activity_count = models.IntegerField(default=0)
+    duration_sum = models.IntegerField(default=0)
+    duration_min = models.IntegerField(null=True, blank=True)
+    duration_max = models.IntegerField(null=True, blank=True)
+    distance_sum = models.FloatField(default=0.0)
+    distance_min = models.FloatField(null=True, blank=True)
+    distance_max = models.FloatField(null=True, blank=True)
+    calories_sum = models.IntegerField(default=0)
+    calories_min = models.IntegerField(null=True, blank=True)
+    calories_max = models.IntegerField(null=True, blank=True)
+    
+    class Meta:
+        abstract = True
+
+
+class UserDailyStats(DailyStats):
+    user_id = models.IntegerField()
+    
+    class Meta:
+        db_table = 'user_daily_stats'
+        unique_together = ('user_id', 'day')
+        verbose_name_plural = 'User daily stats'
+    
+    def __str__(self):
+        return f"User {self.user_id} - {self.day}"
+
+
+class TeamDailyStats(DailyStats):
+    team_id = models.IntegerField()
+    
+    class Meta:
+        db_table = 'team_daily_stats'
+        unique_together = ('team_id', 'day')
+        verbose_name_plural = 'Team daily stats'
+    
+    def __str__(self):
+        return f"Team {self.team_id} - {self.day}"
+
+
+class Job(models.Model):
+    """A unit of background work, queued by the API and run by ``manage.py run_jobs``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    
+    kind = models.CharField(max_length=100)
+    payload = models.TextField(default='{}', help_text="JSON keyword arguments for the job")
+    dedup_key = models.CharField(max_length=200, help_text="Identical pending jobs share this key")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.FloatField(default=0.0, help_text="Fraction complete, 0 to 1")
+    message = models.TextField(blank=True)
+    result = models.TextField(blank=True, help_text="JSON result of a finished job")
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_idx'),
+            models.Index(fields=['dedup_key', 'status'], name='job_dedup_idx'),
+            models.Index(fields=['-created_at', '-id'], name='job_created_idx'),
+        ]
+        constraints = [
+            # At most one pending job per key, however many workers enqueue at once.
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status='pending'), name='job_pending_dedup_uniq',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class ActivityChange(models.Model):
+    """One write to activities, logged so other processes can update their in-memory state (changes.py)."""
+    INSERT = 'insert'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    TEAM = 'team'
+    OP_CHOICES = [(INSERT, 'Insert'), (UPDATE, 'Update'), (DELETE, 'Delete'), (TEAM, 'Team change')]
+    
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    activity_id = models.IntegerField(null=True, blank=True, help_text="None for bulk inserts and team changes")
+    user_id = models.IntegerField(null=True, blank=True)
+    team_id = models.IntegerField(null=True, blank=True, help_text="The user's new team, for team changes")
+    date = models.DateTimeField(null=True, blank=True, help_text="The activity's date")
+    previous_date = models.DateTimeField(null=True, blank=True, help_text="Its date before an update")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'activity_changes'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='activity_change_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.op} activity {self.activity_id} at {self.created_at}"
+
+
+class ModelVersion(models.Model):
+    """A shared version counter per cached model, bumped by every write (caching.py)."""
+    name = models.CharField(max_length=200, unique=True, help_text="Model label, e.g. octofit_tracker.team")
+    version = models.BigIntegerField()
+    
+    class Meta:
+        db_table = 'model_versions'
+    
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class ActivityArchive(models.Model):
+    """A month of activities moved out of ``activities`` into a compressed archive file."""
+    month = models.DateField(unique=True, help_text="First day of the archived month")
+    path = models.CharField(max_length=500, help_text="gzip-compressed NDJSON file, relative to ACTIVITY_ARCHIVE_DIR")
+    row_count = models.IntegerField(default=0)
+    size_bytes = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'activity_archives'
+        ordering = ['month']
+    
+    def __str__(self):
+        return f"Activities {self.month:%Y-%m} ({self.row_count} rows)"
+
+
+def delete_all(*targets):
+    """
+    Delete the rows of each model or queryset in ``targets`` with one DELETE each.
+
+    ``QuerySet.delete()`` loads every row of a model with delete receivers
+    to send them ``post_delete``, even while signals are muted. Reseeding
+    or archiving millions of rows cannot afford that. Nothing is sent
+    here, so callers reset the derived data themselves.
+    """
+    for target in targets:
+        queryset = target.objects.all() if isinstance(target, type) else target
+        queryset._raw_delete(queryset.db)
@@ -0,0 +1,174 @@
+"""
+Per-process MongoDB client and connection pool.
+
+djongo keeps one ``MongoClient`` per database name, but closes it whenever
+a Django connection is closed (every request with ``CONN_MAX_AGE = 0``).
+That throws the pool away and the next request dials MongoDB again. The
+``octofit_tracker.backends.djongo`` engine takes its client from
+:func:`get_client` instead. There is one client per process, shared by
+every thread and database alias, and it is never closed by Django. Pool
+sizes and timeouts come from the ``CLIENT`` settings.
+
+Clients are keyed by process id. A worker forked from a process that
+already had a client (gunicorn ``--preload``, ``run_jobs --workers``)
+builds its own rather than use sockets it shares with its parent.
+
+:data:`metrics` listens to pool events and counts connections created,
+checked out and waiting. ``GET /api/pool/`` reports them. Every client
+also reports its commands to the request instrumentation
+(instrumentation.py).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from pymongo import MongoClient, monitoring
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+from .instrumentation import command_timer
+
+_clients = {}
+_lock = threading.Lock()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Count pool events for this process; :meth:`snapshot` reads them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.waiting = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.cleared = 0
+            self.peak_checked_out = 0
+            self.peak_waiting = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'open': self.created - self.closed,
+                'created': self.created,
+                'closed': self.closed,
+                'checked_out': self.checked_out,
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'pool_cleared': self.cleared,
+                'peak_checked_out': self.peak_checked_out,
+                'peak_waiting': self.peak_waiting,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+metrics = PoolMetrics()
+
+
+def _forked():
+    # Sockets and counters inherited from the parent are not ours to use.
+    _clients.clear()
+    metrics.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forked)
+
+
+def get_client(**options):
+    """
+    Return this process's ``MongoClient`` for ``options`` (the ``CLIENT`` settings).
+
+    Created on first use, with connections opened lazily, so importing the
+    application in a pre-fork master opens nothing.
+    """
+    key = (os.getpid(), repr(sorted(options.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MongoClient(
+                    **options, connect=False, document_class=OrderedDict,
+                    event_listeners=[metrics, command_timer],
+                )
+                _clients[key] = client
+    return client
+
+
+def read_preference(name):
+    """The pymongo read preference for a name such as ``secondaryPreferred``, or None."""
+    return make_read_preference(read_pref_mode_from_name(name), None) if name else None
+
+
+def read_alias():
+    """The database alias list endpoints read from: ``reads`` when it is configured."""
+    alias = settings.LIST_READ_DATABASE
+    return alias if alias in connections.databases else 'default'
+
+
+class ListReadsMixin:
+    """
+    Run a ViewSet's ``list`` queries on the :func:`read_alias` database.
+
+    That alias can prefer secondaries. Lists then take load off the
+    primary, at the cost of possibly lagging the latest writes slightly.
+    Retrieves and writes stay on the primary. Meant for uncached lists:
+    a list in the versioned response cache could otherwise be stored from
+    a lagging secondary under the version of a write it does not show yet.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = queryset.using(read_alias())
+        return queryset
@@ -0,0 +1,137 @@
+"""
+N+1 query detection.
+
+Users, activities and leaderboard entries point at each other through
+plain integer ids rather than foreign keys, so nothing like
+``select_related`` stops a per-row lookup from slipping into a view or
+serializer. :func:`detect` records every query issued inside its block,
+SQL or MongoDB. It normalizes each one to its shape by dropping literal
+values and collapsing ``IN`` lists, and it warns or raises
+:class:`NPlusOneError` when one shape runs more than ``threshold`` times.
+
+The instrumentation middleware wraps every request in :func:`detect`
+when ``QUERY_REPEAT_THRESHOLD`` is set, which it is by default in DEBUG.
+The API tests run every request through it with ``action='raise'``.
+"""
+import json
+import logging
+import re
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_detector = ContextVar('octofit_query_repeats', default=None)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+# MongoDB commands that read or write documents. Cursor continuations
+# (getMore) and session housekeeping are part of one query, not repeats.
+MONGO_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'insert', 'update', 'delete', 'findAndModify'}
+MONGO_SHAPE_KEYS = ('filter', 'pipeline', 'query', 'updates', 'deletes', 'sort', 'projection')
+
+
+class NPlusOneError(AssertionError):
+    """One query shape ran more often than the threshold allows."""
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+def normalize_sql(sql):
+    """Reduce an SQL statement to its shape: no literals, ``IN`` lists of any length alike."""
+    sql = _STRINGS.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBERS.sub('?', sql)
+    sql = _PLACEHOLDER_LISTS.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _structure(value):
+    if isinstance(value, dict):
+        return {key: _structure(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Operators such as $and keep their arity; $in lists of any length look alike.
+        return [_structure(value[0])] if value else []
+    return '?'
+
+
+def normalize_command(name, command):
+    """Reduce a MongoDB command to its shape: collection plus the structure of its query."""
+    parts = {key: command[key] for key in MONGO_SHAPE_KEYS if key in command}
+    encoded = json.dumps(_structure(parts), sort_keys=True, default=str)
+    return f'{name} {command.get(name)} {encoded}'
+
+
+class QueryRepeats:
+    """Count the queries run inside one :func:`detect` block by shape."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.examples = {}
+
+    def record(self, shape, example):
+        self.counts[shape] += 1
+        self.examples.setdefault(shape, example)
+
+    def repeated(self):
+        """``(shape, count, example)`` for every shape over the threshold, most frequent first."""
+        return [
+            (shape, count, self.examples[shape])
+            for shape, count in self.counts.most_common()
+            if count > self.threshold
+        ]
+
+    def report(self, label=''):
+        lines = [f'Query shapes repeated more than {self.threshold} times{f" in {label}" if label else ""}:']
+        for shape, count, example in self.repeated():
+            lines.append(f'  {count}x {shape}')
+            if example != shape:
+                lines.append(f'      e.g. {str(example)[:300]}')
+        return '\n'.join(lines)
+
+
+def record_sql(sql):
+    detector = _detector.get()
+    if detector is not None:
+        detector.record(normalize_sql(sql), sql)
+
+
+def record_command(name, command):
+    detector = _detector.get()
+    if detector is not None and name in MONGO_COMMANDS:
+        detector.record(normalize_command(name, command), command)
+
+
+@contextmanager
+def detect(threshold=None, action=None, label=''):
+    """
+    Watch the queries run inside the block for repeated shapes.
+
+    ``threshold`` and ``action`` (``'warn'`` or ``'raise'``) default to
+    the ``QUERY_REPEAT_THRESHOLD`` and ``QUERY_REPEAT_ACTION`` settings.
+    Yields the :class:`QueryRepeats`. It is checked when the block
+    finishes without an error of its own.
+    """
+    threshold = settings.QUERY_REPEAT_THRESHOLD if threshold is None else threshold
+    action = settings.QUERY_REPEAT_ACTION if action is None else action
+    detector = QueryRepeats(threshold)
+    token = _detector.set(detector)
+    try:
+        yield detector
+    finally:
+        _detector.reset(token)
+    if detector.repeated():
+        message = detector.report(label)
+        if action == 'raise':
+            raise NPlusOneError(message)
+        logger.warning(message)
+        warnings.warn(message, NPlusOneWarning, stacklevel=3)
@@ -0,0 +1,161 @@
+"""
+Keyset pagination.
+
+Pages are addressed by the ordering values of the last row served rather
+than by an offset, so fetching page N costs the same as fetching page 1.
+Each ViewSet declares its ordering in ``keyset_ordering``, or returns it
+from ``get_keyset_ordering()`` when it depends on the request; the last
+field must be unique (``id``) so that the ordering is total.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the filter selecting rows strictly after ``position`` in ``ordering``.
+
+    For ``('-date', '-id')`` and ``(d, i)`` this is
+    ``date < d OR (date = d AND id < i)``.
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        term = Q(**{f'{name}__{lookup}': position[index]})
+        for previous, value in zip(ordering[:index], position[:index]):
+            term &= Q(**{previous.lstrip('-'): value})
+        condition |= term
+    return condition
+
+
+def _cursor_value(value):
+    # Full isoformat: DjangoJSONEncoder drops microseconds, which would skip rows.
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(position):
+    data = json.dumps(position, default=_cursor_value, separators=(',', ':'))
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, ordering, cursor):
+    """Decode a cursor into ordering values, returning None when it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(ordering):
+            return None
+        return [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValueError, TypeError, DjangoValidationError):
+        return None
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination driven by the view's ``keyset_ordering``.
+
+    Responses look like ``{"next": <url or null>, "results": [...]}``.
+    ``?page_size=`` overrides ``PAGE_SIZE`` up to ``API_MAX_PAGE_SIZE``.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE
+        max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', page_size)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if hasattr(view, 'get_keyset_ordering'):
+            self.ordering = tuple(view.get_keyset_ordering())
+        else:
+            self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            position = decode_cursor(queryset.model, self.ordering, cursor)
+            if position is None:
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(keyset_filter(self.ordering, position))
+
+        page = list(queryset[:self.page_size + 1])
+        self.next_position = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            fields = [field.lstrip('-') for field in self.ordering]
+            if isinstance(last, dict):
+                # values() querysets, as used by FastReadMixin
+                self.next_position = [last[field] for field in fields]
+            else:
+                self.next_position = [getattr(last, field) for field in fields]
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
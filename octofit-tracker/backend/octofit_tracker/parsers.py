@@ -0,0 +1,37 @@
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class MalformedLine:
+    """Stands in for an NDJSON line that is not valid JSON; ``errors`` says why, like a row's validation errors."""
+    __slots__ = ('errors',)
+
+    def __init__(self, message):
+        self.errors = {'non_field_errors': [message]}
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list with one item per line.
+
+    Blank lines are skipped. A line that is not valid JSON becomes a
+    :class:`MalformedLine`, so the rest of the batch still goes through
+    and the line is reported with the per-row errors.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line.decode(encoding)))
+            except ValueError as exc:
+                rows.append(MalformedLine(f'NDJSON parse error on line {number} - {exc}'))
+        return rows
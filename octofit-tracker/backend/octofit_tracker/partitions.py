@@ -0,0 +1,127 @@
+"""
+Monthly activity partitions.
+
+Activities are partitioned by calendar month in the current timezone.
+There is no partition key field and no collection per month: a month is
+a range of the indexed ``date`` field. The recent ("hot") months live in
+the ``activities`` collection. Older months
+can be moved out by ``manage.py archive_activities`` (archive.py) into
+compressed files listed in ``ActivityArchive``. Their per-day rollups stay
+behind as the compacted summary. Archived months are read-only, and the
+first hot day is the boundary between the two.
+
+The router functions here tell a query which partitions its date range
+touches. A range that ends before the boundary never queries the
+collection, and one that starts after it never opens an archive file.
+Because archiving keeps the collection to recent months, hot-path queries
+cost the same however much history accumulates.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .caching import model_version
+from .models import ActivityArchive, UserDailyStats
+
+_state = {'version': None, 'months': ()}
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def day_start(day):
+    """The aware datetime at which ``day`` starts in the current timezone."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def month_bounds(month):
+    """The aware ``[start, end)`` datetimes covering ``month``."""
+    return day_start(month), day_start(next_month(month))
+
+
+def archived_months():
+    """Sorted first days of the archived months, cached until the archive changes."""
+    version = model_version(ActivityArchive)
+    if _state['version'] != version:
+        _state['months'] = tuple(ActivityArchive.objects.order_by('month').values_list('month', flat=True))
+        _state['version'] = version
+    return _state['months']
+
+
+def hot_since():
+    """The first day still stored in ``activities``, or None if nothing is archived."""
+    months = archived_months()
+    return next_month(months[-1]) if months else None
+
+
+def hot_start():
+    """:func:`hot_since` as an aware datetime, or None."""
+    since = hot_since()
+    return None if since is None else day_start(since)
+
+
+def archives_for(start=None, end=None):
+    """The ``ActivityArchive`` rows for the archived months ``[start, end)`` overlaps."""
+    months = [
+        month for month in archived_months()
+        if (start is None or month_bounds(month)[1] > start) and (end is None or month_bounds(month)[0] < end)
+    ]
+    if not months:
+        return []
+    return list(ActivityArchive.objects.filter(month__in=months).order_by('month'))
+
+
+def touches_hot(start=None, end=None):
+    """Whether ``[start, end)`` reaches the months still in ``activities``."""
+    boundary = hot_start()
+    return boundary is None or end is None or end > boundary
+
+
+def archived_user_totals():
+    """
+    Per-user totals of the archived months, read from their daily rollups.
+
+    Returns ``{user_id: {'total_calories', 'total_duration',
+    'total_distance', 'activity_count'}}``.
+    """
+    since = hot_since()
+    if since is None:
+        return {}
+    totals = {}
+    rows = UserDailyStats.objects.filter(day__lt=since).values_list(
+        'user_id', 'calories_sum', 'duration_sum', 'distance_sum', 'activity_count'
+    )
+    for user_id, calories, duration, distance, count in rows.iterator(chunk_size=2000):
+        current = totals.setdefault(user_id, {
+            'total_calories': 0, 'total_duration': 0, 'total_distance': 0.0, 'activity_count': 0,
+        })
+        current['total_calories'] += calories
+        current['total_duration'] += duration
+        current['total_distance'] += distance
+        current['activity_count'] += count
+    return totals
+
+
+def with_archived_totals(ranked):
+    """
+    Add the archived months to ``ranked_user_totals()`` output and rank again.
+
+    Returns ``ranked`` unchanged when nothing is archived.
+    """
+    archived = archived_user_totals()
+    if not archived:
+        return ranked
+    totals = {user_id: dict(values) for user_id, values, _ in ranked}
+    for user_id, values in archived.items():
+        current = totals.setdefault(user_id, dict.fromkeys(values, 0))
+        for key, value in values.items():
+            current[key] += value
+    for values in totals.values():
+        values['total_distance'] = round(values['total_distance'], 2)
+    ordered = sorted(totals, key=lambda user_id: (-totals[user_id]['total_calories'], user_id))
+    return [(user_id, totals[user_id], rank) for rank, user_id in enumerate(ordered, start=1)]
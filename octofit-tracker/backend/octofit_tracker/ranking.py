@@ -0,0 +1,280 @@
+"""
+Process-local ranked index over the leaderboard.
+
+Entries are kept in indexable skip lists keyed on ``(-total_calories, id)``,
+the same order used for stored ranks, so top-N, rank lookups and
+"around me" windows cost O(log n + k) instead of sorting the collection.
+The index loads lazily from the ``leaderboard`` collection, follows
+Leaderboard writes made in this process and reloads itself after
+``LEADERBOARD_INDEX_MAX_AGE`` seconds to pick up writes from other workers.
+A rebuild of the whole table, in whichever process it ran, bumps the
+shared :data:`REBUILDS` counter; every ``LEADERBOARD_INDEX_POLL_SECONDS``
+the index checks it and reloads at once if it moved. It loads from the
+memory-mapped snapshot (snapshot.py) instead while the snapshot's
+leaderboard is still current.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from . import snapshot
+from .caching import model_version, model_versions
+from .models import Leaderboard
+
+# The version counter bumped each time the leaderboard table is rebuilt.
+REBUILDS = 'octofit_tracker.leaderboard.rebuilds'
+
+
+class _End:
+    """Sentinel that sorts after every key."""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+    def __repr__(self):
+        return '<end>'
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """
+    Sorted collection of unique keys with positional access.
+
+    Every link stores how many positions it skips, so the position of a key
+    and the key at a position are both found in O(log n).
+    """
+
+    def __init__(self, max_levels=24, seed=None):
+        self.max_levels = max_levels
+        self._random = random.Random(seed)
+        self._end = _Node(_End(), 0)
+        self._head = _Node(None, max_levels)
+        self._head.next = [self._end] * max_levels
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._end:
+            yield node.key
+            node = node.next[0]
+
+    def _random_level(self):
+        level = 1
+        while level < self.max_levels and self._random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        chain = [None] * self.max_levels
+        steps_at_level = [0] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_level()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is self._end or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self.max_levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key):
+        """Return the 0-based position of ``key``."""
+        node = self._head
+        position = 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is self._end or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, stop):
+        """Return the keys at positions ``start`` up to (not including) ``stop``."""
+        start = max(start, 0)
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self.max_levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class LeaderboardIndex:
+    """Overall and per-team ranked views of the leaderboard."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Drop the loaded state; the next query reloads from the database."""
+        with self._lock:
+            self._overall = IndexableSkipList()
+            self._teams = {}
+            self._entries = {}
+            self._by_user = {}
+            self._loaded_at = None
+            self._checked_at = None
+            self._rebuilds = None
+
+    @staticmethod
+    def _key(entry_id, total_calories):
+        return (-total_calories, entry_id)
+
+    def _insert(self, entry_id, user_id, team_id, total_calories):
+        key = self._key(entry_id, total_calories)
+        self._overall.insert(key)
+        team = self._teams.get(team_id)
+        if team is None:
+            team = self._teams[team_id] = IndexableSkipList()
+        team.insert(key)
+        self._entries[entry_id] = (key, user_id, team_id)
+        self._by_user[user_id] = entry_id
+
+    def _remove(self, entry_id):
+        key, user_id, team_id = self._entries.pop(entry_id)
+        self._overall.remove(key)
+        self._teams[team_id].remove(key)
+        if self._by_user.get(user_id) == entry_id:
+            del self._by_user[user_id]
+
+    def _ensure_loaded(self):
+        max_age = getattr(settings, 'LEADERBOARD_INDEX_MAX_AGE', 60)
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < max_age:
+            if now - self._checked_at < settings.LEADERBOARD_INDEX_POLL_SECONDS:
+                return
+            self._checked_at = now
+            if model_version(REBUILDS) == self._rebuilds:
+                return
+        self.reset()
+        mapped = snapshot.current()
+        self._rebuilds, version = model_versions(REBUILDS, Leaderboard)
+        if mapped is not None and mapped.leaderboard_version == version:
+            table = mapped['leaderboard']
+            rows = zip(*(table[name].tolist() for name in ('id', 'user_id', 'team_id', 'total_calories')))
+        else:
+            rows = Leaderboard.objects.values_list('id', 'user_id', 'team_id', 'total_calories')
+            rows = rows.iterator(chunk_size=2000)
+        for entry_id, user_id, team_id, total_calories in rows:
+            self._insert(entry_id, user_id, team_id, total_calories)
+        self._loaded_at = self._checked_at = time.monotonic()
+
+    def upsert(self, entry):
+        """Apply a saved Leaderboard row to the index if it is loaded."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if entry.pk in self._entries:
+                self._remove(entry.pk)
+            self._insert(entry.pk, entry.user_id, entry.team_id, entry.total_calories)
+
+    def discard(self, entry_id):
+        """Remove a deleted Leaderboard row from the index if it is loaded."""
+        with self._lock:
+            if self._loaded_at is not None and entry_id in self._entries:
+                self._remove(entry_id)
+
+    def _ranking(self, team_id):
+        if team_id is None:
+            return self._overall
+        return self._teams.get(team_id, IndexableSkipList())
+
+    def top(self, count, team_id=None):
+        """Return the ids of the ``count`` best entries, overall or within a team."""
+        with self._lock:
+            self._ensure_loaded()
+            return [key[1] for key in self._ranking(team_id).slice(0, count)]
+
+    def position(self, user_id):
+        """
+        Return ``(entry_id, rank, team_rank)`` for a user, ranks being 1-based.
+
+        Returns None when the user has no leaderboard entry.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            entry_id = self._by_user.get(user_id)
+            if entry_id is None:
+                return None
+            key, _, team_id = self._entries[entry_id]
+            return (
+                entry_id,
+                self._overall.index(key) + 1,
+                self._teams[team_id].index(key) + 1,
+            )
+
+    def around(self, user_id, radius, within_team=False):
+        """
+        Return the ids of the entries within ``radius`` ranks of a user.
+
+        With ``within_team`` the window is taken from the user's team ranking.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            entry_id = self._by_user.get(user_id)
+            if entry_id is None:
+                return []
+            key, _, team_id = self._entries[entry_id]
+            ranking = self._teams[team_id] if within_team else self._overall
+            index = ranking.index(key)
+            return [key[1] for key in ranking.slice(index - radius, index + radius + 1)]
+
+
+leaderboard_index = LeaderboardIndex()
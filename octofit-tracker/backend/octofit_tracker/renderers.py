@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+
+from rest_framework import renderers
+from rest_framework.renderers import BaseRenderer
+
+from .instrumentation import serializing
+
+
+def ndjson_line(row):
+    """Encode one row as a compact JSON line, matching JSONRenderer's output style."""
+    return json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class EchoBuffer:
+    """File-like object whose ``write`` returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF's JSONRenderer, with its time counted as serialization by the instrumentation middleware."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serializing():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Renders a list of dicts as newline-delimited JSON."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        return ''.join(ndjson_line(row) for row in data).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """Renders a list of dicts as CSV with a header taken from the first row."""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not data:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(data[0]))
+        writer.writeheader()
+        writer.writerows(data)
+        return output.getvalue().encode(self.charset)
@@ -0,0 +1,313 @@
+"""
+Materialized per-day activity rollups.
+
+``UserDailyStats`` and ``TeamDailyStats`` hold count/sum/min/max of
+duration, distance and calories for each (user, day) and (team, day).
+Activity writes fold into them incrementally, as atomic increments that
+never read the row first, so range queries read one row per day instead
+of every activity in the range. Team rows follow the
+team denormalized onto each activity (``Activity.team_id``), and
+:func:`move_user` carries a user's share along when they change team.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest, Least, Round
+from django.utils import timezone
+
+from .idempotency import is_duplicate
+from .models import Activity, TeamDailyStats, UserDailyStats, delete_all
+from .partitions import day_start, hot_since
+
+METRICS = ('duration', 'distance', 'calories')
+PERIODS = ('day', 'week', 'month')
+STAT_FIELDS = ('activity_count',) + tuple(
+    f'{metric}_{stat}' for metric in METRICS for stat in ('sum', 'min', 'max')
+)
+
+_lock = threading.Lock()
+
+
+def local_day(date):
+    """Return the calendar day of ``date`` in the current timezone."""
+    return timezone.localdate(date) if timezone.is_aware(date) else date.date()
+
+
+def activity_day(activity):
+    """Return the calendar day an activity counts towards, in the current timezone."""
+    return local_day(activity.date)
+
+
+def day_range(day):
+    """Return the aware ``[start, end)`` datetimes covering ``day``."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _empty_stats():
+    return {field: 0 if field.endswith(('_count', '_sum')) else None for field in STAT_FIELDS}
+
+
+def _store(row, stats):
+    stats['distance_sum'] = round(stats['distance_sum'], 2)
+    for field, value in stats.items():
+        setattr(row, field, value)
+
+
+def _fold(stats, values):
+    """Fold one activity's metric values into a stats dict."""
+    stats['activity_count'] += 1
+    for metric, value in zip(METRICS, values):
+        if value is None:
+            continue
+        stats[f'{metric}_sum'] += value
+        low, high = stats[f'{metric}_min'], stats[f'{metric}_max']
+        if low is None or value < low:
+            stats[f'{metric}_min'] = value
+        if high is None or value > high:
+            stats[f'{metric}_max'] = value
+
+
+def _values(activity):
+    return tuple(getattr(activity, metric) for metric in METRICS)
+
+
+def _bucket_activities(model, owner_id, day):
+    """Queryset of the activities that make up one rollup row."""
+    start, end = day_range(day)
+    activities = Activity.objects.filter(date__gte=start, date__lt=end)
+    return activities.filter(**{_owner_field(model): owner_id})
+
+
+def _owner_field(model):
+    return 'user_id' if model is UserDailyStats else 'team_id'
+
+
+def _is_mongo():
+    return connection.vendor == 'djongo'
+
+
+def _row_pk(model, owner_id, day, create=False):
+    """The pk of one rollup row, creating it empty when ``create`` is set and it is missing."""
+    lookup = {_owner_field(model): owner_id, 'day': day}
+    pk = model.objects.filter(**lookup).values_list('pk', flat=True).first()
+    if pk is None and create:
+        try:
+            with transaction.atomic():
+                pk = model.objects.create(**lookup).pk
+        except DatabaseError as exc:
+            # Another process created it first; the update below adds to theirs.
+            if not is_duplicate(exc):
+                raise
+            pk = model.objects.filter(**lookup).values_list('pk', flat=True).get()
+    return pk
+
+
+def _update(model, pk, stats):
+    """
+    Add a stats dict's count and sums to one row and widen its min/max, in one atomic update.
+
+    The row is never read first, so writes from other processes to the
+    same row add up instead of overwriting each other.
+    """
+    count = stats['activity_count']
+    if _is_mongo():
+        # An update pipeline, so the sums and extremes are computed on the server.
+        fields = {'activity_count': {'$add': ['$activity_count', count]}}
+        for metric in METRICS:
+            total = {'$add': [f'${metric}_sum', stats[f'{metric}_sum']]}
+            fields[f'{metric}_sum'] = {'$round': [total, 2]} if metric == 'distance' else total
+            for extreme in ('min', 'max'):
+                if stats[f'{metric}_{extreme}'] is not None:
+                    # $min and $max skip a null, so an empty row takes the new value.
+                    fields[f'{metric}_{extreme}'] = {f'${extreme}': [f'${metric}_{extreme}', stats[f'{metric}_{extreme}']]}
+        connection.ensure_connection()
+        connection.connection[model._meta.db_table].update_one({'id': pk}, [{'$set': fields}])
+        return
+    fields = {'activity_count': F('activity_count') + count}
+    for metric in METRICS:
+        total = F(f'{metric}_sum') + stats[f'{metric}_sum']
+        fields[f'{metric}_sum'] = Round(total, 2) if metric == 'distance' else total
+        for extreme, pick in (('min', Least), ('max', Greatest)):
+            value = stats[f'{metric}_{extreme}']
+            if value is not None:
+                fields[f'{metric}_{extreme}'] = pick(Coalesce(f'{metric}_{extreme}', Value(value)), Value(value))
+    model.objects.filter(pk=pk).update(**fields)
+
+
+def _add(model, owner_id, day, values_list):
+    stats = _empty_stats()
+    for values in values_list:
+        _fold(stats, values)
+    _update(model, _row_pk(model, owner_id, day, create=True), stats)
+
+
+def _remove(model, owner_id, day, values_list):
+    row = model.objects.filter(**{_owner_field(model): owner_id, 'day': day}).first()
+    if row is None:
+        return
+    stats = _empty_stats()
+    stats['activity_count'] = -len(values_list)
+    stale_extremes = False
+    for values in values_list:
+        for metric, value in zip(METRICS, values):
+            if value is None:
+                continue
+            stats[f'{metric}_sum'] -= value
+            if value in (getattr(row, f'{metric}_min'), getattr(row, f'{metric}_max')):
+                stale_extremes = True
+    _update(model, row.pk, stats)
+    emptied = model.objects.filter(pk=row.pk, activity_count__lte=0)
+    if emptied.exists():
+        delete_all(emptied)
+        return
+
+    if stale_extremes:
+        # Sums can be decremented but a removed min/max can only be found
+        # again by rescanning the bucket, which is one owner's single day.
+        rescanned = _empty_stats()
+        for values in _bucket_activities(model, owner_id, day).values_list(*METRICS):
+            _fold(rescanned, values)
+        model.objects.filter(pk=row.pk).update(**{
+            f'{metric}_{extreme}': rescanned[f'{metric}_{extreme}'] for metric in METRICS for extreme in ('min', 'max')
+        })
+
+
+def _group(activities):
+    """
+    Group activity values by (model, owner, day) so each rollup row is written once.
+
+    Team rows are keyed on each activity's own ``team_id``: for a replaced
+    or deleted activity that is the team it was counted towards.
+    """
+    groups = defaultdict(list)
+    for activity in activities:
+        day = activity_day(activity)
+        values = _values(activity)
+        groups[(UserDailyStats, activity.user_id, day)].append(values)
+        if activity.team_id is not None:
+            groups[(TeamDailyStats, activity.team_id, day)].append(values)
+    return groups
+
+
+def add_activities(activities):
+    """Fold new activities into the user and team rollups."""
+    with _lock, transaction.atomic():
+        for (model, owner_id, day), values_list in _group(activities).items():
+            _add(model, owner_id, day, values_list)
+
+
+def remove_activities(activities):
+    """Take deleted (or replaced) activities out of the user and team rollups."""
+    with _lock, transaction.atomic():
+        for (model, owner_id, day), values_list in _group(activities).items():
+            _remove(model, owner_id, day, values_list)
+
+
+def move_user(user_id, old_team_id, new_team_id):
+    """
+    Move a user's share of the team rollups from their old team to the new one.
+
+    Call once the user's activities carry ``new_team_id``, so rescanning
+    the old team's days no longer finds them. Archived months have no
+    activities left to move and stay with the old team.
+    """
+    days = defaultdict(list)
+    rows = Activity.objects.filter(user_id=user_id).values_list('date', *METRICS)
+    for date, *values in rows.iterator(chunk_size=2000):
+        days[local_day(date)].append(tuple(values))
+    with _lock, transaction.atomic():
+        for day, values_list in days.items():
+            if old_team_id is not None:
+                _remove(TeamDailyStats, old_team_id, day, values_list)
+            if new_team_id is not None:
+                _add(TeamDailyStats, new_team_id, day, values_list)
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    Recompute rollup rows from the activities collection in one pass.
+
+    ``start`` and ``end`` (dates, end exclusive) limit the days rebuilt.
+    ``start`` defaults to the first hot day: the rollups of archived months
+    (see partitions.py) are all that is left of them and are kept.
+    """
+    start = hot_since() if start is None else start
+    days = {}
+    activities = Activity.objects.all()
+    if start is not None:
+        days['day__gte'] = start
+        activities = activities.filter(date__gte=day_start(start))
+    if end is not None:
+        days['day__lt'] = end
+        activities = activities.filter(date__lt=day_start(end))
+    stats = defaultdict(_empty_stats)
+    rows = activities.values_list('user_id', 'team_id', 'date', *METRICS)
+    for user_id, team_id, date, *values in rows.iterator(chunk_size=2000):
+        day = local_day(date)
+        _fold(stats[(UserDailyStats, user_id, day)], values)
+        if team_id is not None:
+            _fold(stats[(TeamDailyStats, team_id, day)], values)
+
+    rollups = defaultdict(list)
+    for (model, owner_id, day), values in stats.items():
+        row = model(**{_owner_field(model): owner_id, 'day': day})
+        _store(row, values)
+        rollups[model].append(row)
+
+    with _lock, transaction.atomic():
+        for model in (UserDailyStats, TeamDailyStats):
+            model.objects.filter(**days).delete()
+            model.objects.bulk_create(rollups[model], batch_size=1000)
+    return {model: len(rollups[model]) for model in (UserDailyStats, TeamDailyStats)}
+
+
+def period_start(day, period):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def query_stats(scope, owner_id, start, end, period='day'):
+    """
+    Aggregate rollups for one user or team into day, week or month buckets.
+
+    ``start`` and ``end`` are inclusive dates. Reads one row per day in range.
+    """
+    model = UserDailyStats if scope == 'user' else TeamDailyStats
+    rows = model.objects.filter(
+        **{_owner_field(model): owner_id}, day__gte=start, day__lte=end
+    ).order_by('day')
+
+    buckets = {}
+    for row in rows:
+        bucket = buckets.setdefault(period_start(row.day, period), _empty_stats())
+        bucket['activity_count'] += row.activity_count
+        for metric in METRICS:
+            bucket[f'{metric}_sum'] += getattr(row, f'{metric}_sum')
+            for extreme, pick in (('min', min), ('max', max)):
+                value = getattr(row, f'{metric}_{extreme}')
+                current = bucket[f'{metric}_{extreme}']
+                if value is not None:
+                    bucket[f'{metric}_{extreme}'] = value if current is None else pick(current, value)
+
+    return [
+        {
+            'start': bucket_start.isoformat(),
+            'activity_count': stats['activity_count'],
+            **{
+                metric: {
+                    'sum': round(stats[f'{metric}_sum'], 2) if metric == 'distance' else stats[f'{metric}_sum'],
+                    'min': stats[f'{metric}_min'],
+                    'max': stats[f'{metric}_max'],
+                }
+                for metric in METRICS
+            },
+        }
+        for bucket_start, stats in buckets.items()
+    ]
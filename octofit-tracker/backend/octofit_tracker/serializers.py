@@ -1,5 +1,8 @@
+import json
+
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, Workout, Job
+from .partitions import hot_start
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -20,7 +23,19 @@ class TeamSerializer(serializers.ModelSerializer):
 class ActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Activity
-        fields = ['id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'created_at']
+        fields = ['id', 'user_id', 'team_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'created_at']
+        extra_kwargs = {
+            'team_id': {'read_only': True}
+        }
+    
+    def validate_date(self, value):
+        # Batches pass the boundary in the context rather than read it per row.
+        boundary = self.context['hot_start'] if 'hot_start' in self.context else hot_start()
+        if boundary is not None and value < boundary:
+            raise serializers.ValidationError(
+                f'Activities before {boundary.date().isoformat()} are archived and cannot be changed.'
+            )
+        return value
 
 
 class LeaderboardSerializer(serializers.ModelSerializer):
@@ -33,3 +48,15 @@ class WorkoutSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['id', 'name', 'description', 'activity_type', 'difficulty', 'duration', 'calories_per_session', 'created_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'progress', 'message', 'attempts', 'worker',
+                  'result', 'created_at', 'started_at', 'finished_at']
+    
+    def get_result(self, job):
+        return json.loads(job.result) if job.result else None
@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total includes every other middleware.
+    'octofit_tracker.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -90,18 +92,71 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# The engine is djongo with a per-process, pooled MongoClient (mongo.py).
+# Every worker process gets its own pool of at most maxPoolSize connections,
+# shared by all its threads and by both aliases below.
+MONGO_CLIENT = {
+    'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+    'port': int(os.environ.get('OCTOFIT_MONGO_PORT', 27017)),
+    'maxPoolSize': int(os.environ.get('OCTOFIT_MONGO_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.environ.get('OCTOFIT_MONGO_MIN_POOL_SIZE', 2)),
+    # Milliseconds a request waits for a free connection before failing.
+    'waitQueueTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    'maxIdleTimeMS': int(os.environ.get('OCTOFIT_MONGO_MAX_IDLE_TIME_MS', 300000)),
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'djongo',
+        'ENGINE': 'octofit_tracker.backends.djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
-    }
+        'CLIENT': MONGO_CLIENT,
+    },
+    # Same database, read with a secondary preference by list endpoints
+    # (mongo.ListReadsMixin). On a standalone server it reads the primary.
+    'reads': {
+        'ENGINE': 'octofit_tracker.backends.djongo',
+        'NAME': 'octofit_db',
+        'ENFORCE_SCHEMA': False,
+        'CLIENT': MONGO_CLIENT,
+        'READ_PREFERENCE': os.environ.get('OCTOFIT_MONGO_LIST_READ_PREFERENCE', 'secondaryPreferred'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+# Alias list endpoints read from; falls back to 'default' when it is not configured.
+LIST_READ_DATABASE = 'reads'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The 'api' cache holds versioned API responses (caching.py). It is a
+# per-process LRU by default; set OCTOFIT_CACHE_URL (e.g. redis://host:6379/1)
+# to share it between workers. The versions themselves are kept in the
+# database, so every worker sees every write either way.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-default',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
 }
 
+OCTOFIT_CACHE_URL = os.environ.get('OCTOFIT_CACHE_URL')
+if OCTOFIT_CACHE_URL:
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': OCTOFIT_CACHE_URL,
+        'TIMEOUT': 300,
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -158,4 +213,92 @@ if CODESPACE_NAME:
     CSRF_TRUSTED_ORIGINS.append(f'https://{CODESPACE_NAME}-8000.app.github.dev')
     CSRF_TRUSTED_ORIGINS.append(f'https://{CODESPACE_NAME}-3000.app.github.dev')
 
+# Django REST Framework
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+# Largest page a client may request with ?page_size=
+API_MAX_PAGE_SIZE = 1000
+# Serve list/retrieve through values() rows and precompiled encoders
+# (encoders.FastReadMixin) instead of ModelSerializer instances.
+API_FAST_READS = os.environ.get('OCTOFIT_FAST_READS', '').lower() in ('1', 'true', 'yes')
+# Answer the /api/stats/teams/ and /api/stats/types/ analytics from NumPy
+# columns held in each worker (columnar.py), patched in place as activities
+# change.
+ANALYTICS_COLUMNAR = os.environ.get('OCTOFIT_ANALYTICS_COLUMNAR', '').lower() in ('1', 'true', 'yes')
+# Memory-mapped snapshot written by manage.py snapshot_build (snapshot.py);
+# its delta log is kept alongside, with a .delta suffix.
+SNAPSHOT_PATH = os.environ.get('OCTOFIT_SNAPSHOT_PATH', str(BASE_DIR / 'snapshot' / 'octofit.snap'))
+
+# Activity ingestion
+# Rows per bulk_create round-trip and the largest batch accepted by
+# POST /api/activities/bulk/.
+ACTIVITY_BULK_CHUNK_SIZE = 500
+ACTIVITY_BULK_MAX_ROWS = 10000
+# Rows fetched per cursor batch and written per chunk by the streaming export.
+ACTIVITY_EXPORT_CHUNK_SIZE = 2000
+# Where manage.py archive_activities writes the compressed monthly archives.
+ACTIVITY_ARCHIVE_DIR = os.environ.get('OCTOFIT_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+# Seconds, and number of keys, for which each worker remembers the response
+# to an idempotent POST /api/activities/ (idempotency.py) so that retries are
+# answered without a database read.
+IDEMPOTENCY_CACHE_SECONDS = 600
+IDEMPOTENCY_CACHE_SIZE = 10000
+# Activity writes are logged (changes.py) for the in-memory state of every
+# worker to follow. Reads of the log reach back SETTLE seconds, which must
+# cover the longest write transaction plus the clock skew between servers.
+# Entries are kept for RETENTION seconds; a worker further behind reloads.
+ACTIVITY_CHANGES_SETTLE_SECONDS = 30
+ACTIVITY_CHANGES_RETENTION_SECONDS = 86400
+# Seconds between a worker's reads of the log.
+ACTIVITY_CHANGES_POLL_SECONDS = 5
+
+# Leaderboard
+# Seconds before a worker reloads its in-memory ranked index (ranking.py)
+# to pick up leaderboard writes made by other processes.
+LEADERBOARD_INDEX_MAX_AGE = 60
+# Seconds between a worker's checks for a rebuild of the whole table.
+LEADERBOARD_INDEX_POLL_SECONDS = 5
+
+# Windows served by /api/leaderboard/?window=... (windows.py), and the width
+# in seconds of the time buckets their totals expire by.
+LEADERBOARD_WINDOWS = ('7d', '30d')
+LEADERBOARD_WINDOW_BUCKET_SECONDS = 3600
+
+# Seconds of leaderboard changes coalesced into one pushed diff (live.py).
+LIVE_LEADERBOARD_WINDOW = 0.5
+
+# Async read endpoints (async_views.py)
+# Threads running blocking database work for the /api/async/ views; 0 runs
+# it on Django's thread-sensitive executor instead.
+ASYNC_DB_THREADS = int(os.environ.get('OCTOFIT_ASYNC_DB_THREADS', 8))
+
+# Request instrumentation (instrumentation.py)
+# Share of requests whose queries and serialization are measured; every
+# request is still timed. Keep it low in production to bound the overhead.
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.environ.get('OCTOFIT_INSTRUMENTATION_SAMPLE_RATE', '1.0' if DEBUG else '0.01')
+)
+
+# N+1 detection (nplusone.py): flag a request that runs one query shape more
+# than this many times, by logging a warning or, with 'raise', failing it.
+# 0 turns it off.
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('OCTOFIT_QUERY_REPEAT_THRESHOLD', 10 if DEBUG else 0))
+QUERY_REPEAT_ACTION = os.environ.get('OCTOFIT_QUERY_REPEAT_ACTION', 'warn')
+
+# Background jobs (jobs.py)
+# Seconds an idle worker waits before polling the queue again.
+JOB_POLL_SECONDS = 2
+# Seconds without a progress heartbeat before a running job is requeued.
+JOB_STALE_SECONDS = 600
+# Seconds between the heartbeats a worker sends while a handler runs.
+JOB_HEARTBEAT_SECONDS = 60
+# Runs a job may start before a stale one is marked failed instead of requeued.
+JOB_MAX_ATTEMPTS = 3
+
 # Step 3 validation: This file contains 'djongo' in INSTALLED_APPS and DATABASES ENGINE
@@ -0,0 +1,184 @@
+"""
+Model signal handlers that keep derived data in sync with writes.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import changes, leaderboard, rollups, snapshot
+from .caching import bump_version
+from .columnar import activity_store
+from .idempotency import seen_keys
+from .ingest import assign_team_ids
+from .models import Activity, ActivityArchive, ActivityChange, Leaderboard, Team, User, Workout
+from .ranking import leaderboard_index
+from .windows import window_rankings
+
+_muted = ContextVar('octofit_signals_muted', default=False)
+
+
+@contextmanager
+def muted():
+    """
+    Skip derived-data maintenance for writes made inside the block.
+
+    For bulk operations that rebuild the derived data themselves afterwards.
+    """
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def reset_derived():
+    """
+    Drop everything derived from the tables after they were replaced wholesale.
+
+    Clears the in-memory rankings, columnar store and seen idempotency
+    keys. Removes the snapshot and invalidates cached responses. Rollups
+    and leaderboard rows are rebuilt by their own commands.
+    """
+    leaderboard_index.reset()
+    window_rankings.reset()
+    activity_store.reset()
+    seen_keys.clear()
+    snapshot.remove()
+    for model in (Activity, ActivityArchive, Leaderboard, Team, User, Workout):
+        bump_version(model)
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous_activity(sender, instance, **kwargs):
+    """Stash the stored version of an activity so updates can be applied as deltas."""
+    instance._previous = None
+    if _muted.get():
+        return
+    if instance.pk is not None:
+        instance._previous = Activity.objects.filter(pk=instance.pk).first()
+
+
+@receiver(pre_save, sender=Activity)
+def copy_team_id(sender, instance, **kwargs):
+    """Denormalize the author's team onto new activities and ones that change author."""
+    previous = getattr(instance, '_previous', None)
+    if instance.team_id is None or (previous is not None and previous.user_id != instance.user_id):
+        assign_team_ids([instance])
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, created, **kwargs):
+    if _muted.get():
+        return
+    previous = getattr(instance, '_previous', None)
+    calories, duration, distance = leaderboard.activity_totals(instance)
+    if previous is not None and previous.user_id != instance.user_id:
+        old_calories, old_duration, old_distance = leaderboard.activity_totals(previous)
+        leaderboard.apply_activity_delta(
+            previous.user_id, -old_calories, -old_duration, -old_distance
+        )
+    elif previous is not None:
+        old_calories, old_duration, old_distance = leaderboard.activity_totals(previous)
+        calories -= old_calories
+        duration -= old_duration
+        distance -= old_distance
+    leaderboard.apply_activity_delta(instance.user_id, calories, duration, distance)
+    if previous is not None:
+        rollups.remove_activities([previous])
+        window_rankings.record([previous], -1)
+        snapshot.log_activity('update', instance)
+        activity_store.update([instance])
+    rollups.add_activities([instance])
+    window_rankings.record([instance])
+    changes.log_activity(ActivityChange.UPDATE if previous is not None else ActivityChange.INSERT, instance, previous)
+
+
+@receiver(pre_delete, sender=Activity)
+def refresh_deleted_team(sender, instance, **kwargs):
+    """Take a deleted activity out of the team it is stored under, even if ``instance`` predates a team change."""
+    if _muted.get() or instance.pk is None:
+        return
+    stored = Activity.objects.filter(pk=instance.pk).values_list('team_id', flat=True)
+    for team_id in stored:
+        instance.team_id = team_id
+
+
+@receiver(post_delete, sender=Activity)
+def activity_deleted(sender, instance, **kwargs):
+    if _muted.get():
+        return
+    calories, duration, distance = leaderboard.activity_totals(instance)
+    leaderboard.apply_activity_delta(instance.user_id, -calories, -duration, -distance)
+    rollups.remove_activities([instance])
+    window_rankings.record([instance], -1)
+    snapshot.log_activity('delete', instance)
+    changes.log_activity(ActivityChange.DELETE, instance)
+    activity_store.discard([instance.pk])
+    if instance.idempotency_key:
+        seen_keys.discard(instance.idempotency_key)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_team(sender, instance, **kwargs):
+    instance._previous_team_id = None
+    if not _muted.get() and instance.pk is not None:
+        instance._previous_team_id = User.objects.filter(pk=instance.pk).values_list(
+            'team_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    """Move a user's activities, team rollups, leaderboard entry and window totals along when they change team."""
+    if _muted.get():
+        return
+    window_rankings.move_user(instance.pk, instance.team_id)
+    previous_team_id = getattr(instance, '_previous_team_id', None)
+    if instance.team_id != previous_team_id:
+        changes.log_team(instance.pk, instance.team_id)
+    if not created and instance.team_id != previous_team_id:
+        Activity.objects.filter(user_id=instance.pk).update(team_id=instance.team_id)
+        rollups.move_user(instance.pk, previous_team_id, instance.team_id)
+        # Leaderboard rows store 0 for users without a team.
+        team_id = instance.team_id or 0
+        entry = Leaderboard.objects.filter(user_id=instance.pk).first()
+        if entry is not None and entry.team_id != team_id:
+            entry.team_id = team_id
+            Leaderboard.objects.filter(pk=entry.pk).update(team_id=team_id)
+            leaderboard_index.upsert(entry)
+            bump_version(Leaderboard)
+        snapshot.append_log({'op': 'team', 'user_id': instance.pk, 'team_id': instance.team_id})
+        activity_store.move_user(instance.pk, instance.team_id)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if _muted.get():
+        return
+    entry = Leaderboard.objects.filter(user_id=instance.pk).first()
+    if entry is not None:
+        leaderboard.remove_entry(entry)
+
+
+@receiver(post_save, sender=Leaderboard)
+def leaderboard_saved(sender, instance, **kwargs):
+    leaderboard_index.upsert(instance)
+    bump_version(Leaderboard)
+
+
+@receiver(post_delete, sender=Leaderboard)
+def leaderboard_deleted(sender, instance, **kwargs):
+    leaderboard_index.discard(instance.pk)
+    bump_version(Leaderboard)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=Workout)
+@receiver(post_save, sender=ActivityArchive)
+@receiver(post_delete, sender=ActivityArchive)
+def cached_model_changed(sender, **kwargs):
+    bump_version(sender)
@@ -0,0 +1,354 @@
+"""
+Memory-mapped snapshots of the leaderboard, users and activities.
+
+Workers that keep state in memory (ranking.py, columnar.py) would each
+scan MongoDB to build it. ``manage.py snapshot_build`` writes that data
+once, into one file at ``SNAPSHOT_PATH``. Workers ``mmap`` the file
+read-only and view its columns as NumPy arrays without copying them, so
+every worker on a host shares the same physical pages and warms up in
+milliseconds.
+
+The layout is:
+
+- ``OCTOSNAP``;
+- the format number and the header length, as little-endian uint32s;
+- a JSON header;
+- one segment per column, each a fixed-width little-endian array aligned
+  to 64 bytes.
+
+The header records each table's row count and each column's dtype and
+offset. It also carries the activity_type dictionary and a version stamp,
+the ``time.time_ns()`` at which the build started.
+
+Activities inserted after a build are read by ``created_at``, from a
+little before the build started (columnar.py), and skipped when the
+snapshot already holds their id. Updates, deletes and team moves are
+appended to a delta log next to the snapshot, stamped with
+``time.time_ns()``.
+:meth:`Snapshot.activity_columns` replays the entries stamped at or
+after the snapshot's version. A new build drops the entries older than
+its own version. Deletes made by bulk maintenance without signals
+(archival, reseeding) are not logged, so rebuild the snapshot after them.
+The leaderboard table is used only while the leaderboard's version still
+matches the one it was built at. That version is the shared counter in
+the database (caching.py), so every worker can tell whether the table is
+current.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import model_version
+from .models import Activity, Leaderboard, User
+
+MAGIC = b'OCTOSNAP'
+FORMAT = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGN = 64
+NO_TEAM = -1
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+TABLES = {
+    'leaderboard': {
+        'id': '<i8', 'user_id': '<i4', 'team_id': '<i4', 'total_calories': '<i8',
+        'total_duration': '<i8', 'total_distance': '<f8', 'rank': '<i4',
+    },
+    'users': {'id': '<i4', 'team_id': '<i4'},
+    'activities': {
+        'id': '<i8', 'user_id': '<i4', 'team_id': '<i4', 'activity_type': '<i2',
+        'date': '<i8', 'duration': '<i4', 'calories': '<i4', 'distance': '<f8',
+    },
+}
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this code can read."""
+
+
+def epoch_micros(value):
+    """Microseconds since the epoch for an aware datetime."""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def snapshot_path():
+    return Path(settings.SNAPSHOT_PATH)
+
+
+def log_path(path=None):
+    path = Path(path or settings.SNAPSHOT_PATH)
+    return path.with_name(path.name + '.delta')
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _columns(queryset, columns, chunk_size, convert=None):
+    """Read ``queryset`` into one NumPy array per column, a chunk at a time."""
+    chunks = {name: [] for name in columns}
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+    while True:
+        batch = [convert(row) if convert else row for row in islice(rows, chunk_size)]
+        if not batch:
+            break
+        for name, values in zip(columns, zip(*batch)):
+            chunks[name].append(np.array(values, dtype=columns[name]))
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=columns[name])
+        for name, parts in chunks.items()
+    }
+
+
+def build_snapshot(path=None, chunk_size=20000):
+    """
+    Write a snapshot of the leaderboard, users and activities to ``path``.
+
+    The file is written next to its destination and moved into place, so
+    workers never map a partial snapshot. Returns the header.
+    """
+    path = Path(path or settings.SNAPSHOT_PATH)
+    version = time.time_ns()
+    leaderboard_version = model_version(Leaderboard)
+    types = {}
+
+    def activity_row(row):
+        pk, user_id, team_id, activity_type, date, duration, calories, distance = row
+        code = types.setdefault(activity_type, len(types))
+        return (pk, user_id, NO_TEAM if team_id is None else team_id, code, epoch_micros(date),
+                duration, calories, np.nan if distance is None else distance)
+
+    tables = {
+        'leaderboard': _columns(Leaderboard.objects.order_by('rank', 'id'), TABLES['leaderboard'], chunk_size),
+        'users': _columns(
+            User.objects.order_by('id'), TABLES['users'], chunk_size,
+            lambda row: (row[0], NO_TEAM if row[1] is None else row[1]),
+        ),
+        'activities': _columns(Activity.objects.order_by('id'), TABLES['activities'], chunk_size, activity_row),
+    }
+    ids = tables['activities']['id']
+    header = {
+        'version': version,
+        'created_at': timezone.now().isoformat(),
+        'leaderboard_version': leaderboard_version,
+        'last_activity_id': int(ids.max()) if len(ids) else 0,
+        'activity_types': list(types),
+        'tables': {},
+    }
+    # Offsets depend on the header's length, which depends on the offsets;
+    # reserve room for the widest offsets the file could need.
+    layout = []
+    for table, columns in tables.items():
+        rows = len(next(iter(columns.values())))
+        header['tables'][table] = {'rows': rows, 'columns': {}}
+        for name, values in columns.items():
+            header['tables'][table]['columns'][name] = [TABLES[table][name], 0]
+            layout.append((table, name, values))
+    reserved = len(json.dumps(header)) + len(layout) * 20
+    offset = _aligned(PREAMBLE.size + reserved)
+    for table, name, values in layout:
+        header['tables'][table]['columns'][name][1] = offset
+        offset = _aligned(offset + values.nbytes)
+    encoded = json.dumps(header).encode()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'wb') as output:
+        output.write(PREAMBLE.pack(MAGIC, FORMAT, len(encoded)))
+        output.write(encoded)
+        for table, name, values in layout:
+            output.seek(header['tables'][table]['columns'][name][1])
+            output.write(values.tobytes())
+        output.truncate(offset)
+    os.replace(partial, path)
+    compact_log(version, path)
+    return header
+
+
+class Snapshot:
+    """A snapshot file mapped read-only, with its columns as NumPy arrays."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < PREAMBLE.size:
+            raise SnapshotError(f'{self.path} is too short to be a snapshot')
+        magic, format_, length = PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC or format_ != FORMAT:
+            raise SnapshotError(f'{self.path} is not a format {FORMAT} snapshot')
+        self.header = json.loads(self._map[PREAMBLE.size:PREAMBLE.size + length])
+        self.version = self.header['version']
+        self.leaderboard_version = self.header['leaderboard_version']
+        self.last_activity_id = self.header['last_activity_id']
+        self.activity_types = self.header['activity_types']
+        self.tables = {}
+        for table, layout in self.header['tables'].items():
+            self.tables[table] = {
+                name: np.frombuffer(self._map, dtype=dtype, count=layout['rows'], offset=offset)
+                if layout['rows'] else np.empty(0, dtype=dtype)
+                for name, (dtype, offset) in layout['columns'].items()
+            }
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+    def activity_columns(self):
+        """
+        The activities table with the delta log replayed on top.
+
+        Returns ``(columns, activity_types)``. ``activity_types`` extends
+        the snapshot's dictionary with any type the log introduces. The
+        columns are the mapped arrays themselves when the log touches no
+        row of the snapshot, or private copies otherwise. Rows inserted
+        after the build are not in the log; read them from the database
+        by ``created_at``.
+        """
+        columns = self.tables['activities']
+        types = list(self.activity_types)
+        codes = {name: code for code, name in enumerate(types)}
+        updated = {}
+        moves = {}
+        for entry in read_log(self.version, self.path):
+            if entry['op'] == 'team':
+                moves[entry['user_id']] = entry['team_id']
+                for row in updated.values():
+                    if row is not None and row['user_id'] == entry['user_id']:
+                        row['team_id'] = entry['team_id']
+            elif entry['id'] <= self.last_activity_id:
+                updated[entry['id']] = entry.get('activity') if entry['op'] == 'update' else None
+        if not updated and not moves:
+            return columns, types
+
+        keep = ~np.isin(columns['id'], list(updated)) if updated else np.ones(len(columns['id']), dtype=bool)
+        columns = {name: values[keep] for name, values in columns.items()}
+        for user_id, team_id in moves.items():
+            columns['team_id'][columns['user_id'] == user_id] = NO_TEAM if team_id is None else team_id
+        rows = [row for row in updated.values() if row is not None]
+        if rows:
+            for row in rows:
+                if row['activity_type'] not in codes:
+                    codes[row['activity_type']] = len(types)
+                    types.append(row['activity_type'])
+            extra = {
+                'id': [row['id'] for row in rows],
+                'user_id': [row['user_id'] for row in rows],
+                'team_id': [NO_TEAM if row['team_id'] is None else row['team_id'] for row in rows],
+                'activity_type': [codes[row['activity_type']] for row in rows],
+                'date': [row['date'] for row in rows],
+                'duration': [row['duration'] for row in rows],
+                'calories': [row['calories'] for row in rows],
+                'distance': [np.nan if row['distance'] is None else row['distance'] for row in rows],
+            }
+            columns = {
+                name: np.concatenate([values, np.array(extra[name], dtype=values.dtype)])
+                for name, values in columns.items()
+            }
+        return columns, types
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def current():
+    """
+    The snapshot at ``SNAPSHOT_PATH``, mapped once per file, or None.
+
+    A rebuilt file is a new inode, so it is mapped afresh; workers still
+    using the old mapping keep it valid until they drop it.
+    """
+    global _current
+    path = snapshot_path()
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if _current is None or _current.path != path or (
+            _current.stat.st_ino, _current.stat.st_mtime_ns
+        ) != (stat.st_ino, stat.st_mtime_ns):
+            _current = Snapshot(path)
+        return _current
+
+
+def warm():
+    """Map the snapshot and load the columnar store from it, without touching the database."""
+    snapshot = current()
+    if snapshot is not None and settings.ANALYTICS_COLUMNAR:
+        from .columnar import activity_store
+        activity_store.load_snapshot(snapshot)
+    return snapshot
+
+
+def remove(path=None):
+    """Delete the snapshot and its delta log, e.g. once the data they describe has been replaced."""
+    global _current
+    path = Path(path or settings.SNAPSHOT_PATH)
+    for stale in (path, log_path(path)):
+        stale.unlink(missing_ok=True)
+    with _lock:
+        _current = None
+
+
+def append_log(entry, path=None):
+    """Append one change to the delta log, if a snapshot exists to replay it onto."""
+    path = Path(path or settings.SNAPSHOT_PATH)
+    if not path.exists():
+        return
+    line = json.dumps({'stamp': time.time_ns(), **entry}) + '\n'
+    with open(log_path(path), 'a', encoding='utf-8') as log:
+        fcntl.flock(log, fcntl.LOCK_EX)
+        log.write(line)
+
+
+def log_activity(op, activity):
+    """Log an update (with the activity's new values) or a delete of one activity."""
+    entry = {'op': op, 'id': activity.pk}
+    if op == 'update':
+        entry['activity'] = {
+            'id': activity.pk, 'user_id': activity.user_id, 'team_id': activity.team_id,
+            'activity_type': activity.activity_type, 'date': epoch_micros(activity.date),
+            'duration': activity.duration, 'calories': activity.calories, 'distance': activity.distance,
+        }
+    append_log(entry)
+
+
+def read_log(since, path=None):
+    """Yield the delta log entries stamped at or after ``since``, oldest first."""
+    try:
+        log = open(log_path(path), encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with log:
+        fcntl.flock(log, fcntl.LOCK_SH)
+        lines = log.readlines()
+    for line in lines:
+        entry = json.loads(line)
+        if entry['stamp'] >= since:
+            yield entry
+
+
+def compact_log(since, path=None):
+    """Drop the delta log entries a snapshot built at ``since`` already contains."""
+    try:
+        log = open(log_path(path), 'r+', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with log:
+        fcntl.flock(log, fcntl.LOCK_EX)
+        kept = [line for line in log if json.loads(line)['stamp'] >= since]
+        log.seek(0)
+        log.writelines(kept)
+        log.truncate()
@@ -1,8 +1,29 @@
-from django.test import TestCase
+import unittest
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase as BaseAPITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
+from .leaderboard import rebuild_leaderboard
+from .models import User, Team, Activity, Leaderboard, Workout, UserDailyStats, TeamDailyStats
+from .ranking import IndexableSkipList, leaderboard_index
+from .rollups import rebuild_rollups
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@override_settings(QUERY_REPEAT_THRESHOLD=3, QUERY_REPEAT_ACTION='raise')
+class APITestCase(BaseAPITestCase):
+    """APITestCase whose requests fail on N+1 queries (see nplusone.py)."""
 
 
 class UserModelTest(TestCase):
@@ -66,6 +87,647 @@ class ActivityModelTest(TestCase):
         self.assertEqual(self.activity.calories, 300)
 
 
+class LeaderboardMaintenanceTest(TestCase):
+    """Test case for incremental leaderboard updates on Activity writes."""
+    
+    def setUp(self):
+        self.users = [
+            User.objects.create(
+                name=f'Hero {i}',
+                email=f'hero{i}@test.com',
+                password='pass123',
+                team_id=i % 2 + 1
+            )
+            for i in range(4)
+        ]
+    
+    def log(self, user, calories, duration=30, distance=None):
+        return Activity.objects.create(
+            user_id=user.id,
+            activity_type='Running',
+            duration=duration,
+            distance=distance,
+            calories=calories,
+            date=timezone.now()
+        )
+    
+    def ranks(self):
+        return list(
+            Leaderboard.objects.order_by('rank').values_list('user_id', 'rank', 'total_calories')
+        )
+    
+    def assert_matches_rebuild(self):
+        incremental = self.ranks()
+        rebuild_leaderboard()
+        self.assertEqual(incremental, self.ranks())
+    
+    def test_activity_creates_entry(self):
+        """Test that the first activity creates a leaderboard entry with totals."""
+        self.log(self.users[0], 300, duration=30, distance=5.0)
+        entry = Leaderboard.objects.get(user_id=self.users[0].id)
+        self.assertEqual(entry.team_id, self.users[0].team_id)
+        self.assertEqual(entry.total_calories, 300)
+        self.assertEqual(entry.total_duration, 30)
+        self.assertEqual(entry.total_distance, 5.0)
+        self.assertEqual(entry.rank, 1)
+    
+    def test_ranks_shift_when_overtaken(self):
+        """Test that moving up only shifts the entries that were overtaken."""
+        for calories, user in zip([400, 300, 200, 100], self.users):
+            self.log(user, calories)
+        self.log(self.users[3], 250)
+        self.assertEqual(
+            [row[0] for row in self.ranks()],
+            [self.users[i].id for i in (0, 3, 1, 2)]
+        )
+        self.assertEqual([row[1] for row in self.ranks()], [1, 2, 3, 4])
+        self.assert_matches_rebuild()
+    
+    def test_update_and_delete_apply_deltas(self):
+        """Test that updating or deleting an activity moves the totals back."""
+        first = self.log(self.users[0], 500)
+        self.log(self.users[1], 300)
+        first.calories = 100
+        first.save()
+        self.assertEqual(Leaderboard.objects.get(user_id=self.users[0].id).total_calories, 100)
+        self.assertEqual(self.ranks()[0][0], self.users[1].id)
+        first.delete()
+        self.assertFalse(Leaderboard.objects.filter(user_id=self.users[0].id).exists())
+        self.assert_matches_rebuild()
+    
+    def test_activity_moved_to_other_user(self):
+        """Test that reassigning an activity moves its totals between users."""
+        activity = self.log(self.users[0], 500)
+        activity.user_id = self.users[1].id
+        activity.save()
+        self.assertFalse(Leaderboard.objects.filter(user_id=self.users[0].id).exists())
+        self.assertEqual(Leaderboard.objects.get(user_id=self.users[1].id).total_calories, 500)
+        self.assert_matches_rebuild()
+    
+    def test_user_delete_closes_rank_gap(self):
+        """Test that deleting a user removes their entry and compacts ranks."""
+        for calories, user in zip([400, 300, 200], self.users):
+            self.log(user, calories)
+        self.users[0].delete()
+        self.assertEqual([row[1] for row in self.ranks()], [1, 2])
+    
+    def test_deleted_user_activity_delete(self):
+        """Test that deleting an activity of a deleted user leaves no negative entry behind."""
+        activity = self.log(self.users[0], 100)
+        self.log(self.users[1], 300)
+        self.users[0].delete()
+        activity.delete()
+        self.assertEqual(self.ranks(), [(self.users[1].id, 1, 300)])
+    
+    def test_concurrent_delta_is_kept(self):
+        """Test that a delta another process applies while an entry moves is not overwritten."""
+        from unittest import mock
+        from django.db.models import F
+        from . import leaderboard
+        for calories, user in zip([400, 300], self.users):
+            self.log(user, calories)
+        entries_ahead = leaderboard.entries_ahead
+        
+        def concurrent_writer(entry):
+            # Another worker adds 50 calories between the read and the rank move.
+            Leaderboard.objects.filter(user_id=self.users[0].id).update(total_calories=F('total_calories') + 50)
+            return entries_ahead(entry)
+        
+        with mock.patch.object(leaderboard, 'entries_ahead', side_effect=concurrent_writer):
+            self.log(self.users[0], 100)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.users[0].id).total_calories, 550)
+    
+    @unittest.skipIf(mongomock is None, 'requires mongomock')
+    def test_mongo_rank_lease(self):
+        """Test that the MongoDB rank lease waits for its holder and takes over an expired one."""
+        import time
+        from .leaderboard import mongo_lease
+        locks = mongomock.MongoClient().octofit_db.locks
+        locks.insert_one({'_id': 'ranks', 'holder': 'dead', 'expires': time.time() - 1})
+        with mongo_lease(locks, 'ranks'):
+            self.assertNotEqual(locks.find_one({'_id': 'ranks'})['holder'], 'dead')
+        self.assertIsNone(locks.find_one({'_id': 'ranks'}))
+        
+        locks.insert_one({'_id': 'ranks', 'holder': 'busy', 'expires': time.time() + 0.1})
+        started = time.monotonic()
+        with mongo_lease(locks, 'ranks'):
+            self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+class IndexableSkipListTest(TestCase):
+    """Test case for the order-statistic skip list behind the ranked index."""
+    
+    def test_matches_sorted_list(self):
+        """Test positions and slices against a plain sorted list."""
+        import random
+        rng = random.Random(7)
+        skiplist = IndexableSkipList(seed=7)
+        expected = []
+        for key in rng.sample(range(10000), 500):
+            skiplist.insert((-key, key))
+            expected.append((-key, key))
+        for key in expected[::3]:
+            skiplist.remove(key)
+        expected = sorted(set(expected) - set(expected[::3]))
+        self.assertEqual(list(skiplist), expected)
+        self.assertEqual(len(skiplist), len(expected))
+        for position in (0, 1, 57, len(expected) - 1):
+            self.assertEqual(skiplist.index(expected[position]), position)
+        self.assertEqual(skiplist.slice(10, 20), expected[10:20])
+        self.assertEqual(skiplist.slice(-5, 3), expected[:3])
+        with self.assertRaises(KeyError):
+            skiplist.index((1, -1))
+
+
+class RankedLeaderboardAPITest(APITestCase):
+    """Test case for the top-N and around-me leaderboard endpoints."""
+    
+    def setUp(self):
+        leaderboard_index.reset()
+        self.users = [
+            User.objects.create(
+                name=f'Hero {i}',
+                email=f'hero{i}@test.com',
+                password='pass123',
+                team_id=i % 2 + 1
+            )
+            for i in range(6)
+        ]
+        for i, user in enumerate(self.users):
+            Activity.objects.create(
+                user_id=user.id,
+                activity_type='Running',
+                duration=30,
+                calories=100 * (i + 1),
+                date=timezone.now()
+            )
+    
+    def test_top(self):
+        """Test that ?top=N returns the best N entries in rank order."""
+        response = self.client.get('/api/leaderboard/?top=3')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['total_calories'] for row in response.data], [600, 500, 400])
+    
+    def test_top_within_team(self):
+        """Test that ?team_id limits the slice to one team."""
+        response = self.client.get('/api/leaderboard/?top=2&team_id=1')
+        self.assertEqual([row['total_calories'] for row in response.data], [500, 300])
+    
+    def test_top_follows_writes(self):
+        """Test that the loaded index picks up new activities."""
+        self.client.get('/api/leaderboard/?top=1')
+        Activity.objects.create(
+            user_id=self.users[0].id,
+            activity_type='Cycling',
+            duration=90,
+            calories=1000,
+            date=timezone.now()
+        )
+        response = self.client.get('/api/leaderboard/?top=1')
+        self.assertEqual(response.data[0]['user_id'], self.users[0].id)
+    
+    def test_around(self):
+        """Test the window of entries around a user."""
+        response = self.client.get(f'/api/leaderboard/around/{self.users[2].id}/?radius=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 4)
+        self.assertEqual(response.data['team_rank'], 2)
+        self.assertEqual(
+            [row['total_calories'] for row in response.data['results']], [400, 300, 200]
+        )
+        response = self.client.get(
+            f'/api/leaderboard/around/{self.users[2].id}/?radius=1&scope=team'
+        )
+        self.assertEqual(
+            [row['total_calories'] for row in response.data['results']], [500, 300, 100]
+        )
+    
+    def test_team_change_moves_entry(self):
+        """Test that a user's entry follows them to a new team in the loaded index."""
+        self.client.get('/api/leaderboard/?top=1')
+        self.users[4].team_id = 2
+        self.users[4].save()
+        self.assertEqual(Leaderboard.objects.get(user_id=self.users[4].id).team_id, 2)
+        response = self.client.get('/api/leaderboard/?top=3&team_id=2')
+        self.assertEqual([row['total_calories'] for row in response.data], [600, 500, 400])
+        response = self.client.get('/api/leaderboard/?top=3&team_id=1')
+        self.assertEqual([row['total_calories'] for row in response.data], [300, 100])
+        response = self.client.get(f'/api/leaderboard/around/{self.users[4].id}/?radius=1&scope=team')
+        self.assertEqual(response.data['team_rank'], 2)
+    
+    def test_around_unknown_user(self):
+        """Test that users without an entry return 404."""
+        response = self.client.get('/api/leaderboard/around/9999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_invalid_top(self):
+        """Test that malformed slice sizes are rejected."""
+        response = self.client.get('/api/leaderboard/?top=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RollupMaintenanceTest(TestCase):
+    """Test case for incremental per-day user and team rollups."""
+    
+    def setUp(self):
+        self.user = User.objects.create(name='Hero', email='hero@test.com', password='pass', team_id=7)
+        self.mate = User.objects.create(name='Mate', email='mate@test.com', password='pass', team_id=7)
+        self.day = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    
+    def log(self, user, duration, distance=None, calories=100, days_ago=0):
+        from datetime import timedelta
+        return Activity.objects.create(
+            user_id=user.id,
+            activity_type='Running',
+            duration=duration,
+            distance=distance,
+            calories=calories,
+            date=self.day - timedelta(days=days_ago)
+        )
+    
+    def snapshot(self):
+        fields = ['day', 'activity_count', 'duration_sum', 'duration_min', 'duration_max',
+                  'distance_sum', 'distance_min', 'distance_max', 'calories_sum']
+        return (
+            list(UserDailyStats.objects.order_by('user_id', 'day').values_list('user_id', *fields)),
+            list(TeamDailyStats.objects.order_by('team_id', 'day').values_list('team_id', *fields)),
+        )
+    
+    def assert_matches_rebuild(self):
+        incremental = self.snapshot()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.snapshot())
+    
+    def test_rollups_follow_writes(self):
+        """Test that creates, updates and deletes keep rollups equal to a rebuild."""
+        first = self.log(self.user, 30, distance=5.0)
+        self.log(self.user, 60, distance=2.5)
+        self.log(self.mate, 45)
+        self.log(self.user, 20, days_ago=1)
+        row = UserDailyStats.objects.get(user_id=self.user.id, day=timezone.localdate(self.day))
+        self.assertEqual((row.activity_count, row.duration_sum, row.duration_min, row.duration_max),
+                         (2, 90, 30, 60))
+        self.assertEqual(TeamDailyStats.objects.get(team_id=7, day=timezone.localdate(self.day)).activity_count, 3)
+        self.assert_matches_rebuild()
+        
+        first.duration = 90
+        first.save()
+        self.assert_matches_rebuild()
+        first.delete()
+        row = UserDailyStats.objects.get(user_id=self.user.id, day=timezone.localdate(self.day))
+        self.assertEqual((row.duration_min, row.distance_min), (60, 2.5))
+        self.assert_matches_rebuild()
+    
+    def test_last_activity_removes_row(self):
+        """Test that a bucket disappears with its last activity."""
+        self.log(self.user, 30).delete()
+        self.assertFalse(UserDailyStats.objects.exists())
+        self.assertFalse(TeamDailyStats.objects.exists())
+    
+    def test_concurrent_adds_are_kept(self):
+        """Test that another worker's write landing mid-update is added to, not overwritten."""
+        from unittest import mock
+        from django.db.models import F
+        from . import rollups
+        
+        self.log(self.user, 30)
+        today = timezone.localdate(self.day)
+        fold = rollups._fold
+        
+        def other_worker_writes(stats, values):
+            if not other_worker_writes.done:
+                other_worker_writes.done = True
+                UserDailyStats.objects.filter(user_id=self.user.id, day=today).update(
+                    activity_count=F('activity_count') + 1, duration_sum=F('duration_sum') + 10, duration_min=10,
+                )
+            fold(stats, values)
+        other_worker_writes.done = False
+        
+        with mock.patch.object(rollups, '_fold', other_worker_writes):
+            self.log(self.user, 60)
+        row = UserDailyStats.objects.get(user_id=self.user.id, day=today)
+        self.assertEqual((row.activity_count, row.duration_sum, row.duration_min, row.duration_max),
+                         (3, 100, 10, 60))
+    
+    def test_team_change_moves_rollups(self):
+        """Test that a user's rollups follow them to a new team, and a later delete leaves the old team alone."""
+        old = self.log(self.user, 30, calories=300)
+        self.log(self.mate, 45, calories=200)
+        self.user.team_id = 8
+        self.user.save()
+        today = timezone.localdate(self.day)
+        self.assertEqual(TeamDailyStats.objects.get(team_id=7, day=today).calories_sum, 200)
+        self.assertEqual(TeamDailyStats.objects.get(team_id=8, day=today).calories_sum, 300)
+        self.assert_matches_rebuild()
+        
+        self.log(self.user, 20, calories=100)
+        old.delete()
+        self.assertEqual(TeamDailyStats.objects.get(team_id=7, day=today).calories_sum, 200)
+        self.assertEqual(TeamDailyStats.objects.get(team_id=8, day=today).calories_sum, 100)
+        self.assert_matches_rebuild()
+    
+    def test_muted_team_change_is_left_alone(self):
+        """Test that a team change saved while signals are muted moves nothing."""
+        from .models import ActivityChange
+        from .signals import muted
+        
+        self.log(self.user, 30, calories=300)
+        before = ActivityChange.objects.count()
+        with muted():
+            self.user.team_id = 8
+            self.user.save()
+        today = timezone.localdate(self.day)
+        self.assertEqual(TeamDailyStats.objects.get(team_id=7, day=today).calories_sum, 300)
+        self.assertFalse(TeamDailyStats.objects.filter(team_id=8).exists())
+        self.assertEqual(Activity.objects.get(user_id=self.user.id).team_id, 7)
+        self.assertEqual(ActivityChange.objects.count(), before)
+
+
+class StatsAPITest(APITestCase):
+    """Test case for the rollup-backed stats endpoint."""
+    
+    def setUp(self):
+        from datetime import datetime
+        self.user = User.objects.create(name='Hero', email='hero@test.com', password='pass', team_id=3)
+        # 2026-03-02 is a Monday
+        for day, calories in [(2, 100), (3, 200), (9, 50), (31, 10)]:
+            Activity.objects.create(
+                user_id=self.user.id,
+                activity_type='Cycling',
+                duration=30,
+                calories=calories,
+                date=timezone.make_aware(datetime(2026, 3, day, 9))
+            )
+    
+    def get(self, **params):
+        from urllib.parse import urlencode
+        return self.client.get('/api/stats/?' + urlencode(params))
+    
+    def test_daily(self):
+        """Test day buckets for a user."""
+        response = self.get(id=self.user.id, start='2026-03-01', end='2026-03-04')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(b['start'], b['calories']['sum']) for b in response.data['buckets']],
+            [('2026-03-02', 100), ('2026-03-03', 200)]
+        )
+    
+    def test_weekly_team(self):
+        """Test week buckets for a team."""
+        response = self.get(scope='team', id=3, period='week', start='2026-03-01', end='2026-03-15')
+        buckets = response.data['buckets']
+        self.assertEqual([b['start'] for b in buckets], ['2026-03-02', '2026-03-09'])
+        self.assertEqual(buckets[0]['activity_count'], 2)
+        self.assertEqual(buckets[0]['calories'], {'sum': 300, 'min': 100, 'max': 200})
+    
+    def test_monthly(self):
+        """Test month buckets."""
+        response = self.get(id=self.user.id, period='month', start='2026-01-01', end='2026-03-31')
+        self.assertEqual(len(response.data['buckets']), 1)
+        self.assertEqual(response.data['buckets'][0]['calories']['sum'], 360)
+    
+    def test_invalid_params(self):
+        """Test parameter validation."""
+        self.assertEqual(self.get().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get(id=1, period='year').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.get(id=1, start='2026-03-05', end='2026-03-01').status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+class IndexTest(TestCase):
+    """Test case for the declared secondary indexes."""
+    
+    def test_hot_queries_use_indexes(self):
+        """Test that the API's filters and orderings are not full scans."""
+        from datetime import datetime
+        from .indexes import full_scans
+        from .leaderboard import entries_ahead
+        since = timezone.make_aware(datetime(2026, 3, 1))
+        querysets = [
+            Activity.objects.filter(user_id=1).order_by('-date'),
+            Activity.objects.filter(activity_type='Running', date__gte=since),
+            Activity.objects.order_by('-date', '-id'),
+            Leaderboard.objects.filter(user_id=1),
+            Leaderboard.objects.filter(team_id=1).order_by('-total_calories'),
+            Leaderboard.objects.filter(rank__lte=10).order_by('rank', 'id'),
+            entries_ahead(Leaderboard(pk=5, total_calories=100)),
+            User.objects.filter(team_id=1),
+            Team.objects.order_by('created_at', 'id'),
+        ]
+        for queryset in querysets:
+            self.assertEqual(full_scans(queryset), [], str(queryset.query))
+    
+    def test_full_scan_detected(self):
+        """Test that an unindexed filter is reported as a full scan."""
+        from .indexes import full_scans
+        self.assertEqual(full_scans(Workout.objects.filter(difficulty='Hard')), ['workouts'])
+    
+    def test_sync_indexes_command(self):
+        """Test that sync_indexes recreates a missing declared index."""
+        from io import StringIO
+        from django.db import connection
+        index = next(i for i in Activity._meta.indexes if i.name == 'activity_user_date_idx')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX {index.name}')
+        out = StringIO()
+        call_command('sync_indexes', stdout=out)
+        self.assertIn('Created activities.activity_user_date_idx', out.getvalue())
+        with connection.cursor() as cursor:
+            self.assertIn(index.name, connection.introspection.get_constraints(cursor, 'activities'))
+    
+    @unittest.skipIf(mongomock is None, 'requires mongomock')
+    def test_sync_mongo_indexes(self):
+        """Test that declared indexes are created on MongoDB and stale ones reported."""
+        from .indexes import sync_mongo_indexes
+        db = mongomock.MongoClient().octofit_db
+        db.activities.create_index([('user_id', 1)], name='activity_user_date_idx')
+        db.activities.create_index([('calories', 1)], name='old_calories_idx')
+        report = sync_mongo_indexes(db)
+        self.assertIn('activity_user_date_idx', report['activities']['created'])
+        self.assertEqual(report['activities']['undeclared'], ['old_calories_idx'])
+        self.assertEqual(
+            db.activities.index_information()['activity_user_date_idx']['key'],
+            [('user_id', 1), ('date', -1)]
+        )
+        self.assertEqual(sync_mongo_indexes(db)['activities']['created'], [])
+    
+    def test_mongo_plan_scans(self):
+        """Test COLLSCAN detection in a MongoDB explain plan."""
+        from .indexes import mongo_plan_scans
+        ixscan = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+        collscan = {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}
+        self.assertFalse(mongo_plan_scans(ixscan))
+        self.assertTrue(mongo_plan_scans(collscan))
+
+
+class AggregationTest(TestCase):
+    """Test case for the team and activity type totals."""
+    
+    def setUp(self):
+        from datetime import datetime
+        self.users = [
+            User.objects.create(name=f'Hero {i}', email=f'hero{i}@test.com', password='pass', team_id=team_id)
+            for i, team_id in enumerate([1, 1, 2, None])
+        ]
+        rows = [
+            (0, 'Running', 30, 5.5, 300, 1),
+            (0, 'Yoga', 60, None, 200, 2),
+            (1, 'Running', 20, 3.25, 250, 3),
+            (2, 'Cycling', 90, 30.0, 900, 4),
+            (3, 'Running', 10, 1.0, 100, 5),
+            (1, 'Running', 45, 8.0, 500, 20),
+        ]
+        for index, activity_type, duration, distance, calories, day in rows:
+            Activity.objects.create(
+                user_id=self.users[index].id, activity_type=activity_type, duration=duration,
+                distance=distance, calories=calories,
+                date=timezone.make_aware(datetime(2026, 3, day, 9))
+            )
+    
+    def mongo(self):
+        """Copy the test rows into a mongomock database laid out like djongo's."""
+        from datetime import timezone as dt_timezone
+        db = mongomock.MongoClient().octofit_db
+        for model in (User, Activity):
+            documents = list(model.objects.values())
+            for document in documents:
+                for key, value in document.items():
+                    if hasattr(value, 'tzinfo') and value.tzinfo is not None:
+                        # djongo stores naive UTC datetimes
+                        document[key] = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+            db[model._meta.db_table].insert_many(documents)
+        return db
+    
+    def test_team_totals(self):
+        """Test that team totals sum members' activities and skip users without a team."""
+        from .aggregation import team_totals
+        totals = team_totals()
+        self.assertEqual([row['team_id'] for row in totals], [1, 2])
+        self.assertEqual(totals[0]['total_calories'], 1250)
+        self.assertEqual(totals[0]['total_distance'], 16.75)
+        self.assertEqual(totals[0]['activity_count'], 4)
+        self.assertEqual(totals[0]['member_count'], 2)
+    
+    def test_type_breakdown(self):
+        """Test per-type totals, narrowed by team and date range."""
+        from datetime import datetime
+        from .aggregation import type_breakdown
+        breakdown = type_breakdown(team_id=1, end=timezone.make_aware(datetime(2026, 3, 10)))
+        self.assertEqual(
+            [(row['activity_type'], row['total_calories'], row['total_distance']) for row in breakdown],
+            [('Running', 550, 8.75), ('Yoga', 200, 0.0)]
+        )
+    
+    def test_rebuild_uses_ranked_totals(self):
+        """Test that a rebuild ranks users by their aggregated calories."""
+        rebuild_leaderboard()
+        self.assertEqual(
+            list(Leaderboard.objects.order_by('rank').values_list('user_id', 'total_calories')),
+            [(self.users[2].id, 900), (self.users[1].id, 750), (self.users[0].id, 500), (self.users[3].id, 100)]
+        )
+    
+    def test_stats_endpoints(self):
+        """Test the team and activity type stats endpoints."""
+        response = self.client.get('/api/stats/teams/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['team_id'], 1)
+        response = self.client.get(f'/api/stats/types/?user_id={self.users[2].id}')
+        self.assertEqual([row['activity_type'] for row in response.data], ['Cycling'])
+    
+    def test_ranked_totals_fallback(self):
+        """Test that pipelines may spill to disk and only an unknown stage falls back to the older pipeline."""
+        from unittest import mock
+        from pymongo.errors import OperationFailure
+        from .aggregation import UNRECOGNIZED_STAGE, ranked_user_totals
+        row = {'_id': 1, 'total_calories': 10, 'total_duration': 5, 'total_distance': 1.0, 'activity_count': 1}
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+        collection.aggregate.side_effect = [OperationFailure('unknown stage', code=UNRECOGNIZED_STAGE), [row]]
+        self.assertEqual([(user_id, rank) for user_id, _, rank in ranked_user_totals(db=db)], [(1, 1)])
+        self.assertTrue(all(call.kwargs == {'allowDiskUse': True} for call in collection.aggregate.call_args_list))
+        
+        collection.aggregate.side_effect = OperationFailure('exceeded memory limit', code=292)
+        with self.assertRaises(OperationFailure):
+            ranked_user_totals(db=db)
+        self.assertEqual(collection.aggregate.call_count, 3)
+    
+    @unittest.skipIf(mongomock is None, 'requires mongomock')
+    def test_pipelines_match_orm(self):
+        """Test that the MongoDB pipelines return what the ORM queries return."""
+        from datetime import datetime
+        from .aggregation import ranked_user_totals, team_totals, type_breakdown, user_totals
+        db = self.mongo()
+        start = timezone.make_aware(datetime(2026, 3, 2))
+        self.assertEqual(user_totals(start=start, db=db), user_totals(start=start))
+        self.assertEqual(ranked_user_totals(db=db), ranked_user_totals())
+        self.assertEqual(team_totals(db=db), team_totals())
+        self.assertEqual(type_breakdown(team_id=1, db=db), type_breakdown(team_id=1))
+        self.assertEqual(type_breakdown(db=db), type_breakdown())
+
+
+@unittest.skipIf(numpy is None, 'generate_load requires numpy')
+class GenerateLoadCommandTest(TestCase):
+    """Test case for the synthetic load generator."""
+    
+    def generate(self, **options):
+        from io import StringIO
+        from datetime import date
+        call_command(
+            'generate_load', users=30, teams=3, activities_per_user=4, chunk_users=7,
+            anchor=date(2026, 3, 1), stdout=StringIO(), **options
+        )
+        user_index = {pk: i for i, pk in enumerate(User.objects.order_by('id').values_list('id', flat=True))}
+        return sorted(
+            (user_index[row[0]],) + row[1:]
+            for row in Activity.objects.values_list('user_id', 'activity_type', 'duration', 'distance', 'calories', 'date')
+        )
+    
+    def test_counts_and_leaderboard(self):
+        """Test that totals and ranks match a full leaderboard rebuild."""
+        self.generate()
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(Activity.objects.count(), 120)
+        generated = list(Leaderboard.objects.order_by('rank').values_list(
+            'user_id', 'team_id', 'total_calories', 'total_duration', 'total_distance', 'rank'
+        ))
+        rebuild_leaderboard()
+        rebuilt = list(Leaderboard.objects.order_by('rank').values_list(
+            'user_id', 'team_id', 'total_calories', 'total_duration', 'total_distance', 'rank'
+        ))
+        self.assertEqual(generated, rebuilt)
+        self.assertTrue(UserDailyStats.objects.exists())
+    
+    def test_deterministic_for_seed(self):
+        """Test that the same seed reproduces the same activities."""
+        self.assertEqual(self.generate(seed=5), self.generate(seed=5))
+        self.assertNotEqual(self.generate(seed=5), self.generate(seed=6))
+    
+    def test_reseed_clears_without_row_signals(self):
+        """Test that reseeding empties tables without per-row delete signals and drops the snapshot."""
+        import os
+        import tempfile
+        from unittest import mock
+        from django.db.models.signals import post_delete
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'octofit.snap')
+        with override_settings(SNAPSHOT_PATH=path):
+            self.generate()
+            call_command('snapshot_build', stdout=open(os.devnull, 'w'))
+            receiver = mock.Mock()
+            for model in (Activity, Leaderboard, User):
+                post_delete.connect(receiver, sender=model)
+                self.addCleanup(post_delete.disconnect, receiver, sender=model)
+            self.generate()
+            rebuild_leaderboard()
+            self.assertFalse(os.path.exists(path))
+        receiver.assert_not_called()
+        self.assertEqual(Activity.objects.count(), 120)
+
+
 class UserAPITest(APITestCase):
     """Test case for User API endpoints."""
     
@@ -94,7 +756,7 @@ class UserAPITest(APITestCase):
         url = '/api/users/'
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class TeamAPITest(APITestCase):
@@ -136,6 +798,1477 @@ class ActivityAPITest(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 400)
+    
+    def test_delete_activity_updates_leaderboard(self):
+        """Test that deleting an activity via API removes it from the totals."""
+        activity = Activity.objects.create(
+            user_id=1,
+            activity_type='Swimming',
+            duration=45,
+            calories=400,
+            date=timezone.now()
+        )
+        response = self.client.delete(f'/api/activities/{activity.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Leaderboard.objects.filter(user_id=1).exists())
+
+
+class ActivityFilterAPITest(APITestCase):
+    """Test case for filtering and ordering the activity list."""
+    
+    def setUp(self):
+        from datetime import datetime
+        self.hero = User.objects.create(name='Hero', email='hero@test.com', password='pass', team_id=1)
+        self.rival = User.objects.create(name='Rival', email='rival@test.com', password='pass', team_id=2)
+        for user, activity_type, day in [
+            (self.hero, 'Running', 1), (self.hero, 'Yoga', 5), (self.hero, 'Running', 9),
+            (self.rival, 'Running', 3), (self.rival, 'Cycling', 7),
+        ]:
+            Activity.objects.create(
+                user_id=user.id, activity_type=activity_type, duration=30, calories=200,
+                date=timezone.make_aware(datetime(2026, 3, day, 9))
+            )
+    
+    def days(self, query):
+        response = self.client.get('/api/activities/?' + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [int(row['date'][8:10]) for row in response.data['results']]
+    
+    def test_filters(self):
+        """Test user, team, type and date range filters and their combinations."""
+        self.assertEqual(self.days(f'user_id={self.hero.id}'), [9, 5, 1])
+        self.assertEqual(self.days('team_id=2'), [7, 3])
+        self.assertEqual(self.days('activity_type=Running'), [9, 3, 1])
+        self.assertEqual(self.days('since=2026-03-03&until=2026-03-09'), [7, 5, 3])
+        self.assertEqual(self.days('team_id=1&activity_type=Running&since=2026-03-02'), [9])
+    
+    def test_ordering(self):
+        """Test oldest-first ordering and its pagination."""
+        self.assertEqual(self.days('ordering=date&team_id=1'), [1, 5, 9])
+        response = self.client.get('/api/activities/?ordering=date&page_size=2')
+        self.assertEqual([row['date'][8:10] for row in response.data['results']], ['01', '03'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['date'][8:10] for row in response.data['results']], ['05', '07'])
+        response = self.client.get('/api/activities/?ordering=calories')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_team_id_follows_user(self):
+        """Test that activities carry their author's team, including after a team change."""
+        response = self.client.post('/api/activities/', {
+            'user_id': self.rival.id, 'activity_type': 'Yoga', 'duration': 20, 'calories': 80,
+            'date': timezone.now().isoformat(), 'team_id': 99,
+        }, format='json')
+        self.assertEqual(response.data['team_id'], 2)
+        self.rival.team_id = 3
+        self.rival.save()
+        self.assertEqual(set(Activity.objects.filter(user_id=self.rival.id).values_list('team_id', flat=True)), {3})
+    
+    def test_filters_use_indexes(self):
+        """Test that every filter combination is answered from an index."""
+        from itertools import combinations
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from .indexes import full_scans
+        from .views import ActivityViewSet
+        params = {'user_id': '1', 'team_id': '1', 'activity_type': 'Running', 'since': '2026-03-01'}
+        for size in range(len(params) + 1):
+            for names in combinations(params, size):
+                for ordering in ('date', '-date'):
+                    query = {name: params[name] for name in names}
+                    request = Request(APIRequestFactory().get('/api/activities/', {**query, 'ordering': ordering}))
+                    view = ActivityViewSet(request=request, action='list', kwargs={}, format_kwarg=None)
+                    queryset = view.get_queryset().order_by(*view.get_keyset_ordering())
+                    self.assertEqual(full_scans(queryset), [], query)
+
+
+class AsyncReadAPITest(TestCase):
+    """Test case for the async read endpoints served to the ASGI app."""
+    
+    def setUp(self):
+        from django.core.cache import caches
+        caches['api'].clear()
+        team = Team.objects.create(name='Team Async', description='Async team')
+        user = User.objects.create(name='Hero', email='hero@test.com', password='pass', team_id=team.id)
+        self.activity = Activity.objects.create(
+            user_id=user.id, activity_type='Running', duration=30, calories=300, date=timezone.now()
+        )
+        self.team = team
+    
+    def async_get(self, path):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient
+        
+        async def get():
+            return await AsyncClient().get(path)
+        return async_to_sync(get)()
+    
+    def test_matches_sync_endpoints(self):
+        """Test that every async endpoint returns what its sync counterpart does."""
+        from django.test import override_settings
+        entry = Leaderboard.objects.get()
+        paths = [
+            '/api/activities/', f'/api/activities/{self.activity.id}/', f'/api/activities/?team_id={self.team.id}',
+            '/api/leaderboard/', f'/api/leaderboard/{entry.id}/', '/api/leaderboard/?top=1',
+            '/api/teams/', f'/api/teams/{self.team.id}/',
+        ]
+        with override_settings(ASYNC_DB_THREADS=0):
+            for path in paths:
+                expected = self.client.get(path)
+                response = self.async_get(path.replace('/api/', '/api/async/', 1))
+                self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+                self.assertEqual(response.json(), expected.json(), path)
+    
+    def test_missing_object(self):
+        """Test that a missing object is a 404 on the async path."""
+        from django.test import override_settings
+        with override_settings(ASYNC_DB_THREADS=0):
+            response = self.async_get('/api/async/teams/999999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_runs_on_bounded_pool(self):
+        """Test that blocking work runs on the database thread pool."""
+        import threading
+        from asgiref.sync import async_to_sync
+        from .async_views import run_blocking
+        name = async_to_sync(run_blocking)(lambda: threading.current_thread().name)
+        self.assertTrue(name.startswith('octofit-db'))
+
+
+class LiveLeaderboardTest(TestCase):
+    """Test case for the pushed leaderboard rank deltas."""
+    
+    def setUp(self):
+        from django.core.cache import caches
+        caches['api'].clear()
+        self.users = [
+            User.objects.create(name=f'Hero {i}', email=f'hero{i}@test.com', password='pass', team_id=1)
+            for i in range(3)
+        ]
+        for user, calories in zip(self.users, [300, 200, 100]):
+            self.log(user, calories)
+    
+    def log(self, user, calories):
+        Activity.objects.create(
+            user_id=user.id, activity_type='Running', duration=30, calories=calories, date=timezone.now()
+        )
+    
+    def test_rank_deltas(self):
+        """Test that only moved, new and removed entries produce deltas."""
+        from .live import rank_deltas, within_top
+        before = {1: (1, 300), 2: (2, 200), 3: (3, 100), 4: (4, 50)}
+        after = {1: (2, 300), 2: (3, 200), 3: (1, 400), 5: (4, 60)}
+        deltas = rank_deltas(before, after)
+        self.assertEqual(deltas, [
+            {'user_id': 3, 'from': 3, 'to': 1, 'total_calories': 400},
+            {'user_id': 1, 'from': 1, 'to': 2, 'total_calories': 300},
+            {'user_id': 2, 'from': 2, 'to': 3, 'total_calories': 200},
+            {'user_id': 5, 'from': None, 'to': 4, 'total_calories': 60},
+            {'user_id': 4, 'from': 4, 'to': None, 'total_calories': None},
+        ])
+        self.assertEqual([delta['user_id'] for delta in within_top(deltas, 2)], [3, 1, 2])
+    
+    def test_writes_coalesce_into_one_broadcast(self):
+        """Test that several writes between refreshes reach subscribers as one diff."""
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import override_settings
+        from .live import LeaderboardFeed
+        feed = LeaderboardFeed(window=3600)
+        
+        async def scenario():
+            queue = await feed.subscribe()
+            await sync_to_async(self.log)(self.users[2], 500)
+            await sync_to_async(self.log)(self.users[1], 50)
+            await feed.refresh()
+            await feed.refresh()
+            events = [queue.get_nowait() for _ in range(queue.qsize())]
+            feed.unsubscribe(queue)
+            return events
+        
+        with override_settings(ASYNC_DB_THREADS=0):
+            events = async_to_sync(scenario)()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(
+            [(d['user_id'], d['from'], d['to']) for d in events[0]['deltas']],
+            [(self.users[2].id, 3, 1), (self.users[0].id, 1, 2), (self.users[1].id, 2, 3)]
+        )
+    
+    def test_feed_reads_only_its_slice(self):
+        """Test that the feed watches its first ranks and follows users who leave them."""
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import override_settings
+        from .live import LeaderboardFeed
+        feed = LeaderboardFeed(window=3600, depth=2)
+        
+        async def scenario():
+            queue = await feed.subscribe()
+            loaded = dict(feed.ranks)
+            await sync_to_async(self.log)(self.users[2], 500)
+            await feed.refresh()
+            events = [queue.get_nowait() for _ in range(queue.qsize())]
+            feed.unsubscribe(queue)
+            return loaded, events
+        
+        with override_settings(ASYNC_DB_THREADS=0):
+            loaded, events = async_to_sync(scenario)()
+        self.assertEqual(set(loaded), {self.users[0].id, self.users[1].id})
+        self.assertEqual(
+            [(d['user_id'], d['from'], d['to']) for d in events[0]['deltas']],
+            [(self.users[2].id, None, 1), (self.users[0].id, 1, 2), (self.users[1].id, 2, 3)]
+        )
+        self.assertEqual(set(feed.ranks), {self.users[2].id, self.users[0].id})
+    
+    def test_feed_sees_other_workers_writes(self):
+        """Test that the feed broadcasts a write made by a process with its own cache."""
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import override_settings
+        from .live import LeaderboardFeed
+        feed = LeaderboardFeed(window=3600)
+        other_worker = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other-worker'}
+        
+        def write_elsewhere():
+            with override_settings(CACHES={'default': other_worker, 'api': other_worker}):
+                self.log(self.users[2], 500)
+        
+        async def scenario():
+            queue = await feed.subscribe()
+            await sync_to_async(write_elsewhere)()
+            await feed.refresh()
+            events = [queue.get_nowait() for _ in range(queue.qsize())]
+            feed.unsubscribe(queue)
+            return events
+        
+        with override_settings(ASYNC_DB_THREADS=0):
+            events = async_to_sync(scenario)()
+        self.assertEqual(events[0]['deltas'][0]['user_id'], self.users[2].id)
+    
+    def test_stream(self):
+        """Test the SSE stream's snapshot, delta and disconnect handling."""
+        import asyncio
+        from unittest import mock
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import override_settings
+        from . import live
+        sent = []
+        
+        async def scenario():
+            disconnected = asyncio.Event()
+            
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+            
+            async def send(message):
+                sent.append(message)
+            
+            scope = {'type': 'http', 'method': 'GET', 'path': live.STREAM_PATH, 'query_string': b'top=2'}
+            stream = asyncio.ensure_future(live.leaderboard_stream(scope, receive, send))
+            while len(sent) < 2:
+                await asyncio.sleep(0)
+            await sync_to_async(self.log)(self.users[2], 500)
+            await live.feed.refresh()
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            disconnected.set()
+            await stream
+            return live.feed.subscribers
+        
+        with override_settings(ASYNC_DB_THREADS=0), mock.patch.object(live, 'feed', live.LeaderboardFeed(window=3600)):
+            subscribers = async_to_sync(scenario)()
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertTrue(sent[1]['body'].startswith(b'event: snapshot\n'))
+        self.assertIn(f'"user_id":{self.users[0].id},"rank":1'.encode(), sent[1]['body'])
+        self.assertTrue(sent[2]['body'].startswith(b'event: ranks\n'))
+        self.assertIn(f'"user_id":{self.users[2].id},"from":3,"to":1'.encode(), sent[2]['body'])
+        self.assertEqual(subscribers, set())
+
+
+class MongoPoolTest(APITestCase):
+    """Test case for the per-process MongoDB client and its pool metrics."""
+    
+    options = {'host': 'localhost', 'port': 27017, 'maxPoolSize': 7, 'waitQueueTimeoutMS': 500}
+    
+    def setUp(self):
+        from . import mongo
+        self.addCleanup(mongo._clients.clear)
+        self.addCleanup(mongo.metrics.reset)
+        mongo.metrics.reset()
+    
+    def test_client_reused_per_process(self):
+        """Test that a process reuses its client and a forked child builds its own."""
+        from unittest import mock
+        from .mongo import get_client
+        client = get_client(**self.options)
+        self.assertIs(get_client(**self.options), client)
+        self.assertEqual(client.max_pool_size, 7)
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(get_client(**self.options), client)
+    
+    def test_backend_shares_client(self):
+        """Test that the engine takes the pooled client, applies READ_PREFERENCE and keeps it open."""
+        from django.db.utils import ConnectionHandler
+        from .mongo import _clients, get_client
+        database = {
+            'ENGINE': 'octofit_tracker.backends.djongo', 'NAME': 'octofit_test', 'ENFORCE_SCHEMA': False,
+            'CLIENT': dict(self.options),
+        }
+        handler = ConnectionHandler({
+            'default': database, 'reads': {**database, 'READ_PREFERENCE': 'secondaryPreferred'},
+        })
+        wrapper = handler['reads']
+        database = wrapper.get_new_connection(wrapper.get_connection_params())
+        self.assertIs(database.client, get_client(**self.options))
+        self.assertEqual(database.read_preference.mongos_mode, 'secondaryPreferred')
+        wrapper.connection = database
+        wrapper.close()
+        self.assertIn(database.client, _clients.values())
+    
+    def test_metrics_count_pool_events(self):
+        """Test that pool events move the checked-out, waiting and created counters."""
+        from pymongo import monitoring
+        from .mongo import metrics
+        address = ('localhost', 27017)
+        metrics.connection_created(monitoring.ConnectionCreatedEvent(address, 1))
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1))
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['created'], snapshot['checked_out'], snapshot['waiting']), (1, 1, 1))
+        metrics.connection_check_out_failed(
+            monitoring.ConnectionCheckOutFailedEvent(address, monitoring.ConnectionCheckOutFailedReason.TIMEOUT)
+        )
+        metrics.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+        response = self.client.get('/api/pool/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['checked_out'], 0)
+        self.assertEqual(response.data['waiting'], 0)
+        self.assertEqual(response.data['checkout_failures'], 1)
+        self.assertEqual(response.data['peak_waiting'], 2)
+        self.assertIn('maxPoolSize', response.data['options'])
+
+
+class InstrumentationTest(APITestCase):
+    """Test case for the request instrumentation middleware and /metrics."""
+    
+    def setUp(self):
+        from django.core.cache import caches
+        from . import instrumentation
+        caches['api'].clear()
+        for histogram in instrumentation.HISTOGRAMS:
+            histogram.reset()
+        Activity.objects.create(user_id=1, activity_type='Running', duration=30, calories=100,
+                                date=timezone.now())
+    
+    def test_server_timing(self):
+        """Test that sampled requests report db, serialize and total timings."""
+        import re
+        from django.test import override_settings
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0):
+            response = self.client.get('/api/activities/')
+        timing = response['Server-Timing']
+        match = re.match(r'db;dur=[\d.]+;desc="(\d+) queries", serialize;dur=[\d.]+, total;dur=[\d.]+$', timing)
+        self.assertIsNotNone(match, timing)
+        self.assertGreaterEqual(int(match.group(1)), 1)
+    
+    def test_unsampled_requests_are_only_timed(self):
+        """Test that requests outside the sample get the total only."""
+        from django.test import override_settings
+        from .instrumentation import DB_QUERIES, REQUEST_SECONDS
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=0):
+            response = self.client.get('/api/activities/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$')
+        self.assertEqual(REQUEST_SECONDS.count(('activity-list', 'GET')), 1)
+        self.assertEqual(DB_QUERIES.count(('activity-list',)), 0)
+    
+    def test_prometheus_metrics(self):
+        """Test that /metrics exposes the histograms per view in the text format."""
+        from django.test import override_settings
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0):
+            self.client.get('/api/activities/')
+            self.client.get('/api/activities/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE octofit_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'octofit_http_request_duration_seconds_bucket{view="activity-list",method="GET",le="+Inf"} 2', body
+        )
+        self.assertIn('octofit_http_request_db_queries_count{view="activity-list"} 2', body)
+        self.assertIn('octofit_mongo_pool_connections{state="checked_out"}', body)
+    
+    def test_measurement_follows_async_pool(self):
+        """Test that queries run on the async database pool count towards the request."""
+        from asgiref.sync import async_to_sync
+        from django.test import override_settings
+        from .async_views import run_blocking
+        from .instrumentation import Measurement, _current, current
+        
+        async def scenario():
+            measurement = Measurement()
+            token = _current.set(measurement)
+            try:
+                seen = await run_blocking(current)
+            finally:
+                _current.reset(token)
+            return measurement, seen
+        
+        with override_settings(ASYNC_DB_THREADS=2):
+            measurement, seen = async_to_sync(scenario)()
+        self.assertIs(seen, measurement)
+
+
+class NPlusOneTest(TestCase):
+    """Test case for the repeated query shape (N+1) detector."""
+    
+    def test_normalize_sql(self):
+        """Test that literals and IN lists of any length normalize to one shape."""
+        from .nplusone import normalize_sql
+        one = normalize_sql('SELECT * FROM "users" WHERE "users"."id" IN (1, 2, 3) AND name = \'a\'')
+        other = normalize_sql('SELECT *  FROM "users" WHERE "users"."id" IN (%s) AND name = %s')
+        self.assertEqual(one, other)
+        self.assertEqual(one, 'SELECT * FROM "users" WHERE "users"."id" IN (...) AND name = ?')
+    
+    def test_normalize_command(self):
+        """Test that MongoDB commands differing only in values share a shape."""
+        from .nplusone import normalize_command
+        one = normalize_command('find', {'find': 'users', 'filter': {'id': {'$in': [1, 2]}}, 'limit': 1})
+        other = normalize_command('find', {'find': 'users', 'filter': {'id': {'$in': [7]}}, 'limit': 5})
+        self.assertEqual(one, other)
+        self.assertNotEqual(one, normalize_command('find', {'find': 'activities', 'filter': {'id': {'$in': [7]}}}))
+    
+    def test_detect_raises_on_repeats(self):
+        """Test that a per-row query loop over the threshold raises NPlusOneError."""
+        from .nplusone import NPlusOneError, detect
+        users = [User.objects.create(name=f'U{index}', email=f'u{index}@x.com') for index in range(4)]
+        with detect(threshold=3, action='raise'):
+            for user in users[:3]:
+                User.objects.filter(id=user.id).first()
+        with self.assertRaises(NPlusOneError) as raised:
+            with detect(threshold=3, action='raise', label='loop'):
+                for user in users:
+                    User.objects.filter(id=user.id).first()
+        self.assertIn('4x SELECT', str(raised.exception))
+        self.assertIn('in loop', str(raised.exception))
+        with detect(threshold=3, action='raise'):
+            list(User.objects.filter(id__in=[user.id for user in users]))
+    
+    def test_middleware_warns(self):
+        """Test that the middleware warns about a request with N+1 queries in dev mode."""
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .instrumentation import InstrumentationMiddleware
+        from .nplusone import NPlusOneWarning
+        
+        def view(request):
+            for index in range(5):
+                User.objects.filter(id=index).exists()
+            return HttpResponse()
+        
+        middleware = InstrumentationMiddleware(view)
+        request = RequestFactory().get('/api/users/')
+        with override_settings(QUERY_REPEAT_THRESHOLD=4, QUERY_REPEAT_ACTION='warn'):
+            with self.assertWarns(NPlusOneWarning) as warned, self.assertLogs('octofit_tracker.nplusone'):
+                middleware(request)
+        self.assertIn('GET /api/users/', str(warned.warning))
+        with override_settings(QUERY_REPEAT_THRESHOLD=0):
+            middleware(request)
+
+
+class WindowRankingsTest(APITestCase):
+    """Test case for the sliding-window rankings and /api/leaderboard/?window=."""
+    
+    def setUp(self):
+        from .windows import window_rankings
+        window_rankings.reset()
+        self.red = Team.objects.create(name='Red', description='Red team')
+        self.blue = Team.objects.create(name='Blue', description='Blue team')
+        self.ann = User.objects.create(name='Ann', email='ann@x.com', password='secret', team_id=self.red.id)
+        self.bob = User.objects.create(name='Bob', email='bob@x.com', password='secret', team_id=self.red.id)
+        self.cat = User.objects.create(name='Cat', email='cat@x.com', password='secret', team_id=self.blue.id)
+    
+    def log(self, user, ago, **totals):
+        values = {'activity_type': 'Running', 'duration': 30, 'calories': 100, 'distance': 1.0, **totals}
+        return Activity.objects.create(user_id=user.id, date=timezone.now() - ago, **values)
+    
+    def test_buckets_expire(self):
+        """Test that totals drop activities as they slide out of each window."""
+        from datetime import timedelta
+        from .windows import WindowRankings
+        self.log(self.ann, timedelta(minutes=30), calories=100)
+        self.log(self.ann, timedelta(hours=3), calories=50)
+        self.log(self.bob, timedelta(hours=10), calories=999)
+        rankings = WindowRankings(windows=('2h', '4h'), bucket_seconds=3600)
+        now = timezone.now()
+        self.assertEqual(rankings.top('calories', '2h', now=now), [(self.ann.id, {
+            'calories': 100, 'duration': 30, 'distance': 1.0,
+        })])
+        self.assertEqual(rankings.top('calories', '4h', now=now)[0][1]['calories'], 150)
+        with self.assertNumQueries(0):
+            later = now + timedelta(hours=2)
+            self.assertEqual(rankings.top('calories', '2h', now=later), [])
+            self.assertEqual(rankings.top('calories', '4h', now=later)[0][1]['calories'], 100)
+            self.assertEqual(rankings.top('calories', '4h', scope='team', now=later), [(self.red.id, {
+                'calories': 100, 'duration': 30, 'distance': 1.0,
+            })])
+    
+    def test_team_distance_window(self):
+        """Test ranking teams by distance, following writes and team changes."""
+        from datetime import timedelta
+        self.log(self.ann, timedelta(days=1), distance=5.0)
+        self.log(self.bob, timedelta(days=2), distance=4.0)
+        self.log(self.cat, timedelta(days=3), distance=7.5)
+        self.log(self.cat, timedelta(days=20), distance=50.0)
+        url = '/api/leaderboard/?metric=distance&window=7d&scope=team'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['rank'], row['name'], row['total_distance']) for row in response.data['results']],
+            [(1, 'Red', 9.0), (2, 'Blue', 7.5)],
+        )
+        self.cat.team_id = self.red.id
+        self.cat.save()
+        activity = self.log(self.ann, timedelta(hours=1), distance=2.5)
+        results = self.client.get(url).data['results']
+        self.assertEqual([(row['team_id'], row['total_distance']) for row in results], [(self.red.id, 19.0)])
+        activity.delete()
+        users = self.client.get('/api/leaderboard/?metric=distance&window=30d').data['results']
+        self.assertEqual(
+            [(row['name'], row['team_id'], row['total_distance']) for row in users],
+            [('Cat', self.red.id, 57.5), ('Ann', self.red.id, 5.0), ('Bob', self.red.id, 4.0)],
+        )
+    
+    def test_other_workers_writes(self):
+        """Test that another worker's writes reach loaded rankings through the change log, without a reload."""
+        from datetime import timedelta
+        from unittest import mock
+        from .ingest import insert_activities
+        from .windows import WindowRankings
+        moved = self.log(self.ann, timedelta(hours=1), calories=100)
+        deleted = self.log(self.bob, timedelta(hours=2), calories=200)
+        # Not the rankings the signal handlers of this process write to.
+        rankings = WindowRankings(windows=('1d', '7d'), bucket_seconds=3600)
+        self.assertEqual(rankings.top('calories', '1d')[0][0], self.bob.id)
+        moved.date = timezone.now() - timedelta(days=3)
+        moved.save()
+        deleted.delete()
+        self.cat.team_id = self.red.id
+        self.cat.save()
+        insert_activities([Activity(
+            user_id=self.cat.id, activity_type='Running', duration=30, calories=70, distance=1.0,
+            date=timezone.now() - timedelta(hours=5),
+        )])
+        with override_settings(ACTIVITY_CHANGES_POLL_SECONDS=0), \
+                mock.patch.object(rankings, '_load', side_effect=AssertionError('reloaded')):
+            with self.assertNumQueries(3):
+                day = rankings.top('calories', '1d')
+            week = rankings.top('calories', '7d', scope='team')
+        self.assertEqual([(user_id, totals['calories']) for user_id, totals in day], [(self.cat.id, 70)])
+        self.assertEqual([(team_id, totals['calories']) for team_id, totals in week], [(self.red.id, 170)])
+    
+    def test_invalid_parameters(self):
+        """Test that unknown metrics, windows and scopes are rejected."""
+        for query in ('metric=steps', 'window=90d', 'window=7d&scope=planet'):
+            response = self.client.get(f'/api/leaderboard/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+
+class ColumnarStoreTest(APITestCase):
+    """Test case for the NumPy columnar analytics store."""
+    
+    def setUp(self):
+        import os
+        import tempfile
+        from datetime import timedelta
+        from .columnar import activity_store
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(SNAPSHOT_PATH=os.path.join(directory.name, 'none.snap'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        activity_store.reset()
+        self.red = Team.objects.create(name='Red', description='Red team')
+        self.blue = Team.objects.create(name='Blue', description='Blue team')
+        ann = User.objects.create(name='Ann', email='ann@x.com', password='secret', team_id=self.red.id)
+        bob = User.objects.create(name='Bob', email='bob@x.com', password='secret', team_id=self.blue.id)
+        loner = User.objects.create(name='Loner', email='loner@x.com', password='secret')
+        self.now = timezone.now()
+        for user, activity_type, duration, distance, days in (
+            (ann, 'Running', 30, 5.5, 1), (ann, 'Running', 50, 7.25, 3), (ann, 'Yoga', 60, None, 2),
+            (bob, 'Running', 20, 3.0, 1), (bob, 'Cycling', 90, 30.0, 40), (loner, 'Yoga', 45, None, 1),
+        ):
+            Activity.objects.create(
+                user_id=user.id, activity_type=activity_type, duration=duration, distance=distance,
+                calories=duration * 10, date=self.now - timedelta(days=days),
+            )
+    
+    def test_matches_aggregation(self):
+        """Test that team and type totals match the database aggregations."""
+        from datetime import timedelta
+        from .aggregation import team_totals, type_breakdown
+        from .columnar import activity_store
+        since = self.now - timedelta(days=30)
+        self.assertEqual(activity_store.team_totals(), team_totals())
+        self.assertEqual(activity_store.team_totals(start=since), team_totals(start=since))
+        self.assertEqual(activity_store.type_breakdown(), type_breakdown())
+        self.assertEqual(activity_store.type_breakdown(team_id=self.red.id), type_breakdown(team_id=self.red.id))
+        self.assertEqual(activity_store.type_breakdown(end=since), type_breakdown(end=since))
+    
+    def test_group_by_team_and_type(self):
+        """Test average duration per activity type per team over a date range."""
+        from datetime import timedelta
+        from .columnar import activity_store
+        rows = activity_store.summarize(('team_id', 'activity_type'), start=self.now - timedelta(days=30))
+        self.assertEqual(
+            [(row['team_id'], row['activity_type'], row['activity_count'], row['avg_duration']) for row in rows],
+            [(self.red.id, 'Running', 2, 40.0), (self.red.id, 'Yoga', 1, 60.0), (self.blue.id, 'Running', 1, 20.0)],
+        )
+        self.assertEqual(activity_store.summarize(('user_id',), activity_type='Boxing'), [])
+        with self.assertRaises(ValueError):
+            activity_store.summarize(('calories',))
+    
+    def test_incremental_refresh(self):
+        """Test that new activities are appended, even out of id order, and that writes patch rows in place."""
+        from .columnar import activity_store
+        activity_store.refresh()
+        self.assertEqual(activity_store.size, 6)
+        self.assertEqual(activity_store.columns['activity_type'].dtype, 'int16')
+        self.assertEqual(activity_store.types, ['Running', 'Yoga', 'Cycling'])
+        activity = Activity.objects.create(
+            id=100, user_id=1, activity_type='Boxing', duration=10, calories=80, date=self.now
+        )
+        with self.assertNumQueries(1):
+            activity_store.refresh()
+        self.assertEqual(activity_store.size, 7)
+        # A lower id committed after a higher one has been read.
+        Activity.objects.create(id=50, user_id=1, activity_type='Boxing', duration=5, calories=40, date=self.now)
+        activity.duration = 20
+        activity.save()
+        Activity.objects.filter(activity_type='Cycling').get().delete()
+        rows = activity_store.summarize(('activity_type',))
+        self.assertEqual(activity_store.size, 8)
+        self.assertEqual(
+            [(row['activity_type'], row['activity_count'], row['total_duration']) for row in rows],
+            [('Yoga', 2, 105), ('Running', 3, 100), ('Boxing', 2, 25)],
+        )
+    
+    def test_other_workers_writes(self):
+        """Test that another worker's updates, deletes and team moves are patched in from the change log."""
+        from unittest import mock
+        from .aggregation import team_totals, type_breakdown
+        from .columnar import ActivityStore
+        # Not the store the signal handlers of this process patch.
+        store = ActivityStore()
+        store.refresh()
+        updated, deleted = Activity.objects.filter(activity_type='Running').order_by('id')[:2]
+        updated.activity_type = 'Boxing'
+        updated.save()
+        deleted.delete()
+        loner = User.objects.get(name='Loner')
+        loner.team_id = self.blue.id
+        loner.save()
+        with override_settings(ACTIVITY_CHANGES_POLL_SECONDS=0), \
+                mock.patch.object(store, '_load', side_effect=AssertionError('reloaded')):
+            with self.assertNumQueries(4):
+                store.refresh()
+            self.assertEqual(store.size, 6)
+            self.assertEqual(store.team_totals(), team_totals())
+            self.assertEqual(store.type_breakdown(), type_breakdown())
+    
+    def test_endpoints_opt_in(self):
+        """Test that the stats endpoints answer the same from the columnar store."""
+        urls = ('/api/stats/teams/', f'/api/stats/types/?team_id={self.blue.id}')
+        expected = [self.client.get(url).data for url in urls]
+        with override_settings(ANALYTICS_COLUMNAR=True):
+            self.assertEqual([self.client.get(url).data for url in urls], expected)
+
+
+class SnapshotTest(TestCase):
+    """Test case for the memory-mapped snapshot and its delta log."""
+    
+    def setUp(self):
+        import os
+        import tempfile
+        from datetime import timedelta
+        from .columnar import activity_store
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'octofit.snap')
+        settings = override_settings(SNAPSHOT_PATH=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        activity_store.reset()
+        self.team = Team.objects.create(name='Mapped')
+        self.ann = User.objects.create(name='Ann', email='ann@x.com', password='secret', team_id=self.team.id)
+        self.bob = User.objects.create(name='Bob', email='bob@x.com', password='secret')
+        now = timezone.now()
+        self.activities = [
+            Activity.objects.create(user_id=user.id, activity_type=activity_type, duration=duration,
+                                    distance=distance, calories=duration * 10, date=now - timedelta(days=days))
+            for user, activity_type, duration, distance, days in (
+                (self.ann, 'Running', 30, 5.0, 1), (self.ann, 'Yoga', 60, None, 2),
+                (self.bob, 'Running', 45, 8.5, 3), (self.bob, 'Cycling', 90, 25.0, 4),
+            )
+        ]
+    
+    def build(self):
+        from io import StringIO
+        call_command('snapshot_build', stdout=StringIO())
+    
+    def test_build_and_map(self):
+        """Test that the snapshot maps back to read-only columns of every table."""
+        import numpy as np
+        from .snapshot import Snapshot, SnapshotError
+        self.build()
+        mapped = Snapshot(self.path)
+        activities = mapped['activities']
+        self.assertEqual(activities['id'].tolist(), [activity.id for activity in self.activities])
+        self.assertEqual(mapped.activity_types, ['Running', 'Yoga', 'Cycling'])
+        self.assertEqual(activities['activity_type'].tolist(), [0, 1, 0, 2])
+        self.assertTrue(np.isnan(activities['distance'][1]))
+        self.assertFalse(activities['date'].flags.writeable)
+        self.assertEqual(mapped['users']['team_id'].tolist(), [self.team.id, -1])
+        self.assertEqual(mapped['leaderboard']['rank'].tolist(), [1, 2])
+        self.assertEqual(mapped['leaderboard']['user_id'].tolist(), [self.bob.id, self.ann.id])
+        self.assertEqual(mapped.last_activity_id, self.activities[-1].id)
+        with open(self.path, 'r+b') as file:
+            file.write(b'NOTASNAP')
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.path)
+    
+    def test_store_replays_delta_log(self):
+        """Test that the columnar store starts from the snapshot plus the changes made since."""
+        import json
+        import os
+        from .aggregation import team_totals, type_breakdown
+        from .columnar import activity_store
+        from .snapshot import current, log_path
+        self.build()
+        activity_store.refresh()
+        self.assertFalse(activity_store.columns['date'].flags.writeable)
+        
+        first, second = self.activities[:2]
+        first.duration = 35
+        first.save()
+        second.delete()
+        self.bob.team_id = self.team.id
+        self.bob.save()
+        Activity.objects.create(user_id=self.ann.id, activity_type='Boxing', duration=20,
+                                calories=200, date=timezone.now())
+        with open(log_path()) as log:
+            self.assertEqual([json.loads(line)['op'] for line in log], ['update', 'delete', 'team'])
+        self.assertEqual(activity_store.team_totals(), team_totals())
+        self.assertEqual(activity_store.type_breakdown(), type_breakdown())
+        
+        self.build()
+        self.assertEqual(os.path.getsize(log_path()), 0)
+        self.assertEqual(current().last_activity_id, Activity.objects.order_by('-id').first().id)
+    
+    def test_leaderboard_index_from_snapshot(self):
+        """Test that the ranked index loads from a current snapshot without reading the leaderboard."""
+        from .caching import model_version
+        from .ranking import REBUILDS, leaderboard_index
+        self.build()
+        # Counters are created on first read; production has long since made this one.
+        model_version(REBUILDS)
+        leaderboard_index.reset()
+        # Only the shared leaderboard and rebuild versions are read.
+        with self.assertNumQueries(1):
+            self.assertEqual(len(leaderboard_index.top(10)), 2)
+        Activity.objects.create(user_id=self.ann.id, activity_type='Running', duration=200,
+                                calories=2000, date=timezone.now())
+        leaderboard_index.reset()
+        # The version no longer matches, so the leaderboard is read as well.
+        with self.assertNumQueries(2):
+            ids = leaderboard_index.top(10)
+        self.assertEqual(Leaderboard.objects.get(pk=ids[0]).user_id, self.ann.id)
+    
+    def test_leaderboard_index_from_snapshot_in_another_worker(self):
+        """Test that a worker with its own cache still finds the snapshot's leaderboard current."""
+        from .caching import model_version
+        from .ranking import REBUILDS, leaderboard_index
+        self.build()
+        model_version(REBUILDS)
+        leaderboard_index.reset()
+        other_worker = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other-worker'}
+        with override_settings(CACHES={'default': other_worker, 'api': other_worker}):
+            with self.assertNumQueries(1):
+                self.assertEqual(len(leaderboard_index.top(10)), 2)
+
+
+class ImportActivitiesTest(TestCase):
+    """Test case for the import_activities command."""
+    
+    def setUp(self):
+        import os
+        import tempfile
+        from datetime import timedelta
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.checkpoint = os.path.join(self.directory, 'import.checkpoint')
+        self.ann = User.objects.create(name='Ann', email='ann@x.com', password='secret')
+        self.bob = User.objects.create(name='Bob', email='bob@x.com', password='secret')
+        self.days = [(timezone.now() - timedelta(days=days)).replace(microsecond=0) for days in range(1, 6)]
+    
+    def write(self, name, content):
+        import os
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as output:
+            output.write(content)
+        return path
+    
+    def run_import(self, *paths, **options):
+        from io import StringIO
+        output = StringIO()
+        call_command('import_activities', *paths, checkpoint=self.checkpoint, stdout=output, **options)
+        return output.getvalue()
+    
+    def csv_file(self):
+        lines = ['email,activity_type,duration,distance,calories,date']
+        for index, day in enumerate(self.days):
+            lines.append(f'ANN@x.com,Running,{30 + index},5.5,300,{day.isoformat()}')
+            lines.append(f'bob@x.com,Cycling,{60 + index},,500,{day.isoformat()}')
+        lines.append(f'nobody@x.com,Running,30,5,300,{self.days[0].isoformat()}')
+        lines.append(f'ann@x.com,Running,31,5.5,300,{self.days[0].isoformat()}')
+        return self.write('history.csv', '\n'.join(lines) + '\n')
+    
+    def test_csv_in_pieces_dedupes_and_rejects(self):
+        """Test that a CSV split into pieces imports every row once and rejects unknown emails."""
+        import os
+        path = self.csv_file()
+        report = self.run_import(path, format='csv', chunk_mb=0.0002, batch_size=3)
+        self.assertIn('10 inserted, 1 duplicates skipped, 1 rejected', report)
+        self.assertIn('nobody@x.com', report)
+        self.assertEqual(Activity.objects.filter(user_id=self.ann.id).count(), 5)
+        self.assertIsNone(Activity.objects.filter(user_id=self.bob.id).first().distance)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.bob.id).total_duration, sum(range(60, 65)))
+        self.assertFalse(os.path.exists(self.checkpoint))
+        
+        report = self.run_import(path, format='csv')
+        self.assertIn('0 inserted, 11 duplicates skipped', report)
+        self.assertEqual(Activity.objects.count(), 10)
+    
+    def test_resume_skips_finished_pieces(self):
+        """Test that a checkpoint left by an interrupted import skips the pieces it records."""
+        import json
+        from . import importers
+        path = self.csv_file()
+        first = importers.plan_units(path, 'csv', int(0.0002 * 1024 * 1024))[0]
+        with open(self.checkpoint, 'w') as output:
+            json.dump({'paths': [path], 'format': 'csv', 'done': [importers.unit_key(first)],
+                       'inserted': 0, 'duplicates': 0, 'rejected': 0}, output)
+        report = self.run_import(path, format='csv', chunk_mb=0.0002)
+        self.assertIn('Resuming: 1 piece(s)', report)
+        skipped = len(importers.parse_unit(first)[1])
+        self.assertGreater(skipped, 0)
+        # The file's last row repeats its first, which is now skipped, so it is kept.
+        self.assertEqual(Activity.objects.count(), 11 - skipped)
+        
+        with open(self.checkpoint, 'w') as output:
+            json.dump({'paths': ['/elsewhere.csv'], 'format': 'csv', 'done': []}, output)
+        from django.core.management.base import CommandError
+        with self.assertRaises(CommandError):
+            self.run_import(path, format='csv')
+    
+    def test_json_array_and_lines(self):
+        """Test that JSON arrays and newline-delimited JSON both import."""
+        import json
+        rows = [
+            {'email': 'ann@x.com', 'activity_type': 'Yoga', 'duration': 40, 'calories': 150,
+             'date': day.isoformat()}
+            for day in self.days
+        ]
+        array = self.write('history.json', json.dumps(rows, indent=2))
+        lines = self.write('history.ndjson', '\n'.join(json.dumps({**row, 'email': 'bob@x.com'}) for row in rows)
+                           + '\nnot json\n')
+        report = self.run_import(array, lines, format='json', chunk_mb=0.0002)
+        self.assertIn('10 inserted, 0 duplicates skipped, 1 rejected', report)
+        self.assertEqual(Activity.objects.filter(user_id=self.bob.id, activity_type='Yoga').count(), 5)
+    
+    def test_csv_quoted_newlines_in_pieces(self):
+        """Test that quoted fields spanning lines stay in one record when the CSV is split into pieces."""
+        from . import importers
+        # The notes look like a line break followed by a record of their own.
+        notes = '"felt good\nthen ""tired""\n\nbob@x.com,Running"'
+        lines = ['email,notes,activity_type,duration,distance,calories,date']
+        for index, day in enumerate(self.days):
+            lines.append(f'ann@x.com,{notes},Running,{30 + index},5,300,{day.isoformat()}')
+        path = self.write('notes.csv', '\n'.join(lines) + '\n')
+        units = importers.plan_units(path, 'csv', 100)
+        self.assertGreater(len(units), 1)
+        self.assertEqual(sum(len(list(importers.csv_rows(path, start, end))) for path, _, start, end in units), 5)
+        report = self.run_import(path, format='csv', chunk_mb=100 / 1024 / 1024)
+        self.assertIn('5 inserted, 0 duplicates skipped, 0 rejected', report)
+        self.assertEqual(Activity.objects.filter(user_id=self.ann.id).count(), 5)
+    
+    def test_malformed_json_array(self):
+        """Test that a JSON array that stops parsing fails the import with the offset."""
+        from django.core.management.base import CommandError
+        path = self.write('broken.json', '[{"email": "ann@x.com"}, {"email": ]')
+        with self.assertRaisesMessage(CommandError, 'item 1 at character 35'):
+            self.run_import(path, format='json')
+    
+    def test_gpx_tracks(self):
+        """Test that each GPX track becomes one activity with its measured distance."""
+        from datetime import timedelta
+        start = self.days[0]
+        points = ''.join(
+            f'<trkpt lat="{48 + index * 0.01}" lon="2.0"><time>{(start + timedelta(minutes=10 * index)).isoformat()}'
+            f'</time></trkpt>'
+            for index in range(4)
+        )
+        path = self.write('ride.gpx', (
+            '<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+            '<metadata><author><email id="bob" domain="x.com"/></author></metadata>'
+            f'<trk><type>cycling</type><trkseg>{points}</trkseg></trk></gpx>'
+        ))
+        report = self.run_import(path, format='gpx', email='ann@x.com')
+        self.assertIn('1 inserted', report)
+        activity = Activity.objects.get()
+        self.assertEqual((activity.user_id, activity.activity_type, activity.duration), (self.bob.id, 'Cycling', 30))
+        self.assertAlmostEqual(activity.distance, 3.34, places=1)
+        self.assertEqual(activity.date, start)
+    
+    def test_reimport_matches_stored_precision(self):
+        """Test that rows with microseconds still dedupe against dates stored to the millisecond."""
+        from datetime import timedelta
+        day = self.days[0] + timedelta(microseconds=123456)
+        path = self.write('precise.csv', 'email,activity_type,duration,distance,calories,date\n'
+                                         f'ann@x.com,Running,30,5,300,{day.isoformat()}\n')
+        self.assertIn('1 inserted', self.run_import(path, format='csv'))
+        # What MongoDB keeps of the date.
+        Activity.objects.update(date=day.replace(microsecond=123000))
+        self.assertIn('0 inserted, 1 duplicates skipped', self.run_import(path, format='csv'))
+        self.assertEqual(Activity.objects.count(), 1)
+    
+
+class IdempotentActivityAPITest(APITestCase):
+    """Test case for idempotent POST /api/activities/."""
+    
+    def setUp(self):
+        from .idempotency import seen_keys
+        seen_keys.clear()
+        self.addCleanup(seen_keys.clear)
+        self.user = User.objects.create(name='Ann', email='ann@x.com', password='secret', team_id=1)
+        self.payload = {
+            'user_id': self.user.id, 'activity_type': 'Running', 'duration': 30, 'calories': 300,
+            'distance': 5.0, 'date': timezone.now().isoformat(),
+        }
+    
+    def post(self, payload=None, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/activities/', payload or self.payload, format='json', **headers)
+    
+    def test_retry_replays_original_response(self):
+        """Test that a retried key returns the original response without a second insert."""
+        first = self.post(key='retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first)
+        # Only the archive version behind the date check is read.
+        with self.assertNumQueries(1):
+            retry = self.post(key='retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user.id).total_calories, 300)
+        
+        response = self.post({**self.payload, 'duration': 45}, key='retry-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Idempotency-Key', response.data)
+    
+    def test_natural_key_without_header(self):
+        """Test that identical activities posted without a key are stored once."""
+        first = self.post()
+        self.assertEqual(self.post().data['id'], first.data['id'])
+        self.assertNotEqual(self.post({**self.payload, 'duration': 31}).data['id'], first.data['id'])
+        self.assertEqual(self.post(key='another-session').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.count(), 3)
+    
+    def test_replay_from_database_and_unique_index(self):
+        """Test that keys are found in the database once forgotten, and that the index rejects duplicates."""
+        from django.db import IntegrityError, transaction
+        from .idempotency import seen_keys
+        from .indexes import full_scans
+        first = self.post(key='retry-2')
+        seen_keys.clear()
+        retry = self.post(key='retry-2')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        
+        activity = Activity.objects.get()
+        self.assertEqual(full_scans(Activity.objects.filter(idempotency_key=activity.idempotency_key)), [])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Activity.objects.create(user_id=self.user.id, activity_type='Yoga', duration=5, calories=10,
+                                    date=timezone.now(), idempotency_key=activity.idempotency_key)
+        
+        self.client.delete(f'/api/activities/{activity.id}/')
+        self.assertNotEqual(self.post(key='retry-2').data['id'], first.data['id'])
+    
+    def test_concurrent_insert_is_replayed(self):
+        """Test that a key inserted by a racing request between lookup and insert is replayed."""
+        from unittest import mock
+        from . import views
+        first = self.post(key='race')
+        with mock.patch.object(views, 'lookup', side_effect=[None, first.data]):
+            retry = self.post(key='race')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user.id).total_calories, 300)
+    
+
+class ActivityBulkAPITest(APITestCase):
+    """Test case for the bulk activity ingestion endpoint."""
+    
+    url = '/api/activities/bulk/'
+    
+    def setUp(self):
+        User.objects.create(id=1, name='Ann', email='ann@x.com', password='secret')
+        User.objects.create(id=2, name='Bob', email='bob@x.com', password='secret')
+    
+    def row(self, user_id=1, calories=100, **overrides):
+        data = {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': 5.0,
+            'calories': calories,
+            'date': timezone.now().isoformat()
+        }
+        data.update(overrides)
+        return data
+    
+    def test_bulk_json_array(self):
+        """Test inserting a JSON array with one leaderboard delta per user."""
+        rows = [self.row(1, 100), self.row(1, 200), self.row(2, 50)]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 300)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).rank, 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=2).rank, 2)
+    
+    def test_bulk_ndjson(self):
+        """Test inserting an NDJSON stream."""
+        import json
+        body = '\n'.join(json.dumps(row) for row in [self.row(1), self.row(2)]) + '\n\n'
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.count(), 2)
+    
+    def test_bulk_partial_errors(self):
+        """Test that invalid rows are reported without failing the batch."""
+        rows = [self.row(1), self.row(1, calories='lots'), 'not a row', self.row(2)]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('calories', response.data['errors'][0]['errors'])
+    
+    def test_bulk_column_validation(self):
+        """Test that rows are validated a column at a time, with unknown authors found in one query."""
+        from .ingest import validate_activities
+        from .partitions import hot_start
+        rows = [self.row(1), self.row(2, duration='45'), self.row(3), self.row(1, duration=-1.5)] * 50
+        hot_start()
+        # The archived months' version, then the authors.
+        with self.assertNumQueries(2):
+            activities, errors = validate_activities(rows)
+        self.assertEqual(len(activities), 100)
+        self.assertEqual({activity.duration for activity in activities}, {30, 45})
+        self.assertEqual([error['index'] for error in errors[:2]], [2, 3])
+        self.assertEqual(errors[0]['errors'], {'user_id': ['Invalid pk "3" - object does not exist.']})
+        self.assertIn('duration', errors[1]['errors'])
+    
+    def test_bulk_ndjson_malformed_line(self):
+        """Test that a line that is not JSON is reported as that row's error."""
+        import json
+        body = '\n'.join([json.dumps(self.row(1)), '{"user_id": 1,', '', json.dumps(self.row(2))])
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertIn('line 2', response.data['errors'][0]['errors']['non_field_errors'][0])
+    
+    def test_bulk_all_invalid(self):
+        """Test that a batch with no valid rows is rejected."""
+        response = self.client.post(self.url, [{'user_id': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Activity.objects.count(), 0)
+    
+    def test_bulk_rejects_non_list(self):
+        """Test that a single object is not accepted as a batch."""
+        response = self.client.post(self.url, self.row(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class JobQueueTest(APITestCase):
+    """Test case for the background job queue and its API."""
+    
+    def test_enqueue_dedups_pending_jobs(self):
+        """Test that an identical pending job is reused instead of queued twice."""
+        from .jobs import enqueue
+        from .models import Job
+        first, created = enqueue('rebuild_rollups')
+        self.assertTrue(created)
+        second, created = enqueue('rebuild_rollups')
+        self.assertFalse(created)
+        self.assertEqual(first.pk, second.pk)
+        Job.objects.filter(pk=first.pk).update(status=Job.DONE)
+        third, created = enqueue('rebuild_rollups')
+        self.assertTrue(created)
+        with self.assertRaises(TypeError):
+            enqueue('rebuild_rollups', unexpected=1)
+    
+    def test_run_next_records_result(self):
+        """Test that a worker runs the oldest job and records its result."""
+        from .jobs import enqueue, run_next
+        from .models import Job
+        Activity.objects.create(user_id=1, activity_type='Running', duration=30, calories=300,
+                                date=timezone.now())
+        Leaderboard.objects.all().delete()
+        job, _ = enqueue('rebuild_leaderboard')
+        self.assertEqual(run_next('test-worker').pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.worker, 'test-worker')
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 300)
+        self.assertIsNone(run_next('test-worker'))
+    
+    def test_failed_job_and_stale_requeue(self):
+        """Test that handler errors are recorded and abandoned jobs are requeued."""
+        from datetime import timedelta
+        from .jobs import enqueue, requeue_stale, run_next
+        from .models import Job
+        job, _ = enqueue('import_activities', rows=None)
+        run_next('test-worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('TypeError', job.message)
+        
+        stale, _ = enqueue('rebuild_rollups')
+        Job.objects.filter(pk=stale.pk).update(
+            status=Job.RUNNING, heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(requeue_stale(max_age=60), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, Job.PENDING)
+    
+    def test_pending_key_is_unique(self):
+        """Test that the database, not a process-local lock, keeps one pending job per key."""
+        from django.db import IntegrityError, transaction
+        from .jobs import enqueue
+        from .models import Job
+        first, _ = enqueue('rebuild_rollups')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(kind='rebuild_rollups', dedup_key=first.dedup_key)
+        Job.objects.filter(pk=first.pk).update(status=Job.RUNNING)
+        second, created = enqueue('rebuild_rollups')
+        self.assertTrue(created)
+        self.assertEqual(second.dedup_key, first.dedup_key)
+    
+    def test_stale_requeue_gives_up(self):
+        """Test that stale jobs are failed after JOB_MAX_ATTEMPTS runs, or when an identical job is pending."""
+        from datetime import timedelta
+        from .jobs import enqueue, requeue_stale
+        from .models import Job
+        hour_ago = timezone.now() - timedelta(hours=1)
+        worn, _ = enqueue('rebuild_rollups')
+        Job.objects.filter(pk=worn.pk).update(status=Job.RUNNING, heartbeat_at=hour_ago, attempts=3)
+        twin, _ = enqueue('rebuild_leaderboard')
+        Job.objects.filter(pk=twin.pk).update(status=Job.RUNNING, heartbeat_at=hour_ago, attempts=1)
+        pending, _ = enqueue('rebuild_leaderboard')
+        with override_settings(JOB_MAX_ATTEMPTS=3):
+            self.assertEqual(requeue_stale(max_age=60), 0)
+        self.assertEqual(
+            dict(Job.objects.values_list('id', 'status')),
+            {worn.pk: Job.FAILED, twin.pk: Job.FAILED, pending.pk: Job.PENDING},
+        )
+    
+    def test_requeued_run_keeps_its_result(self):
+        """Test that a worker whose job was requeued and claimed again does not overwrite the new run."""
+        from datetime import timedelta
+        from unittest import mock
+        from .jobs import HANDLERS, claim, enqueue, requeue_stale, run_next
+        from .models import Job
+        job, _ = enqueue('rebuild_rollups')
+        
+        def stalls(job):
+            Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            requeue_stale(max_age=60)
+            claim('second-worker')
+            return {'from': 'first-worker'}
+        
+        with mock.patch.dict(HANDLERS, {'rebuild_rollups': stalls}):
+            run_next('first-worker')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.result), (Job.RUNNING, 'second-worker', ''))
+    
+    def test_rebuild_reaches_other_workers(self):
+        """Test that a leaderboard rebuild in the job worker makes every process reload its ranked index."""
+        from .caching import bump_version
+        from .models import delete_all
+        from .ranking import REBUILDS, leaderboard_index
+        Activity.objects.create(user_id=1, activity_type='Running', duration=30, calories=300,
+                                date=timezone.now())
+        leaderboard_index.reset()
+        self.assertEqual(len(leaderboard_index.top(10)), 1)
+        # What a rebuild in another process leaves behind: new rows, no signals here.
+        delete_all(Leaderboard)
+        Leaderboard.objects.bulk_create([Leaderboard(user_id=1, team_id=0, total_calories=300, rank=1)])
+        bump_version(REBUILDS)
+        with override_settings(LEADERBOARD_INDEX_POLL_SECONDS=0):
+            self.assertEqual(leaderboard_index.top(10), [Leaderboard.objects.get(user_id=1).pk])
+    
+    def test_post_job(self):
+        """Test that POST /api/jobs/ queues a job and responds 202."""
+        response = self.client.post('/api/jobs/', {'kind': 'rebuild_leaderboard'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response['Location'], response.data['url'])
+        again = self.client.post('/api/jobs/', {'kind': 'rebuild_leaderboard'}, format='json')
+        self.assertEqual(again.data['id'], response.data['id'])
+        
+        response = self.client.post('/api/jobs/', {'kind': 'drop_everything'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('kind', response.data)
+    
+    def test_background_bulk_import(self):
+        """Test that a background bulk import returns at once and inserts when run."""
+        from .jobs import run_next
+        User.objects.create(id=1, name='Ann', email='ann@x.com', password='secret')
+        row = {'user_id': 1, 'activity_type': 'Running', 'duration': 30, 'calories': 100,
+               'date': timezone.now().isoformat()}
+        response = self.client.post('/api/activities/bulk/?background=1&chunk_size=1',
+                                    [row, row, {'user_id': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Activity.objects.count(), 0)
+        run_next('test-worker')
+        
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['progress'], 1.0)
+        self.assertEqual(job['result']['created'], 2)
+        self.assertEqual([error['index'] for error in job['result']['errors']], [2])
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 200)
+    
+    def test_background_ndjson_malformed_line(self):
+        """Test that a background NDJSON import reports a line that is not JSON at its index."""
+        import json
+        from .jobs import run_next
+        User.objects.create(id=1, name='Ann', email='ann@x.com', password='secret')
+        row = json.dumps({'user_id': 1, 'activity_type': 'Running', 'duration': 30, 'calories': 100,
+                          'date': timezone.now().isoformat()})
+        response = self.client.post('/api/activities/bulk/?background=1', '\n'.join([row, 'nope', row]),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        run_next('test-worker')
+        result = self.client.get(response['Location']).data['result']
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['errors'], [{'index': 1, 'errors': {
+            'non_field_errors': [result['errors'][0]['errors']['non_field_errors'][0]],
+        }}])
+        self.assertIn('line 2', result['errors'][0]['errors']['non_field_errors'][0])
+    
+    def test_post_job_limits_import_rows(self):
+        """Test that an import posted to /api/jobs/ is held to the bulk row limit."""
+        from django.test import override_settings
+        from .models import Job
+        row = {'user_id': 1, 'activity_type': 'Running', 'duration': 30, 'calories': 100,
+               'date': timezone.now().isoformat()}
+        with override_settings(ACTIVITY_BULK_MAX_ROWS=2):
+            response = self.client.post('/api/jobs/', {'kind': 'import_activities', 'payload': {'rows': [row] * 3}},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('payload', response.data)
+        self.assertFalse(Job.objects.exists())
+    
+    def test_requeued_import_resumes(self):
+        """Test that a requeued import skips the chunks an earlier run finished."""
+        import json
+        from .jobs import enqueue, run_next
+        from .models import Job
+        User.objects.create(id=1, name='Ann', email='ann@x.com', password='secret')
+        rows = [{'user_id': 1, 'activity_type': 'Running', 'duration': 30, 'calories': calories,
+                 'date': timezone.now().isoformat()} for calories in (100, 200, 300)]
+        job, _ = enqueue('import_activities', rows=rows, chunk_size=1)
+        Job.objects.filter(pk=job.pk).update(
+            attempts=1, result=json.dumps({'done': 2, 'created': 2, 'errors': []})
+        )
+        run_next('test-worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(json.loads(job.result), {'created': 3, 'errors': []})
+        self.assertEqual(list(Activity.objects.values_list('calories', flat=True)), [300])
+
+
+class JobHeartbeatTest(TransactionTestCase):
+    """Test case for the heartbeat a worker sends while a job runs; the heartbeat thread needs committed rows."""
+    
+    def test_heartbeat_while_handler_runs(self):
+        """Test that a running handler keeps its job's heartbeat fresh."""
+        import time
+        from datetime import timedelta
+        from .jobs import enqueue, heartbeat, requeue_stale
+        from .models import Job
+        job, _ = enqueue('rebuild_leaderboard')
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        with heartbeat(job, interval=0.01):
+            time.sleep(0.2)
+        self.assertEqual(requeue_stale(max_age=60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+
+
+class ActivityArchiveTest(APITestCase):
+    """Test case for monthly partitions and the archival of old activities."""
+    
+    def setUp(self):
+        import tempfile
+        from django.core.cache import caches
+        from django.test import override_settings
+        caches['api'].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(ACTIVITY_ARCHIVE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+        
+        from datetime import timedelta
+        team = Team.objects.create(name='Archivists')
+        self.user = User.objects.create(name='Old Timer', email='old@timer.com', password='pw', team_id=team.id)
+        self.old = timezone.now() - timedelta(days=500)
+        for calories in (100, 200):
+            Activity.objects.create(user_id=self.user.id, activity_type='Running', duration=30,
+                                    calories=calories, date=self.old)
+        Activity.objects.create(user_id=self.user.id, activity_type='Cycling', duration=60,
+                                calories=400, date=timezone.now())
+    
+    def archive(self):
+        from io import StringIO
+        call_command('archive_activities', '--older-than', '365d', stdout=StringIO())
+    
+    def test_archive_moves_old_months(self):
+        """Test that old months leave the collection but keep their rollups and leaderboard totals."""
+        import gzip
+        import os
+        from .models import ActivityArchive
+        from .partitions import hot_since
+        self.archive()
+        self.assertEqual(Activity.objects.count(), 1)
+        archive = ActivityArchive.objects.get()
+        self.assertEqual(archive.row_count, 2)
+        self.assertEqual(archive.month, timezone.localdate(self.old).replace(day=1))
+        with gzip.open(os.path.join(self.directory, archive.path), 'rt') as archived:
+            self.assertEqual(len(archived.readlines()), 2)
+        self.assertGreater(hot_since(), archive.month)
+        
+        old_day = timezone.localdate(self.old)
+        self.assertEqual(UserDailyStats.objects.get(user_id=self.user.id, day=old_day).calories_sum, 300)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user.id).total_calories, 700)
+        rebuild_rollups()
+        rebuild_leaderboard()
+        self.assertEqual(UserDailyStats.objects.get(user_id=self.user.id, day=old_day).calories_sum, 300)
+        self.assertEqual(Leaderboard.objects.get(user_id=self.user.id).total_calories, 700)
+    
+    def test_archive_deletes_without_row_signals(self):
+        """Test that archiving removes the month's rows without a delete signal per row."""
+        from unittest import mock
+        from django.db.models.signals import post_delete, pre_delete
+        receiver = mock.Mock()
+        for signal in (pre_delete, post_delete):
+            signal.connect(receiver, sender=Activity)
+            self.addCleanup(signal.disconnect, receiver, sender=Activity)
+        self.archive()
+        receiver.assert_not_called()
+        self.assertEqual(Activity.objects.count(), 1)
+    
+    def test_router_and_export(self):
+        """Test that reads only touch the partitions in range and the export includes archives."""
+        import json
+        from datetime import timedelta
+        from .partitions import archived_months
+        self.archive()
+        archived_months()
+        until = (self.old + timedelta(days=1)).isoformat()
+        # Only the archive version is read, never the collection.
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/activities/', {'until': until})
+        self.assertEqual(response.data['results'], [])
+        
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['calories'] for row in rows], [100, 200, 400])
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson', 'until': until})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+    
+    def test_archived_months_are_read_only(self):
+        """Test that new activities cannot be dated inside an archived month."""
+        self.archive()
+        response = self.client.post('/api/activities/', {
+            'user_id': self.user.id, 'activity_type': 'Running', 'duration': 10,
+            'calories': 50, 'date': self.old.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date', response.data)
+
+
+class ActivityExportAPITest(APITestCase):
+    """Test case for the streaming activity export."""
+    
+    def setUp(self):
+        from datetime import timedelta
+        now = timezone.now()
+        for days_ago, distance in [(10, 5.0), (2, None), (1, 3.5)]:
+            Activity.objects.create(
+                user_id=1,
+                activity_type='Running',
+                duration=30,
+                distance=distance,
+                calories=300,
+                date=now - timedelta(days=days_ago)
+            )
+        self.since = (now - timedelta(days=5)).date().isoformat()
+    
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+    
+    def test_export_ndjson_matches_serializer(self):
+        """Test that NDJSON rows match the regular serializer output."""
+        import json
+        from .serializers import ActivitySerializer
+        body = self.read(self.client.get('/api/activities/export/?format=ndjson'))
+        rows = [json.loads(line) for line in body.splitlines()]
+        expected = ActivitySerializer(Activity.objects.order_by('date', 'id'), many=True).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+    
+    def test_export_csv_since(self):
+        """Test CSV output with a since filter."""
+        import csv
+        body = self.read(self.client.get(f'/api/activities/export/?format=csv&since={self.since}'))
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['distance'], '')
+        self.assertEqual(rows[1]['distance'], '3.5')
+    
+    def test_export_invalid_since(self):
+        """Test that a malformed since is rejected."""
+        response = self.client.get('/api/activities/export/?format=ndjson&since=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class LeaderboardAPITest(APITestCase):
@@ -190,6 +2323,183 @@ class WorkoutAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class ResponseCacheAPITest(APITestCase):
+    """Test case for the versioned response cache and ETags."""
+    
+    def setUp(self):
+        from django.core.cache import caches
+        caches['api'].clear()
+        self.team = Team.objects.create(name='Cached Team', description='First')
+    
+    def test_cached_list_skips_database(self):
+        """Test that a repeated list is served from the cache after one version read."""
+        first = self.client.get('/api/teams/')
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/teams/')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_write_invalidates(self):
+        """Test that a save bumps the version and changes the response."""
+        first = self.client.get(f'/api/teams/{self.team.id}/')
+        self.team.description = 'Second'
+        self.team.save()
+        second = self.client.get(f'/api/teams/{self.team.id}/')
+        self.assertEqual(second.data['description'], 'Second')
+        self.assertNotEqual(first['ETag'], second['ETag'])
+    
+    def test_write_in_another_worker_invalidates(self):
+        """Test that a write made by a process with its own cache invalidates this one's responses."""
+        etag = self.client.get(f'/api/teams/{self.team.id}/')['ETag']
+        other_worker = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other-worker'}
+        with override_settings(CACHES={'default': other_worker, 'api': other_worker}):
+            self.team.description = 'Elsewhere'
+            self.team.save()
+        response = self.client.get(f'/api/teams/{self.team.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['description'], 'Elsewhere')
+    
+    def test_if_none_match(self):
+        """Test that a matching If-None-Match returns 304 until the data changes."""
+        etag = self.client.get('/api/workouts/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Workout.objects.create(
+            name='New', description='New', activity_type='Yoga',
+            difficulty='Easy', duration=20, calories_per_session=100
+        )
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+    
+    def test_leaderboard_follows_activity_writes(self):
+        """Test that activity writes invalidate cached leaderboard slices."""
+        Activity.objects.create(
+            user_id=1, activity_type='Running', duration=30, calories=100, date=timezone.now()
+        )
+        leaderboard_index.reset()
+        first = self.client.get('/api/leaderboard/?top=5')
+        Activity.objects.create(
+            user_id=2, activity_type='Running', duration=30, calories=500, date=timezone.now()
+        )
+        second = self.client.get('/api/leaderboard/?top=5')
+        self.assertEqual(len(first.data), 1)
+        self.assertEqual([row['user_id'] for row in second.data], [2, 1])
+
+
+class FastReadAPITest(APITestCase):
+    """Test case for the values()-based fast read path."""
+    
+    def setUp(self):
+        from datetime import timedelta
+        team = Team.objects.create(name='Fast Team', description='Ünïcode "quoted"')
+        user = User.objects.create(name='Fast Hero', email='fast@hero.com', password='secret', team_id=team.id)
+        User.objects.create(name='No Team', email='none@hero.com', password='secret')
+        for i, distance in enumerate([5.25, None, 3.0]):
+            Activity.objects.create(
+                user_id=user.id,
+                activity_type='Running',
+                duration=30 + i,
+                distance=distance,
+                calories=300,
+                date=timezone.now() - timedelta(days=i, microseconds=i)
+            )
+        Workout.objects.create(
+            name='Fast Workout', description='Quick', activity_type='Running',
+            difficulty='Easy', duration=20, calories_per_session=150
+        )
+        self.ids = {
+            'users': user.id,
+            'teams': team.id,
+            'activities': Activity.objects.first().id,
+            'leaderboard': Leaderboard.objects.get().id,
+            'workouts': Workout.objects.get().id,
+        }
+    
+    def fetch(self, url, fast):
+        from django.core.cache import caches
+        from django.test import override_settings
+        caches['api'].clear()
+        with override_settings(API_FAST_READS=fast):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+    
+    def test_byte_identical_output(self):
+        """Test that every list and retrieve renders the same bytes on both paths."""
+        for endpoint, pk in self.ids.items():
+            for url in (f'/api/{endpoint}/', f'/api/{endpoint}/?page_size=1', f'/api/{endpoint}/{pk}/'):
+                with self.subTest(url=url):
+                    self.assertEqual(self.fetch(url, False), self.fetch(url, True))
+    
+    def test_password_not_exposed(self):
+        """Test that write-only fields stay out of the fast path."""
+        self.assertNotIn(b'secret', self.fetch('/api/users/', True))
+    
+    def test_missing_object(self):
+        """Test that the fast retrieve path returns 404 for unknown ids."""
+        from django.test import override_settings
+        with override_settings(API_FAST_READS=True):
+            response = self.client.get('/api/activities/999999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class KeysetPaginationAPITest(APITestCase):
+    """Test case for keyset pagination on list endpoints."""
+    
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return pages
+    
+    def test_activities_newest_first_with_ties(self):
+        """Test that pages follow (date, id) descending without gaps when dates tie."""
+        now = timezone.now()
+        ids = []
+        for i in range(7):
+            ids.append(Activity.objects.create(
+                user_id=1,
+                activity_type='Running',
+                duration=30,
+                calories=100,
+                date=now if i < 4 else now.replace(microsecond=now.microsecond // 2)
+            ).id)
+        pages = self.walk('/api/activities/?page_size=3')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        expected = sorted(ids[:4], reverse=True) + sorted(ids[4:], reverse=True)
+        self.assertEqual(sum(pages, []), expected)
+    
+    def test_leaderboard_by_rank(self):
+        """Test that the leaderboard is paged in rank order."""
+        for rank in (3, 1, 2):
+            Leaderboard.objects.create(user_id=rank, team_id=1, total_calories=100, rank=rank)
+        pages = self.walk('/api/leaderboard/?page_size=2')
+        ranks = [
+            Leaderboard.objects.get(pk=pk).rank for pk in sum(pages, [])
+        ]
+        self.assertEqual(ranks, [1, 2, 3])
+    
+    def test_page_size_is_capped(self):
+        """Test that page_size cannot exceed API_MAX_PAGE_SIZE."""
+        from django.test import override_settings
+        for i in range(3):
+            Team.objects.create(name=f'Team {i}')
+        with override_settings(API_MAX_PAGE_SIZE=2):
+            response = self.client.get('/api/teams/?page_size=50')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+    
+    def test_invalid_cursor(self):
+        """Test that a tampered cursor returns 404."""
+        response = self.client.get('/api/workouts/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class APIRootTest(APITestCase):
     """Test case for API root endpoint."""
     
@@ -203,3 +2513,4 @@ class APIRootTest(APITestCase):
         self.assertIn('activities', response.data)
         self.assertIn('leaderboard', response.data)
         self.assertIn('workouts', response.data)
+        self.assertIn('stats', response.data)
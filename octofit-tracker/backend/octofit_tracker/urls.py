@@ -16,7 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from octofit_tracker import views
+from octofit_tracker import async_views, views
 import os
 
 # Configure base URL for GitHub Codespaces
@@ -37,9 +37,22 @@ router.register(r'teams', views.TeamViewSet, basename='team')
 router.register(r'activities', views.ActivityViewSet, basename='activity')
 router.register(r'leaderboard', views.LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', views.WorkoutViewSet, basename='workout')
+router.register(r'jobs', views.JobViewSet, basename='job')
 
 urlpatterns = [
     path('', views.api_root, name='api-root'),
+    path('api/stats/', views.stats, name='stats'),
+    path('api/pool/', views.pool_status, name='pool-status'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('api/stats/teams/', views.team_stats, name='team-stats'),
+    path('api/stats/types/', views.activity_type_stats, name='activity-type-stats'),
+    # Same responses as the router's read endpoints, served as coroutines for the ASGI app
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/activities/<int:pk>/', async_views.activity_detail, name='async-activity-detail'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/leaderboard/<int:pk>/', async_views.leaderboard_detail, name='async-leaderboard-detail'),
+    path('api/async/teams/', async_views.team_list, name='async-team-list'),
+    path('api/async/teams/<int:pk>/', async_views.team_detail, name='async-team-detail'),
     path('api/', include(router.urls)),
     path('admin/', admin.site.urls),
 ]
@@ -1,15 +1,95 @@
-from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+import csv
+from datetime import datetime, time, timedelta
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from .aggregation import team_totals, type_breakdown
+from .archive import archived_rows
+from .caching import CachedResponseMixin
+from .columnar import activity_store
+from .encoders import FastReadMixin, RowEncoder
+from .ingest import ingest_activities
+from .idempotency import REPLAYED_HEADER, is_duplicate, lookup, natural_key, request_key, seen_keys
+from .instrumentation import expose
+from .jobs import HANDLERS, enqueue
+from .models import User, Team, Activity, Leaderboard, Workout, Job
+from .mongo import ListReadsMixin, metrics
+from .parsers import MalformedLine, NDJSONParser
+from .partitions import touches_hot
+from .ranking import leaderboard_index
+from .renderers import CSVRenderer, EchoBuffer, NDJSONRenderer, ndjson_line
+from .rollups import PERIODS, query_stats
 from .serializers import (
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
-    WorkoutSerializer
+    WorkoutSerializer,
+    JobSerializer
 )
+from .windows import METRICS, SCOPES, window_rankings
+
+
+def query_int(request, name, default=None, minimum=None, maximum=None):
+    """
+    Read an integer query parameter, raising a 400 for malformed values.
+    
+    Values above ``maximum`` are clamped rather than rejected.
+    """
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+    if minimum is not None and value < minimum:
+        raise ValidationError({name: f'Ensure this value is greater than or equal to {minimum}.'})
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def query_datetime(request, name):
+    """
+    Read an ISO 8601 date or datetime query parameter, raising a 400 for malformed values.
+    
+    Dates are taken as midnight and naive values as the current timezone.
+    """
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = None if day is None else datetime.combine(day, time.min)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Expected an ISO 8601 date or datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def join_chunks(lines, size):
+    """Group streamed lines so each response chunk carries ``size`` of them."""
+    while True:
+        chunk = ''.join(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 @api_view(['GET'])
@@ -23,15 +103,121 @@ def api_root(request, format=None):
         'activities': request.build_absolute_uri('/api/activities/'),
         'leaderboard': request.build_absolute_uri('/api/leaderboard/'),
         'workouts': request.build_absolute_uri('/api/workouts/'),
+        'stats': request.build_absolute_uri('/api/stats/'),
+        'jobs': request.build_absolute_uri('/api/jobs/'),
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def stats(request, format=None):
+    """
+    Activity statistics for a user or team, bucketed by day, week or month.
+    
+    Supports:
+    - GET /api/stats/?scope=user|team&id=N&period=day|week|month&start=YYYY-MM-DD&end=YYYY-MM-DD
+    
+    ``start`` defaults to 29 days before ``end``, which defaults to today.
+    Answered from the daily rollups, so the cost grows with the number of
+    days in range rather than the number of activities.
+    """
+    scope = request.query_params.get('scope', 'user')
+    if scope not in ('user', 'team'):
+        raise ValidationError({'scope': 'Expected "user" or "team".'})
+    period = request.query_params.get('period', 'day')
+    if period not in PERIODS:
+        raise ValidationError({'period': f'Expected one of {", ".join(PERIODS)}.'})
+    owner_id = query_int(request, 'id')
+    if owner_id is None:
+        raise ValidationError({'id': 'This parameter is required.'})
+    
+    end = query_datetime(request, 'end')
+    end = timezone.localdate() if end is None else timezone.localdate(end)
+    start = query_datetime(request, 'start')
+    start = end - timedelta(days=29) if start is None else timezone.localdate(start)
+    if start > end:
+        raise ValidationError({'start': 'Must not be after end.'})
+    
+    return Response({
+        'scope': scope,
+        'id': owner_id,
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'buckets': query_stats(scope, owner_id, start, end, period),
+    })
+
+
+@api_view(['GET'])
+def pool_status(request, format=None):
+    """
+    MongoDB connection pool counters for the worker process that answers.
+    
+    Supports:
+    - GET /api/pool/
+    
+    ``checked_out`` and ``waiting`` are current values, the ``peak_``
+    fields their highs since the process started, and ``created`` and
+    ``closed`` count connections opened and dropped. A ``created`` that
+    keeps growing under steady load means connections are churning.
+    """
+    return Response({**metrics.snapshot(), 'options': {
+        key: value for key, value in settings.MONGO_CLIENT.items() if key not in ('host', 'port')
+    }})
+
+
+def prometheus_metrics(request):
+    """
+    Request histograms and MongoDB pool counters in the Prometheus text format.
+    
+    Supports:
+    - GET /metrics
+    
+    The numbers belong to the worker process that answers.
+    """
+    return HttpResponse(expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def team_stats(request, format=None):
+    """
+    Activity totals per team, highest total calories first.
+    
+    Supports:
+    - GET /api/stats/teams/?start=...&end=...
+    
+    ``start`` is inclusive and ``end`` exclusive; both are optional.
+    Answered from the columnar store (columnar.py) with ``ANALYTICS_COLUMNAR``.
+    """
+    totals = activity_store.team_totals if settings.ANALYTICS_COLUMNAR else team_totals
+    return Response(totals(query_datetime(request, 'start'), query_datetime(request, 'end')))
+
+
+@api_view(['GET'])
+def activity_type_stats(request, format=None):
+    """
+    Activity totals per activity type, highest total calories first.
+    
+    Supports:
+    - GET /api/stats/types/?user_id=N|team_id=N&start=...&end=...
+    
+    ``start`` is inclusive and ``end`` exclusive; all parameters are optional.
+    Answered from the columnar store (columnar.py) with ``ANALYTICS_COLUMNAR``.
+    """
+    breakdown = activity_store.type_breakdown if settings.ANALYTICS_COLUMNAR else type_breakdown
+    return Response(breakdown(
+        user_id=query_int(request, 'user_id'),
+        team_id=query_int(request, 'team_id'),
+        start=query_datetime(request, 'start'),
+        end=query_datetime(request, 'end'),
+    ))
+
+
+class UserViewSet(FastReadMixin, ListReadsMixin, viewsets.ModelViewSet):
     """
     API endpoint for users.
     
     Supports:
-    - GET /api/users/ - List all users
+    - GET /api/users/ - List users, oldest first, one keyset page at a time
     - POST /api/users/ - Create a new user
     - GET /api/users/{id}/ - Retrieve a specific user
     - PUT /api/users/{id}/ - Update a specific user
@@ -39,63 +225,330 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    keyset_ordering = ('created_at', 'id')
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for teams.
     
     Supports:
-    - GET /api/teams/ - List all teams
+    - GET /api/teams/ - List teams, oldest first, one keyset page at a time
     - POST /api/teams/ - Create a new team
     - GET /api/teams/{id}/ - Retrieve a specific team
     - PUT /api/teams/{id}/ - Update a specific team
     - DELETE /api/teams/{id}/ - Delete a specific team
+    
+    Reads are served from the versioned response cache.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    keyset_ordering = ('created_at', 'id')
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(FastReadMixin, ListReadsMixin, viewsets.ModelViewSet):
     """
     API endpoint for activities.
     
     Supports:
-    - GET /api/activities/ - List all activities
-    - POST /api/activities/ - Create a new activity
+    - GET /api/activities/ - List activities, newest first, one keyset page at a time
+    - GET /api/activities/?user_id=&team_id=&activity_type=&since=&until=&ordering=date|-date - Filtered list
+    - POST /api/activities/ - Create a new activity; retries are answered with the original response
     - GET /api/activities/{id}/ - Retrieve a specific activity
     - PUT /api/activities/{id}/ - Update a specific activity
     - DELETE /api/activities/{id}/ - Delete a specific activity
+    - POST /api/activities/bulk/ - Create many activities from a JSON array or NDJSON
+    - POST /api/activities/bulk/?background=1 - Queue the same import as a background job
+    - GET /api/activities/export/?format=ndjson|csv&since=...&until=... - Stream activities
+    
+    Writes update the author's leaderboard entry incrementally. A create
+    is keyed by its ``Idempotency-Key`` header, or else by its natural
+    key, so a retried POST inserts nothing (see idempotency.py). Filters
+    combine freely; each one leads an index (see ``Activity.Meta.indexes``),
+    and ``team_id`` matches the team denormalized onto the activity.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    keyset_ordering = ('-date', '-id')
+    orderings = {'-date': ('-date', '-id'), 'date': ('date', 'id')}
+    
+    def get_keyset_ordering(self):
+        ordering = self.request.query_params.get('ordering', '-date')
+        if ordering not in self.orderings:
+            raise ValidationError({'ordering': f'Expected one of {", ".join(self.orderings)}.'})
+        return self.orderings[ordering]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        for field in ('user_id', 'team_id'):
+            value = query_int(self.request, field)
+            if value is not None:
+                queryset = queryset.filter(**{field: value})
+        activity_type = self.request.query_params.get('activity_type')
+        if activity_type:
+            queryset = queryset.filter(activity_type=activity_type)
+        since = query_datetime(self.request, 'since')
+        until = query_datetime(self.request, 'until')
+        if not touches_hot(since, until):
+            # Archived months are only available through the export.
+            return queryset.none()
+        if since is not None:
+            queryset = queryset.filter(date__gte=since)
+        if until is not None:
+            queryset = queryset.filter(date__lt=until)
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key = request_key(request, serializer.validated_data)
+        fingerprint = natural_key(serializer.validated_data)
+        data = lookup(key, fingerprint)
+        if data is None:
+            try:
+                with transaction.atomic():
+                    serializer.save(idempotency_key=key)
+                    # Remember the response only once the insert is durable.
+                    transaction.on_commit(lambda: seen_keys.add(key, fingerprint, serializer.data))
+            except DatabaseError as exc:
+                # A concurrent retry inserted the same key first.
+                data = lookup(key, fingerprint) if is_duplicate(exc) else None
+                if data is None:
+                    raise
+            else:
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_201_CREATED, headers={REPLAYED_HEADER: 'true'})
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Insert a batch of activities.
+        
+        Invalid rows are reported by index and skipped; the valid ones are
+        still inserted. Responds 400 only when no row could be inserted.
+        With ``?background=1`` the rows are queued as an ``import_activities``
+        job instead and the response is 202 with the job to poll.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        max_rows = settings.ACTIVITY_BULK_MAX_ROWS
+        if len(rows) > max_rows:
+            raise ValidationError({'non_field_errors': [f'At most {max_rows} activities per request.']})
+        
+        chunk_size = query_int(
+            request, 'chunk_size', default=settings.ACTIVITY_BULK_CHUNK_SIZE, minimum=1, maximum=max_rows
+        )
+        if request.query_params.get('background') in ('1', 'true'):
+            # Jobs store their payload as JSON; lines that did not parse travel as their errors.
+            malformed = [
+                {'index': index, 'errors': row.errors} for index, row in enumerate(rows) if isinstance(row, MalformedLine)
+            ]
+            payload = {'rows': [None if isinstance(row, MalformedLine) else row for row in rows], 'chunk_size': chunk_size}
+            if malformed:
+                payload['errors'] = malformed
+            job, _ = enqueue('import_activities', **payload)
+            return job_accepted(request, job)
+        created, errors = ingest_activities(rows, chunk_size=chunk_size)
+        response_status = status.HTTP_201_CREATED if created or not errors else status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': len(created),
+            'ids': [activity.pk for activity in created if activity.pk is not None],
+            'errors': errors,
+        }, status=response_status)
+    
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Stream activities as NDJSON or CSV, oldest first.
+        
+        ``?format=ndjson|csv`` picks the encoding and ``since``/``until`` bound
+        the activity date. Rows come from a server-side cursor and are
+        encoded without DRF serializers, so memory stays flat regardless of
+        the number of rows exported. Archived months in range are streamed
+        from their archive files first.
+        """
+        queryset = Activity.objects.order_by('date', 'id')
+        since = query_datetime(request, 'since')
+        until = query_datetime(request, 'until')
+        if since is not None:
+            queryset = queryset.filter(date__gte=since)
+        if until is not None:
+            queryset = queryset.filter(date__lt=until)
+        
+        chunk_size = settings.ACTIVITY_EXPORT_CHUNK_SIZE
+        encoder = RowEncoder.for_serializer(ActivitySerializer)
+        rows = chain(
+            archived_rows(since, until),
+            encoder.iter_rows(queryset, chunk_size=chunk_size) if touches_hot(since, until) else (),
+        )
+        if request.accepted_renderer.format == 'csv':
+            writer = csv.writer(EchoBuffer())
+            lines = chain(
+                [writer.writerow(encoder.fields)],
+                (writer.writerow(row.values()) for row in rows),
+            )
+        else:
+            lines = (ndjson_line(row) for row in rows)
+        chunks = join_chunks(lines, chunk_size)
+        
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            (chunk.encode(renderer.charset) for chunk in chunks),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for leaderboard.
     
     Supports:
-    - GET /api/leaderboard/ - List all leaderboard entries
+    - GET /api/leaderboard/ - List leaderboard entries by rank, one keyset page at a time
+    - GET /api/leaderboard/?top=N[&team_id=T] - Best N entries, overall or within a team
+    - GET /api/leaderboard/?metric=distance&window=7d[&scope=team][&top=N] - Best N users
+      (or teams) by calories, duration or distance over a sliding window
+    - GET /api/leaderboard/around/{user_id}/?radius=K[&scope=team] - Entries within K ranks of a user
     - POST /api/leaderboard/ - Create a new leaderboard entry
     - GET /api/leaderboard/{id}/ - Retrieve a specific leaderboard entry
     - PUT /api/leaderboard/{id}/ - Update a specific leaderboard entry
     - DELETE /api/leaderboard/{id}/ - Delete a specific leaderboard entry
+    
+    Slices are served from the in-memory ranked index in ``ranking.py``;
+    lists and slices are cached in the versioned response cache. Window
+    rankings come from ``windows.py`` and are not cached, since they change
+    as time passes as well as on writes.
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    keyset_ordering = ('rank', 'id')
+    max_slice = 1000
+    
+    def serialize_ids(self, ids):
+        """Serialize leaderboard entries in the order of ``ids``."""
+        entries = Leaderboard.objects.in_bulk(ids)
+        return self.get_serializer([entries[pk] for pk in ids if pk in entries], many=True).data
+    
+    def list(self, request, *args, **kwargs):
+        if 'metric' in request.query_params or 'window' in request.query_params:
+            return self.windowed(request)
+        top = query_int(request, 'top', minimum=1, maximum=self.max_slice)
+        if top is None:
+            return super().list(request, *args, **kwargs)
+        team_id = query_int(request, 'team_id')
+        return self.cached_response(request, self.top_entries, top, team_id)
+    
+    def top_entries(self, request, top, team_id):
+        return Response(self.serialize_ids(leaderboard_index.top(top, team_id)))
+    
+    def windowed(self, request):
+        metric = request.query_params.get('metric', 'calories')
+        window = request.query_params.get('window', settings.LEADERBOARD_WINDOWS[0])
+        scope = request.query_params.get('scope', 'user')
+        for name, value, choices in (
+            ('metric', metric, METRICS), ('window', window, settings.LEADERBOARD_WINDOWS), ('scope', scope, SCOPES),
+        ):
+            if value not in choices:
+                raise ValidationError({name: f'Expected one of {", ".join(choices)}.'})
+        top = query_int(request, 'top', default=10, minimum=1, maximum=self.max_slice)
+        ranked = window_rankings.top(metric, window, scope, top)
+        model = Team if scope == 'team' else User
+        names = model.objects.in_bulk([key for key, _ in ranked])
+        results = []
+        for rank, (key, totals) in enumerate(ranked, start=1):
+            row = {'rank': rank, f'{scope}_id': key, 'name': getattr(names.get(key), 'name', None)}
+            if scope == 'user':
+                row['team_id'] = getattr(names.get(key), 'team_id', None)
+            row.update((f'total_{name}', value) for name, value in totals.items())
+            results.append(row)
+        return Response({'metric': metric, 'window': window, 'scope': scope, 'results': results})
+    
+    @action(detail=False, url_path=r'around/(?P<user_id>\d+)')
+    def around(self, request, user_id=None):
+        user_id = int(user_id)
+        radius = query_int(request, 'radius', default=5, minimum=0, maximum=self.max_slice)
+        within_team = request.query_params.get('scope') == 'team'
+        position = leaderboard_index.position(user_id)
+        if position is None:
+            raise NotFound(f'User {user_id} has no leaderboard entry.')
+        _, rank, team_rank = position
+        ids = leaderboard_index.around(user_id, radius, within_team=within_team)
+        return Response({
+            'user_id': user_id,
+            'rank': rank,
+            'team_rank': team_rank,
+            'results': self.serialize_ids(ids),
+        })
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for workouts.
     
     Supports:
-    - GET /api/workouts/ - List all workouts
+    - GET /api/workouts/ - List workouts, oldest first, one keyset page at a time
     - POST /api/workouts/ - Create a new workout
     - GET /api/workouts/{id}/ - Retrieve a specific workout
     - PUT /api/workouts/{id}/ - Update a specific workout
     - DELETE /api/workouts/{id}/ - Delete a specific workout
+    
+    Reads are served from the versioned response cache.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    keyset_ordering = ('created_at', 'id')
+
+
+def job_accepted(request, job):
+    """A 202 response pointing the client at ``job``."""
+    url = reverse('job-detail', args=[job.pk], request=request)
+    data = {**JobSerializer(job).data, 'url': url}
+    return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': url})
+
+
+class JobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    API endpoint for background jobs.
+    
+    Supports:
+    - GET /api/jobs/ - List jobs, newest first, one keyset page at a time
+    - GET /api/jobs/?status=pending|running|done|failed - Jobs in one state
+    - POST /api/jobs/ - Queue a job from {"kind": ..., "payload": {...}}; responds 202
+    - GET /api/jobs/{id}/ - Poll a job's status, progress and result
+    
+    Posting a job identical to one still pending returns that job instead
+    of queueing another. An ``import_activities`` payload is held to
+    ``ACTIVITY_BULK_MAX_ROWS`` rows, as on the bulk endpoint.
+    ``manage.py run_jobs`` runs the queue.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    keyset_ordering = ('-created_at', '-id')
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        job_status = self.request.query_params.get('status')
+        if self.action == 'list' and job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        kind = request.data.get('kind')
+        if kind not in HANDLERS:
+            raise ValidationError({'kind': [f'Expected one of {", ".join(sorted(HANDLERS))}.']})
+        payload = request.data.get('payload') or {}
+        if not isinstance(payload, dict):
+            raise ValidationError({'payload': ['Expected an object.']})
+        rows = payload.get('rows') if kind == 'import_activities' else None
+        max_rows = settings.ACTIVITY_BULK_MAX_ROWS
+        if isinstance(rows, list) and len(rows) > max_rows:
+            raise ValidationError({'payload': [f'At most {max_rows} activities per job.']})
+        try:
+            job, _ = enqueue(kind, **payload)
+        except TypeError as exc:
+            raise ValidationError({'payload': [str(exc)]})
+        return job_accepted(request, job)
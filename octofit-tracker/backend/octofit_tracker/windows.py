@@ -0,0 +1,266 @@
+"""
+Sliding-window rankings by calories, duration or distance.
+
+Team challenges rank users and teams by what they did over the last few
+days rather than all time. :class:`WindowRankings` keeps, for every window
+in ``LEADERBOARD_WINDOWS``, running per-user and per-team totals of every
+metric at once. Team totals follow ``User.team_id`` membership.
+
+Activities land in time buckets ``LEADERBOARD_WINDOW_BUCKET_SECONDS``
+wide, held in one ring sized for the longest window. When the clock
+enters a new bucket, each window subtracts the bucket that just left it
+from its totals. Expiry therefore touches only the users active in the
+expired bucket and never rescans activities. A window covers its span
+plus the part of the current bucket elapsed so far.
+
+The rankings live in each process. They load lazily from the activities
+collection once and follow the activity writes made in this process.
+Every ``ACTIVITY_CHANGES_POLL_SECONDS`` a query also reads the shared
+change log (changes.py). Each bucket touched by another worker's write is
+summed again from the database and swapped into the ring and the windows
+holding it, and logged team moves are applied. A bump of the ``Activity``
+version, sent after the table is replaced wholesale, causes a reload.
+"""
+import heapq
+import re
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import model_version
+from .changes import ChangeCursor
+from .models import Activity, ActivityChange, User
+
+METRICS = ('calories', 'duration', 'distance')
+SCOPES = ('user', 'team')
+
+_SPAN = re.compile(r'^(\d+)([hdw])$')
+_UNITS = {'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_window(value):
+    """Seconds in a window such as ``7d``, ``12h`` or ``2w``; ValueError when malformed."""
+    match = _SPAN.match(value or '')
+    if not match or not int(match.group(1)):
+        raise ValueError(f'Expected a window such as 7d, 12h or 2w, got {value!r}.')
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def _add(totals, key, amounts, sign):
+    current = totals.get(key)
+    if current is None:
+        current = totals[key] = [0, 0, 0.0]
+    current[0] += sign * amounts[0]
+    current[1] += sign * amounts[1]
+    current[2] = round(current[2] + sign * amounts[2], 2)
+    if not (current[0] or current[1] or current[2]):
+        del totals[key]
+
+
+class Window:
+    """Running per-user and per-team totals over the last ``buckets`` buckets."""
+    __slots__ = ('name', 'buckets', 'users', 'teams')
+
+    def __init__(self, name, buckets):
+        self.name = name
+        self.buckets = buckets
+        self.users = {}
+        self.teams = {}
+
+    def apply(self, user_id, team_id, amounts, sign):
+        _add(self.users, user_id, amounts, sign)
+        if team_id is not None:
+            _add(self.teams, team_id, amounts, sign)
+
+
+class WindowRankings:
+    """Per-user and per-team metric totals over every configured window."""
+
+    def __init__(self, windows=None, bucket_seconds=None):
+        self._windows = windows
+        self._bucket_seconds = bucket_seconds
+        self._lock = threading.RLock()
+        self._cursor = ChangeCursor()
+        self.reset()
+
+    def reset(self):
+        """Drop the loaded state; the next query reloads from the database."""
+        with self._lock:
+            self.bucket_seconds = self._bucket_seconds or settings.LEADERBOARD_WINDOW_BUCKET_SECONDS
+            self.windows = {
+                name: Window(name, -(-parse_window(name) // self.bucket_seconds))
+                for name in (self._windows or settings.LEADERBOARD_WINDOWS)
+            }
+            self.size = max(window.buckets for window in self.windows.values())
+            # Ring slot n % size holds {user_id: [calories, duration, distance]} for bucket n.
+            self.ring = [None] * self.size
+            self.head = None
+            self.user_teams = {}
+            self._loaded_at = None
+            self._version = None
+
+    def bucket(self, when):
+        return int(when.timestamp() // self.bucket_seconds)
+
+    def advance(self, head):
+        """Move the newest bucket up to ``head``, expiring what falls out of each window."""
+        if self.head is None or head - self.head >= self.size:
+            for window in self.windows.values():
+                window.users.clear()
+                window.teams.clear()
+            self.ring = [None] * self.size
+            self.head = head
+            return
+        for bucket in range(self.head + 1, head + 1):
+            for window in self.windows.values():
+                expired = self.ring[(bucket - window.buckets) % self.size]
+                if expired:
+                    for user_id, amounts in expired.items():
+                        window.apply(user_id, self.user_teams.get(user_id), amounts, -1)
+            # The longest window has just let go of this slot's old bucket.
+            self.ring[bucket % self.size] = None
+        self.head = head
+
+    def _record(self, user_id, when, amounts, sign):
+        bucket = self.bucket(when)
+        age = self.head - bucket
+        if age < 0 or age >= self.size:
+            # Future-dated or older than every window.
+            return
+        slot = bucket % self.size
+        contents = self.ring[slot]
+        if contents is None:
+            contents = self.ring[slot] = {}
+        _add(contents, user_id, amounts, sign)
+        team_id = self.user_teams.get(user_id)
+        for window in self.windows.values():
+            if age < window.buckets:
+                window.apply(user_id, team_id, amounts, sign)
+
+    def _bucket_start(self, bucket):
+        return datetime.fromtimestamp(bucket * self.bucket_seconds, tz=dt_timezone.utc)
+
+    def _rows(self, activities):
+        rows = activities.values_list('user_id', 'date', 'calories', 'duration', 'distance')
+        for user_id, date, calories, duration, distance in rows.iterator(chunk_size=2000):
+            yield user_id, date, (calories, duration, distance or 0.0)
+
+    def _load(self, now):
+        self.reset()
+        # Writes logged from here on are applied after the load.
+        self._cursor.start()
+        self._version = model_version(Activity)
+        self.advance(self.bucket(now))
+        self.user_teams = {
+            user_id: team_id
+            for user_id, team_id in User.objects.exclude(team_id=None).values_list('id', 'team_id')
+        }
+        # The start of the oldest bucket still in the ring.
+        since = self._bucket_start(self.head - self.size + 1)
+        for user_id, date, amounts in self._rows(Activity.objects.filter(date__gte=since)):
+            self._record(user_id, date, amounts, 1)
+        self._loaded_at = time.monotonic()
+
+    def _resum(self, buckets):
+        """Replace the given buckets with fresh sums from the database."""
+        buckets = sorted(bucket for bucket in buckets if 0 <= self.head - bucket < self.size)
+        if not buckets:
+            return
+        ranges = Q()
+        for bucket in buckets:
+            ranges |= Q(date__gte=self._bucket_start(bucket), date__lt=self._bucket_start(bucket + 1))
+        fresh = {bucket: {} for bucket in buckets}
+        for user_id, date, amounts in self._rows(Activity.objects.filter(ranges)):
+            _add(fresh[self.bucket(date)], user_id, amounts, 1)
+        for bucket in buckets:
+            age = self.head - bucket
+            slot = bucket % self.size
+            old = self.ring[slot] or {}
+            for window in self.windows.values():
+                if age < window.buckets:
+                    for user_id, amounts in old.items():
+                        window.apply(user_id, self.user_teams.get(user_id), amounts, -1)
+                    for user_id, amounts in fresh[bucket].items():
+                        window.apply(user_id, self.user_teams.get(user_id), amounts, 1)
+            self.ring[slot] = fresh[bucket] or None
+
+    def _sync(self):
+        """Apply the writes other workers logged since the last sync."""
+        self._loaded_at = time.monotonic()
+        changes = self._cursor.read() if model_version(Activity) == self._version else None
+        if changes is None:
+            return False
+        dirty = set()
+        for change in changes:
+            if change.op == ActivityChange.TEAM:
+                self._move_user(change.user_id, change.team_id)
+                continue
+            for date in (change.date, change.previous_date):
+                if date is not None:
+                    dirty.add(self.bucket(date))
+        self._resum(dirty)
+        return True
+
+    def _ensure_loaded(self, now):
+        if self._loaded_at is None:
+            self._load(now)
+            return
+        self.advance(self.bucket(now))
+        if time.monotonic() - self._loaded_at >= settings.ACTIVITY_CHANGES_POLL_SECONDS and not self._sync():
+            self._load(now)
+
+    def record(self, activities, sign=1):
+        """Add (or with ``sign=-1`` remove) saved activities if the rankings are loaded."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self.advance(self.bucket(timezone.now()))
+            for activity in activities:
+                self._record(
+                    activity.user_id, activity.date,
+                    (activity.calories, activity.duration, activity.distance or 0.0), sign,
+                )
+
+    def _move_user(self, user_id, team_id):
+        previous = self.user_teams.get(user_id)
+        if previous == team_id:
+            return
+        for window in self.windows.values():
+            amounts = window.users.get(user_id)
+            if amounts is not None:
+                if previous is not None:
+                    _add(window.teams, previous, amounts, -1)
+                if team_id is not None:
+                    _add(window.teams, team_id, amounts, 1)
+        if team_id is None:
+            self.user_teams.pop(user_id, None)
+        else:
+            self.user_teams[user_id] = team_id
+
+    def move_user(self, user_id, team_id):
+        """Move a user's window totals to a new team if the rankings are loaded."""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._move_user(user_id, team_id)
+
+    def top(self, metric, window, scope='user', count=10, now=None):
+        """
+        The ``count`` best users or teams by ``metric`` over ``window``.
+
+        Returns ``(id, {'calories', 'duration', 'distance'})`` pairs, ties
+        broken by id. Raises KeyError for a window that is not configured.
+        """
+        column = METRICS.index(metric)
+        with self._lock:
+            self._ensure_loaded(now or timezone.now())
+            totals = self.windows[window]
+            totals = totals.teams if scope == 'team' else totals.users
+            best = heapq.nsmallest(count, totals.items(), key=lambda item: (-item[1][column], item[0]))
+            return [(key, dict(zip(METRICS, amounts))) for key, amounts in best]
+
+
+window_rankings = WindowRankings()
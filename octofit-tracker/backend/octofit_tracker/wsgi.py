@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+# Map the snapshot, if one has been built, before the first request.
+from octofit_tracker import snapshot  # noqa: E402  (needs the app registry)
+
+snapshot.warm()
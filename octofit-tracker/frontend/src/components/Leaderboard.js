@@ -1,14 +1,20 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 
 function Leaderboard() {
   const [leaderboard, setLeaderboard] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const entriesRef = useRef([]);
 
   useEffect(() => {
+    const baseUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev`;
+    let events = null;
+    // Set on unmount, so a fetch that resolves afterwards opens no stream.
+    let cancelled = false;
+
     const fetchLeaderboard = async () => {
       try {
-        const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
+        const apiUrl = `${baseUrl}/api/leaderboard/`;
         console.log('Leaderboard - Fetching from:', apiUrl);
         
         const response = await fetch(apiUrl);
@@ -21,16 +27,61 @@ function Leaderboard() {
         
         // Handle both paginated (.results) and plain array responses
         const leaderboardData = data.results || data;
-        setLeaderboard(Array.isArray(leaderboardData) ? leaderboardData : []);
+        const entries = Array.isArray(leaderboardData) ? leaderboardData : [];
+        entriesRef.current = entries;
+        setLeaderboard(entries);
         setLoading(false);
+        return entries.length;
       } catch (err) {
         console.error('Leaderboard - Error fetching data:', err);
         setError(err.message);
         setLoading(false);
+        return 0;
+      }
+    };
+
+    // Apply pushed rank deltas instead of re-fetching the whole list.
+    // Deltas only carry ranks and totals, so someone entering the visible
+    // range triggers one fresh fetch.
+    const applyDeltas = (deltas) => {
+      const current = entriesRef.current;
+      const byUser = new Map(current.map((entry) => [entry.user_id, entry]));
+      let needsFetch = false;
+      deltas.forEach((delta) => {
+        const entry = byUser.get(delta.user_id);
+        if (delta.to === null) {
+          byUser.delete(delta.user_id);
+        } else if (entry) {
+          byUser.set(delta.user_id, { ...entry, rank: delta.to, total_calories: delta.total_calories });
+        } else if (delta.to <= current.length) {
+          needsFetch = true;
+        }
+      });
+      if (needsFetch) {
+        fetchLeaderboard();
+        return;
       }
+      const entries = [...byUser.values()].sort((a, b) => a.rank - b.rank).slice(0, current.length);
+      entriesRef.current = entries;
+      setLeaderboard(entries);
     };
 
-    fetchLeaderboard();
+    fetchLeaderboard().then((count) => {
+      if (cancelled || !count || typeof EventSource === 'undefined') {
+        return;
+      }
+      // Served by the ASGI app only; without it the list simply stays static.
+      events = new EventSource(`${baseUrl}/api/leaderboard/stream/?top=${count}`);
+      events.addEventListener('ranks', (event) => applyDeltas(JSON.parse(event.data).deltas));
+      events.addEventListener('resync', () => fetchLeaderboard());
+    });
+
+    return () => {
+      cancelled = true;
+      if (events) {
+        events.close();
+      }
+    };
   }, []);
 
   if (loading) return <div className="container mt-4"><div className="spinner-border" role="status"><span className="visually-hidden">Loading...</span></div></div>;